@@ -1,13 +1,22 @@
 from dotenv import load_dotenv
 import os
+import click
 from datetime import timedelta
 from blacklist import BLACKLIST
 from flask import Flask
 from config import Config
 from models import db
+from hashing import servico_hash
+from limitador import limitador_login
+from catalogo import catalogo
+from fila_desempenho import fila_desempenho
+from idempotencia import idempotencia
+from serializadores import ProvedorJson
+from ia import cache_analises, servico_analises
 from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Importações específicas para a IA e o BLACKLIST
 import google.generativeai as genai
@@ -18,13 +27,16 @@ import google.generativeai as genai
 load_dotenv() 
 genai.configure(api_key=os.environ.get('GEMINI_API_KEY'))
 
-# Variável GLOBAL para tokens revogados (BLACKLIST)
-
 # -------------------------------------------------------------
 # 2. INICIALIZAÇÃO DO FLASK E CONFIGS
 # -------------------------------------------------------------
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = ProvedorJson(app) # orjson quando instalado (serializadores.py)
+
+# IP real do cliente atrás do proxy reverso (usado pelo limite de login por IP)
+if app.config['PROXY_FIX_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_HOPS'], x_proto=app.config['PROXY_FIX_HOPS'])
 
 # Configurações do JWT que usam timedelta
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=1)
@@ -33,8 +45,16 @@ app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY", "fallback-secret
 
 
 jwt = JWTManager(app)
+BLACKLIST.init_app(app)
 
 db.init_app(app)
+servico_hash.init_app(app)
+limitador_login.init_app(app)
+catalogo.init_app(app)
+fila_desempenho.init_app(app)
+idempotencia.init_app(app)
+cache_analises.init_app(app)
+servico_analises.init_app(app)
 migrate = Migrate(app, db)
 CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}}, supports_credentials=True)
 
@@ -61,7 +81,71 @@ def check_if_token_is_revoked(jwt_header, jwt_payload):
     return jti in BLACKLIST 
 
 # -------------------------------------------------------------
-# 5. EXECUÇÃO
+# 5. COMANDOS DE MANUTENÇÃO (flask <comando>)
+# -------------------------------------------------------------
+@app.cli.command('sincronizar-credenciais')
+def sincronizar_credenciais():
+    # Reconstrói o índice de login (tabela credencial) a partir de admin, professor e aluno.
+    # Deve ser executado uma vez após o deploy do índice e sempre que as tabelas forem editadas fora da API.
+    from models import Credencial, MODELOS_POR_FUNCAO
+
+    Credencial.query.delete()
+    emails_vistos = set()
+    total = 0
+    for funcao, modelo in MODELOS_POR_FUNCAO.items():
+        for usuario in modelo.query.all():
+            if usuario.email in emails_vistos:
+                print(f"Aviso: email '{usuario.email}' duplicado, {funcao} {usuario.id} ignorado.")
+                continue
+            emails_vistos.add(usuario.email)
+            db.session.add(Credencial(email=usuario.email, funcao=funcao,
+                                      usuario_id=usuario.id, senha_hash=usuario.senha_hash))
+            total += 1
+    db.session.commit()
+    print(f"{total} credenciais sincronizadas.")
+
+@app.cli.command('reconstruir-progresso')
+def reconstruir_progresso_command():
+    # Reconstrói progresso_aluno_trilha a partir de desempenho_jogo.
+    # Deve ser executado uma vez após o deploy da tabela e se ela divergir do histórico de desempenhos.
+    from catalogo import catalogo
+    from progresso import reconstruir_progresso
+
+    total = reconstruir_progresso(catalogo.atual())
+    db.session.commit()
+    print(f"Progressão reconstruída para {total} pares aluno/trilha.")
+
+@app.cli.command('reconstruir-resumos')
+def reconstruir_resumos_command():
+    # Reconstrói resumo_aluno_jogo_dia e resumo_sala_jogo_dia a partir de desempenho_jogo.
+    # Deve ser executado uma vez após o deploy das tabelas e se elas divergirem do histórico de desempenhos.
+    from resumos import reconstruir_resumos
+
+    total = reconstruir_resumos()
+    db.session.commit()
+    print(f"Resumos diários reconstruídos: {total} linhas.")
+
+@app.cli.command('podar-idempotencia')
+def podar_idempotencia():
+    # Apaga as chaves de idempotência mais antigas que IDEMPOTENCY_RETENTION_HOURS (agendar no cron)
+    total = idempotencia.podar()
+    db.session.commit()
+    print(f"{total} chaves de idempotência removidas.")
+
+@app.cli.command('preencher-fatos')
+@click.option('--lote', default=5000, show_default=True, help='Tentativas lidas por lote (um commit por lote).')
+@click.option('--desde-id', default=0, show_default=True, help='Retoma a partir deste id de desempenho_jogo.')
+def preencher_fatos_command(lote, desde_id):
+    # Gera desempenho_fato a partir do JSON acertos/erros das tentativas gravadas antes da tabela existir.
+    # Pode ser interrompido e executado de novo: tentativas que já têm fatos são puladas.
+    from fatos import preencher_fatos
+
+    for ultimo_id, total_desempenhos, total_fatos in preencher_fatos(lote, desde_id):
+        print(f"... até o desempenho {ultimo_id}: {total_desempenhos} tentativas, {total_fatos} fatos.")
+    print("Fatos preenchidos.")
+
+# -------------------------------------------------------------
+# 6. EXECUÇÃO
 # -------------------------------------------------------------
 with app.app_context():
     db.create_all()
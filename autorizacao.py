@@ -0,0 +1,175 @@
+import threading
+import time
+from functools import wraps
+from flask import g, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
+from models import db, Aluno, Professor, Sala, ContadorVersao, sala_trilha_association
+
+# -------------------------------------------------------------
+# DECORATOR DE AUTORIZAÇÃO POR FUNÇÃO
+# -------------------------------------------------------------
+# @requer_funcao('aluno') substitui o bloco repetido em todas as rotas (get_jwt() + checagem da
+# 'funcao' + int(get_jwt_identity()) + Aluno/Professor.query.get). O usuário logado é carregado uma
+# única vez, já com o contexto usado nas checagens de autorização, e fica disponível em flask.g:
+#   aluno     -> g.aluno_id, g.aluno, g.sala e g.trilhas_ids (trilhas liberadas para a sala), em 1 consulta
+#   professor -> g.professor_id, g.professor e g.salas_ids (salas do professor), em 1 consulta
+#   admin     -> g.admin_id, sem consulta (as rotas de admin não usam o registro do admin)
+# g.usuario_id é preenchido para todas as funções. Rotas que só precisam do id do usuário usam
+# carregar=False e não fazem nenhuma consulta para autorização.
+#
+# ESCOPO NO TOKEN DO ALUNO: no login/refresh o token do aluno recebe a claim
+# 'escopo' = {"sala_id", "trilhas", "versao"}, em que 'versao' é o contador de versão da sala
+# (ContadorVersao 'sala:<id>'), incrementado sempre que as trilhas liberadas para a sala ou os
+# alunos dela mudam. Com carregar=False, g.sala_id e g.trilhas_ids vêm do próprio token quando a
+# versão confere com a versão atual da sala, que cada worker mantém em memória por até
+# ACL_VERSION_CACHE_SECONDS: o caminho comum de autorização não consulta o banco. Token sem escopo
+# ou desatualizado cai na consulta ao banco (e o escopo é renovado no próximo /refresh).
+
+_versoes_sala = {} # sala_id -> (versao, momento da leitura)
+_versoes_lock = threading.Lock()
+
+def _chave_sala(sala_id):
+    return f'sala:{sala_id}'
+
+def versao_sala(sala_id):
+    agora = time.monotonic()
+    cache = _versoes_sala.get(sala_id)
+    if cache is not None and agora - cache[1] < current_app.config.get('ACL_VERSION_CACHE_SECONDS', 30):
+        return cache[0]
+
+    versao = ContadorVersao.obter(_chave_sala(sala_id))
+    with _versoes_lock:
+        _versoes_sala[sala_id] = (versao, agora)
+    return versao
+
+def incrementar_versao_salas(salas_ids):
+    # Chamado pelas rotas que alteram as trilhas ou os alunos de uma sala, antes do commit
+    for sala_id in salas_ids:
+        ContadorVersao.incrementar(_chave_sala(sala_id))
+    # Este worker relê a versão na próxima requisição; os demais, quando o cache deles expirar
+    with _versoes_lock:
+        for sala_id in salas_ids:
+            _versoes_sala.pop(sala_id, None)
+
+def _sala_e_trilhas_do_aluno(aluno_id):
+    # (sala_id, trilhas_ids) do aluno numa única consulta, ou None se o aluno não existir
+    linhas = db.session.query(Aluno.sala_id, sala_trilha_association.c.trilha_id)\
+        .outerjoin(sala_trilha_association, sala_trilha_association.c.sala_id == Aluno.sala_id)\
+        .filter(Aluno.id == aluno_id)\
+        .all()
+    if not linhas:
+        return None
+    return linhas[0][0], frozenset(trilha_id for _, trilha_id in linhas if trilha_id is not None)
+
+def escopo_do_aluno(aluno_id):
+    # Claim 'escopo' gravada no token do aluno no login e no refresh
+    resultado = _sala_e_trilhas_do_aluno(aluno_id)
+    if resultado is None:
+        return None
+    sala_id, trilhas_ids = resultado
+    return {
+        "sala_id": sala_id,
+        "trilhas": sorted(trilhas_ids),
+        "versao": versao_sala(sala_id)
+    }
+
+MENSAGENS_ACESSO_NEGADO = {
+    'aluno': "Acesso negado: Apenas Alunos podem acessar esta rota.",
+    'professor': "Acesso negado: Apenas Professores podem acessar esta rota.",
+    'admin': "Acesso negado: Apenas administradores podem acessar esta rota."
+}
+
+def _carregar_aluno(aluno_id):
+    # Aluno + sala + ids das trilhas da sala numa única consulta (uma linha por trilha)
+    linhas = db.session.query(Aluno, Sala, sala_trilha_association.c.trilha_id)\
+        .outerjoin(Sala, Aluno.sala_id == Sala.id)\
+        .outerjoin(sala_trilha_association, sala_trilha_association.c.sala_id == Sala.id)\
+        .filter(Aluno.id == aluno_id)\
+        .all()
+
+    if not linhas:
+        return jsonify({"message": "Aluno não encontrado."}), 404
+
+    g.aluno, g.sala = linhas[0][0], linhas[0][1]
+    g.sala_id = g.aluno.sala_id
+    g.trilhas_ids = frozenset(trilha_id for _, _, trilha_id in linhas if trilha_id is not None)
+    return None
+
+def _carregar_professor(professor_id):
+    linhas = db.session.query(Professor, Sala.id)\
+        .outerjoin(Sala, Sala.professor_id == Professor.id)\
+        .filter(Professor.id == professor_id)\
+        .all()
+
+    if not linhas:
+        return jsonify({"message": "Professor não encontrado."}), 404
+
+    g.professor = linhas[0][0]
+    g.salas_ids = frozenset(sala_id for _, sala_id in linhas if sala_id is not None)
+    return None
+
+def _carregar_admin(admin_id):
+    return None
+
+def _escopo_aluno(aluno_id):
+    escopo = get_jwt().get('escopo')
+    if escopo and versao_sala(escopo['sala_id']) == escopo['versao']:
+        g.sala_id = escopo['sala_id']
+        g.trilhas_ids = frozenset(escopo['trilhas'])
+        return None
+
+    # Token sem escopo ou emitido antes da última mudança na sala: consulta o banco
+    resultado = _sala_e_trilhas_do_aluno(aluno_id)
+    if resultado is None:
+        return jsonify({"message": "Aluno não encontrado."}), 404
+    g.sala_id, g.trilhas_ids = resultado
+    return None
+
+CARREGADORES = {
+    'aluno': _carregar_aluno,
+    'professor': _carregar_professor,
+    'admin': _carregar_admin
+}
+
+# Contexto mínimo usado com carregar=False (aluno: sala e trilhas a partir do escopo do token)
+CARREGADORES_ESCOPO = {
+    'aluno': _escopo_aluno
+}
+
+# Atributos de g preenchidos mesmo com carregar=False
+ATRIBUTO_ID = {
+    'aluno': 'aluno_id',
+    'professor': 'professor_id',
+    'admin': 'admin_id'
+}
+
+def requer_funcao(funcao, carregar=True):
+    carregador = CARREGADORES[funcao] if carregar else CARREGADORES_ESCOPO.get(funcao)
+    atributo_id = ATRIBUTO_ID[funcao]
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # 1. VALIDAÇÃO DE FUNÇÃO
+            if get_jwt().get('funcao') != funcao:
+                return jsonify({"message": MENSAGENS_ACESSO_NEGADO[funcao]}), 403
+
+            # 2. EXTRAÇÃO DO ID DO USUÁRIO LOGADO
+            try:
+                usuario_id = int(get_jwt_identity())
+            except (TypeError, ValueError):
+                return jsonify({"message": "ID de usuário no token inválido."}), 401
+            g.usuario_id = usuario_id
+            setattr(g, atributo_id, usuario_id)
+
+            # 3. CARREGA O USUÁRIO E O CONTEXTO DE AUTORIZAÇÃO
+            if carregador is not None:
+                erro = carregador(usuario_id)
+                if erro is not None:
+                    return erro
+
+            return view(*args, **kwargs)
+
+        return jwt_required()(wrapper)
+
+    return decorator
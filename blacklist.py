@@ -1 +1,285 @@
-BLACKLIST = set()
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_monotonic = time.monotonic
+
+# -------------------------------------------------------------
+# LISTA DE TOKENS REVOGADOS (BLACKLIST)
+# -------------------------------------------------------------
+# Os JTIs revogados ficam num armazenamento compartilhado entre os processos (arquivo SQLite na
+# mesma máquina ou Redis entre máquinas) somente até o 'exp' do token; depois disso o próprio JWT
+# já é recusado e a entrada é podada. Cada processo mantém na frente um filtro de Bloom local com
+# os JTIs ativos: o caso comum ("não revogado") é respondido só pelo filtro, sem I/O. Um acerto do
+# filtro é confirmado no armazenamento (falsos positivos) e guardado num pequeno LRU.
+# Cada revogação recebe um número de sequência no armazenamento. A cada REVOCATION_SYNC_SECONDS a
+# requisição busca só as revogações com sequência maior que a última vista e as soma ao filtro atual
+# (uma consulta pelo índice, que não cresce com o total de JTIs ativos). A poda dos expirados e a
+# recriação do filtro com todos os JTIs ativos (que tira os expirados e redimensiona o filtro) rodam
+# numa thread de fundo, a cada REVOCATION_REBUILD_SECONDS ou quando o filtro passa da capacidade.
+
+class FiltroBloom:
+    BITS_POR_ITEM = 16 # com 3 hashes: ~0,5% de falsos positivos na capacidade máxima
+
+    def __init__(self, capacidade):
+        self.capacidade = max(capacidade, 1)
+        self.itens = 0
+        self.tamanho = self.capacidade * self.BITS_POR_ITEM
+        self._bits = bytearray(self.tamanho // 8 + 1)
+
+    def _posicoes(self, item):
+        # Hash duplo (Kirsch-Mitzenmacher) a partir do hash() do Python, que é cacheado nas strings
+        h = hash(item)
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        tamanho = self.tamanho
+        return h1 % tamanho, (h1 + h2) % tamanho, (h1 + 2 * h2) % tamanho
+
+    def adicionar(self, item):
+        bits = self._bits
+        for p in self._posicoes(item):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.itens += 1
+
+    def __contains__(self, item):
+        # Mesmo cálculo de _posicoes, repetido aqui porque esta checagem roda a cada requisição
+        h = hash(item)
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        tamanho = self.tamanho
+        bits = self._bits
+        p = h1 % tamanho
+        if not bits[p >> 3] & (1 << (p & 7)):
+            return False
+        p = (h1 + h2) % tamanho
+        if not bits[p >> 3] & (1 << (p & 7)):
+            return False
+        p = (h1 + 2 * h2) % tamanho
+        return bool(bits[p >> 3] & (1 << (p & 7)))
+
+class ArmazenamentoSQLite:
+    # Arquivo local em modo WAL: compartilhado pelos workers do gunicorn da mesma máquina.
+    # 'seq' (AUTOINCREMENT: nunca reaproveitado, mesmo após a poda) ordena as revogações.
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local()
+        conexao = self._conexao()
+        conexao.execute("BEGIN IMMEDIATE")
+        try:
+            colunas = {linha[1] for linha in conexao.execute("PRAGMA table_info(token_revogado)")}
+            if colunas and 'seq' not in colunas:
+                # Arquivo de uma versão anterior (sem 'seq'): recria a tabela mantendo os JTIs
+                conexao.execute("ALTER TABLE token_revogado RENAME TO token_revogado_antigo")
+                conexao.execute("DROP INDEX IF EXISTS idx_token_revogado_exp")
+            conexao.execute(
+                "CREATE TABLE IF NOT EXISTS token_revogado "
+                "(seq INTEGER PRIMARY KEY AUTOINCREMENT, jti TEXT NOT NULL UNIQUE, exp REAL NOT NULL)"
+            )
+            conexao.execute("CREATE INDEX IF NOT EXISTS idx_token_revogado_exp ON token_revogado (exp)")
+            if colunas and 'seq' not in colunas:
+                conexao.execute("INSERT INTO token_revogado (jti, exp) SELECT jti, exp FROM token_revogado_antigo")
+                conexao.execute("DROP TABLE token_revogado_antigo")
+            conexao.execute("COMMIT")
+        except Exception:
+            conexao.execute("ROLLBACK")
+            raise
+
+    def _conexao(self):
+        # sqlite3 não permite compartilhar a conexão entre threads: uma por thread
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=5, isolation_level=None)
+            conexao.execute("PRAGMA journal_mode=WAL")
+            self._local.conexao = conexao
+        return conexao
+
+    def adicionar(self, jti, exp):
+        # REPLACE apaga a linha antiga do JTI e insere outra, com sequência nova
+        self._conexao().execute("INSERT OR REPLACE INTO token_revogado (jti, exp) VALUES (?, ?)", (jti, exp))
+
+    def contem(self, jti):
+        linha = self._conexao().execute(
+            "SELECT 1 FROM token_revogado WHERE jti = ? AND exp > ?", (jti, time.time())
+        ).fetchone()
+        return linha is not None
+
+    def ativos(self):
+        # (JTIs ativos, sequência até a qual eles estão incluídos). A sequência é lida antes: uma
+        # revogação feita entre as duas consultas vem de novo no próximo novos(), sem se perder.
+        conexao = self._conexao()
+        (ultima,) = conexao.execute("SELECT COALESCE(MAX(seq), 0) FROM token_revogado").fetchone()
+        jtis = [jti for (jti,) in conexao.execute("SELECT jti FROM token_revogado WHERE exp > ?", (time.time(),))]
+        return jtis, ultima
+
+    def novos(self, desde):
+        # (JTIs revogados com sequência maior que 'desde', maior sequência vista)
+        linhas = self._conexao().execute(
+            "SELECT seq, jti FROM token_revogado WHERE seq > ? ORDER BY seq", (desde,)
+        ).fetchall()
+        return [jti for _, jti in linhas], (linhas[-1][0] if linhas else desde)
+
+    def podar(self):
+        self._conexao().execute("DELETE FROM token_revogado WHERE exp <= ?", (time.time(),))
+
+class ArmazenamentoRedis:
+    # Sorted set JTI -> exp em qualquer servidor compatível com Redis (Redis, Valkey, KeyDB...),
+    # mais um sorted set JTI -> sequência (INCR). O INCR e os dois ZADD rodam num script Lua, atômico
+    # no servidor: as sequências ficam visíveis na ordem em que foram geradas (com o INCR fora da
+    # transação, um worker podia ler N+1 antes de N existir e pular N até a próxima reconstrução).
+    SCRIPT_ADICIONAR = """
+    local seq = redis.call('INCR', KEYS[3])
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+    redis.call('ZADD', KEYS[2], seq, ARGV[1])
+    return seq
+    """
+
+    def __init__(self, url, chave='mathmagic:tokens_revogados'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("REVOCATION_BACKEND='redis' requer o pacote 'redis' (pip install redis).")
+        self._redis = redis.Redis.from_url(url)
+        self.chave = chave
+        self.chave_ordem = f'{chave}:ordem'
+        self.chave_sequencia = f'{chave}:seq'
+        self._adicionar = self._redis.register_script(self.SCRIPT_ADICIONAR)
+
+    def adicionar(self, jti, exp):
+        self._adicionar(keys=[self.chave, self.chave_ordem, self.chave_sequencia], args=[jti, exp])
+
+    def contem(self, jti):
+        exp = self._redis.zscore(self.chave, jti)
+        return exp is not None and exp > time.time()
+
+    def ativos(self):
+        ultima = int(self._redis.get(self.chave_sequencia) or 0)
+        jtis = [jti.decode() for jti in self._redis.zrangebyscore(self.chave, time.time(), '+inf')]
+        return jtis, ultima
+
+    def novos(self, desde):
+        linhas = self._redis.zrangebyscore(self.chave_ordem, f'({desde}', '+inf', withscores=True)
+        return [jti.decode() for jti, _ in linhas], (int(linhas[-1][1]) if linhas else desde)
+
+    def podar(self):
+        expirados = self._redis.zrangebyscore(self.chave, '-inf', time.time())
+        if expirados:
+            pipe = self._redis.pipeline(transaction=True)
+            pipe.zrem(self.chave, *expirados)
+            pipe.zrem(self.chave_ordem, *expirados)
+            pipe.execute()
+
+class ListaDeRevogacao:
+    def __init__(self):
+        self._armazenamento = None
+        self._bloom = FiltroBloom(1)
+        self._revogados = OrderedDict() # LRU dos JTIs confirmados como revogados
+        self._lock = threading.Lock()              # troca do filtro / sincronização incremental
+        self._lock_reconstrucao = threading.Lock() # uma reconstrução por vez
+        self._lock_lru = threading.Lock()
+        self._sequencia = 0                        # última sequência somada ao filtro
+        self._sincronizado_em = float('-inf')
+        self._reconstruido_em = float('-inf')
+        self.intervalo_sincronizacao = 2
+        self.intervalo_reconstrucao = 300
+        self.tamanho_lru = 1024
+
+    def init_app(self, app):
+        config = app.config
+        backend = config.get('REVOCATION_BACKEND', 'sqlite')
+
+        if backend == 'sqlite':
+            caminho = config.get('REVOCATION_SQLITE_PATH')
+            if not caminho:
+                os.makedirs(app.instance_path, exist_ok=True)
+                caminho = os.path.join(app.instance_path, 'tokens_revogados.db')
+            self._armazenamento = ArmazenamentoSQLite(caminho)
+        elif backend == 'redis':
+            self._armazenamento = ArmazenamentoRedis(config['REVOCATION_REDIS_URL'])
+        else:
+            raise ValueError(f"REVOCATION_BACKEND inválido: '{backend}' (use 'sqlite' ou 'redis').")
+
+        self.intervalo_sincronizacao = config.get('REVOCATION_SYNC_SECONDS', 2)
+        self.intervalo_reconstrucao = config.get('REVOCATION_REBUILD_SECONDS', 300)
+        self.tamanho_lru = config.get('REVOCATION_LRU_SIZE', 1024)
+        app.extensions['blacklist'] = self
+        self._reconstruir() # na inicialização, fora das requisições
+
+    def _sincronizar(self):
+        # Soma ao filtro as revogações feitas por todos os processos desde a última sincronização.
+        # Se outra thread já está sincronizando, segue com o filtro atual em vez de esperar.
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            novos, self._sequencia = self._armazenamento.novos(self._sequencia)
+            bloom = self._bloom
+            for jti in novos:
+                bloom.adicionar(jti)
+            self._sincronizado_em = _monotonic()
+        finally:
+            self._lock.release()
+
+        if (_monotonic() - self._reconstruido_em >= self.intervalo_reconstrucao
+                or self._bloom.itens > self._bloom.capacidade):
+            self._agendar_reconstrucao()
+
+    def _agendar_reconstrucao(self):
+        if self._lock_reconstrucao.locked():
+            return
+        threading.Thread(target=self._reconstruir, name='blacklist-reconstrucao', daemon=True).start()
+
+    def _reconstruir(self):
+        # Poda os expirados e recria o filtro com todos os JTIs ativos (thread de fundo)
+        if not self._lock_reconstrucao.acquire(blocking=False):
+            return
+        try:
+            self._armazenamento.podar()
+            ativos, sequencia = self._armazenamento.ativos()
+            bloom = FiltroBloom(max(2 * len(ativos), 4096))
+            for jti in ativos:
+                bloom.adicionar(jti)
+
+            with self._lock:
+                # Revogações feitas durante a recarga: as gravadas depois da leitura de 'ativos'
+                # e as locais (add() pode ter marcado só o filtro antigo)
+                novos, sequencia = self._armazenamento.novos(sequencia)
+                for jti in novos:
+                    bloom.adicionar(jti)
+                for jti in list(self._revogados):
+                    bloom.adicionar(jti)
+                self._bloom = bloom
+                self._sequencia = max(self._sequencia, sequencia)
+                self._sincronizado_em = self._reconstruido_em = _monotonic()
+        finally:
+            self._lock_reconstrucao.release()
+
+    def add(self, jti, exp):
+        self._armazenamento.adicionar(jti, exp)
+        self._bloom.adicionar(jti)
+        self._lembrar(jti)
+
+    def _lembrar(self, jti):
+        with self._lock_lru:
+            self._revogados[jti] = True
+            self._revogados.move_to_end(jti)
+            while len(self._revogados) > self.tamanho_lru:
+                self._revogados.popitem(last=False)
+
+    def __contains__(self, jti):
+        if _monotonic() - self._sincronizado_em >= self.intervalo_sincronizacao:
+            self._sincronizar()
+
+        # Caminho comum: o filtro garante que o JTI nunca foi revogado
+        if jti not in self._bloom:
+            return False
+
+        if jti in self._revogados:
+            return True
+
+        revogado = self._armazenamento.contem(jti)
+        if revogado:
+            self._lembrar(jti)
+        return revogado
+
+BLACKLIST = ListaDeRevogacao()
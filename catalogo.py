@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from models import db, Trilha, Jogo, ContadorVersao
+
+# -------------------------------------------------------------
+# CATÁLOGO DE TRILHAS E JOGOS EM MEMÓRIA
+# -------------------------------------------------------------
+# O catálogo (trilhas e jogos) só muda pelas rotas de admin, mas é lido em quase toda requisição
+# de aluno e professor. Cada worker mantém em memória uma "foto" imutável do catálogo, já ordenada
+# e com os dicionários de resposta prontos, identificada pela versão do ContadorVersao 'catalogo'.
+# As rotas que alteram trilhas/jogos chamam catalogo.invalidar() antes do commit (incrementa a
+# versão na mesma transação) e catalogo.recarregar() depois dele. Os outros workers comparam a
+# versão do banco com a da foto no máximo a cada CATALOG_VERSION_CHECK_SECONDS e remontam a foto
+# quando ela muda. A troca é uma única atribuição: cada requisição enxerga uma foto inteira.
+#
+# Os dicionários da foto são compartilhados entre as requisições: quem precisar alterar um deles
+# (ex.: acrescentar 'status' no mapa de progressão) deve copiá-lo antes com dict(...).
+
+logger = logging.getLogger(__name__)
+
+CHAVE_VERSAO = 'catalogo'
+
+class FotoCatalogo:
+    def __init__(self, versao, trilhas, jogos):
+        self.versao = versao
+
+        # Jogos: id -> dict (mesmo formato de Jogo.to_dict()), por trilha em ordem de id e com 'trilha_nome'
+        nomes_trilhas = {t['id']: t['nome'] for t in trilhas}
+        self.jogos = {}
+        jogos_por_trilha = {t['id']: [] for t in trilhas}
+        for jogo in jogos:
+            self.jogos[jogo['id']] = jogo
+            jogos_por_trilha.setdefault(jogo['trilha_id'], []).append(jogo)
+        self.lista_jogos = tuple(jogos)
+        self.jogos_por_trilha = {trilha_id: tuple(lista) for trilha_id, lista in jogos_por_trilha.items()}
+        self.lista_jogos_com_trilha = tuple(
+            dict(jogo, trilha_nome=nomes_trilhas.get(jogo['trilha_id'])) for jogo in jogos
+        )
+
+        # Trilhas: id -> dict (Trilha.to_dict()), e a versão com a lista de jogos usada em /aluno/me
+        self.trilhas = {t['id']: t for t in trilhas}
+        self.lista_trilhas = tuple(trilhas)
+        self.trilhas_com_jogos = {
+            t['id']: dict(t, jogos=list(self.jogos_por_trilha[t['id']])) for t in trilhas
+        }
+
+    def trilhas_de(self, trilhas_ids):
+        # Trilhas (em ordem de id) cujos ids estão em trilhas_ids, ignorando ids fora do catálogo
+        return [t for t in self.lista_trilhas if t['id'] in trilhas_ids]
+
+    def jogos_da_trilha(self, trilha_id):
+        return self.jogos_por_trilha.get(trilha_id, ())
+
+class CatalogoEmMemoria:
+    def __init__(self):
+        self._foto = None
+        self._verificado_em = float('-inf')
+        self._lock = threading.Lock()
+        self.intervalo_verificacao = 5
+
+    def init_app(self, app):
+        self.intervalo_verificacao = app.config.get('CATALOG_VERSION_CHECK_SECONDS', 5)
+        app.extensions['catalogo'] = self
+
+    def _montar(self):
+        # A versão é lida ANTES dos dados: se o catálogo mudar no meio da leitura, a foto fica
+        # com a versão antiga e é remontada na próxima verificação (nunca o contrário)
+        versao = ContadorVersao.obter(CHAVE_VERSAO)
+        trilhas = [
+            {'id': id, 'nome': nome, 'descricao': descricao}
+            for id, nome, descricao in db.session.query(Trilha.id, Trilha.nome, Trilha.descricao).order_by(Trilha.id)
+        ]
+        jogos = [
+            {'id': id, 'nome': nome, 'descricao': descricao, 'trilha_id': trilha_id}
+            for id, nome, descricao, trilha_id in db.session.query(
+                Jogo.id, Jogo.nome, Jogo.descricao, Jogo.trilha_id
+            ).order_by(Jogo.id)
+        ]
+        return FotoCatalogo(versao, trilhas, jogos)
+
+    def atual(self):
+        foto = self._foto
+        agora = time.monotonic()
+        if foto is not None and agora - self._verificado_em < self.intervalo_verificacao:
+            return foto
+
+        with self._lock:
+            # Outra thread pode ter verificado/remontado enquanto esta esperava o lock
+            foto = self._foto
+            if foto is not None and agora - self._verificado_em < self.intervalo_verificacao:
+                return foto
+            if foto is None or ContadorVersao.obter(CHAVE_VERSAO) != foto.versao:
+                foto = self._foto = self._montar()
+            self._verificado_em = time.monotonic()
+            return foto
+
+    def invalidar(self):
+        # Chamado pelas rotas de admin antes do commit: a nova versão vale junto com a alteração
+        ContadorVersao.incrementar(CHAVE_VERSAO)
+
+    def recarregar(self):
+        # Chamado após o commit: este worker passa a usar o catálogo novo imediatamente.
+        # Uma falha aqui não pode virar erro da rota (a alteração já foi gravada): a foto atual fica
+        # marcada como não verificada e a próxima leitura compara a versão (já incrementada por
+        # invalidar()) e remonta o catálogo.
+        with self._lock:
+            try:
+                self._foto = self._montar()
+                self._verificado_em = time.monotonic()
+            except Exception:
+                db.session.rollback()
+                self._verificado_em = float('-inf')
+                logger.exception("Falha ao recarregar o catálogo após uma alteração; ele será remontado na próxima leitura.")
+        return self._foto
+
+catalogo = CatalogoEmMemoria()
@@ -0,0 +1,125 @@
+from datetime import datetime, timezone
+from models import db, DesempenhoJogo
+from progresso import atualizar_progresso
+from fatos import inserir_fatos
+from resumos import atualizar_resumos
+
+# -------------------------------------------------------------
+# GRAVAÇÃO DE TENTATIVAS (DESEMPENHO DOS JOGOS)
+# -------------------------------------------------------------
+# Validação e gravação compartilhadas pelas rotas de desempenho do aluno (uma tentativa ou lote).
+# A autorização usa só o escopo já carregado pelo @requer_funcao (sala e trilhas do aluno) e o
+# catálogo em memória: validar uma tentativa não consulta o banco.
+# Nenhuma função aqui faz commit: a rota grava o desempenho, os fatos, os resumos diários e a
+# progressão na mesma transação.
+
+def _data_hora(valor, agora):
+    # 'data_hora' opcional enviada pelo jogo (tentativas feitas offline), em ISO 8601.
+    # Gravada em UTC sem fuso, como o default de DesempenhoJogo; datas no futuro viram "agora".
+    if valor is None:
+        return agora
+    data_hora = datetime.fromisoformat(valor)
+    if data_hora.tzinfo is not None:
+        data_hora = data_hora.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(data_hora, agora)
+
+def _id_valido(valor):
+    # bool é subclasse de int no Python: true/false no JSON não são ids
+    return isinstance(valor, int) and not isinstance(valor, bool) and valor > 0
+
+def validar_tentativa(dados, trilhas_ids, foto, agora=None):
+    # Retorna (tentativa, None) com os campos prontos para gravar, ou (None, (mensagem, código HTTP))
+    if not isinstance(dados, dict):
+        return None, ("Tentativa inválida: cada item deve ser um objeto.", 400)
+
+    jogo_id = dados.get('jogo_id')
+    trilha_id = dados.get('trilha_id')
+    passou = dados.get('passou')
+    acertos = dados.get('acertos', [])
+    erros = dados.get('erros', [])
+
+    # 1. Validação dos dados: IDs inteiros, 'passou' booleano (a string "false" não pode contar como
+    # aprovação), acertos e erros como listas
+    if not (_id_valido(jogo_id) and _id_valido(trilha_id) and isinstance(passou, bool)
+            and isinstance(acertos, list) and isinstance(erros, list)):
+        return None, ("Dados incompletos ou formatos inválidos. Verifique jogo e trilha (ids inteiros), "
+                      "resultado (true/false) e se acertos/erros são listas.", 400)
+
+    try:
+        data_hora = _data_hora(dados.get('data_hora'), agora or datetime.utcnow())
+    except (TypeError, ValueError):
+        return None, ("Formato de data_hora inválido. Use ISO 8601 (ex.: 2024-05-10T14:30:00).", 400)
+
+    # 2. Autorização: a trilha precisa ser da sala do aluno
+    if trilha_id not in trilhas_ids:
+        return None, ("Trilha não pertence à sua sala. Desempenho não pode ser salvo.", 403)
+
+    # 3. Jogo e trilha existem no catálogo
+    if jogo_id not in foto.jogos or trilha_id not in foto.trilhas:
+        return None, ("Jogo ou trilha não encontrados.", 404)
+
+    return {
+        'jogo_id': jogo_id,
+        'trilha_id': trilha_id,
+        'passou': passou,
+        'acertos': acertos,
+        'erros': erros,
+        'data_hora': data_hora
+    }, None
+
+def novo_desempenho(aluno_id, sala_id, tentativa, foto):
+    # Uma tentativa pelo ORM (a rota devolve o registro criado, com id) + fatos + resumos + progressão
+    desempenho = DesempenhoJogo(aluno_id=aluno_id, sala_id=sala_id, **tentativa)
+    db.session.add(desempenho)
+    db.session.flush()
+    linha = dict(tentativa, id=desempenho.id, aluno_id=aluno_id, sala_id=sala_id)
+    inserir_fatos([linha])
+    atualizar_resumos([linha])
+    atualizar_progresso(aluno_id, [tentativa], foto)
+    return desempenho
+
+COLUNAS_DESEMPENHO = ('aluno_id', 'sala_id', 'jogo_id', 'trilha_id', 'passou', 'acertos', 'erros', 'data_hora')
+
+def inserir_desempenhos(linhas, tamanho_lote=500):
+    # INSERT de várias linhas em desempenho_jogo, sem objetos do ORM; devolve os ids na ordem das linhas
+    # (usados pelos fatos). Bancos com RETURNING em lote (SQLite, PostgreSQL, MariaDB) devolvem os
+    # ids direto. No MySQL cada lote é um único INSERT ... VALUES (...), (...): o InnoDB reserva ids
+    # consecutivos para um INSERT com número de linhas conhecido, a partir do LAST_INSERT_ID().
+    ids = []
+    for inicio in range(0, len(linhas), tamanho_lote):
+        lote = [{coluna: linha[coluna] for coluna in COLUNAS_DESEMPENHO} for linha in linhas[inicio:inicio + tamanho_lote]]
+        if db.session.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+            resultado = db.session.execute(
+                db.insert(DesempenhoJogo).returning(DesempenhoJogo.id, sort_by_parameter_order=True), lote
+            )
+            ids.extend(resultado.scalars())
+        else:
+            primeiro_id = db.session.execute(db.insert(DesempenhoJogo).values(lote)).lastrowid
+            ids.extend(range(primeiro_id, primeiro_id + len(lote)))
+    return ids
+
+def inserir_em_lote(aluno_id, sala_id, tentativas, foto):
+    # Várias tentativas do mesmo aluno: INSERTs de várias linhas + fatos + resumos + progressão de todas as trilhas
+    if not tentativas:
+        return
+    linhas = [dict(tentativa, aluno_id=aluno_id, sala_id=sala_id) for tentativa in tentativas]
+    for linha, desempenho_id in zip(linhas, inserir_desempenhos(linhas)):
+        linha['id'] = desempenho_id
+    inserir_fatos(linhas)
+    atualizar_resumos(linhas)
+    atualizar_progresso(aluno_id, tentativas, foto)
+
+def tentativa_to_dict(entrada):
+    # Mesmo formato de DesempenhoJogo.to_dict() a partir de um dict (linha lida só com as colunas,
+    # ou tentativa ainda não gravada, sem id)
+    return {
+        'id': entrada.get('id'),
+        'aluno_id': entrada['aluno_id'],
+        'sala_id': entrada['sala_id'],
+        'jogo_id': entrada['jogo_id'],
+        'trilha_id': entrada['trilha_id'],
+        'data_hora': entrada['data_hora'].isoformat(),
+        'passou': entrada['passou'],
+        'acertos': entrada['acertos'],
+        'erros': entrada['erros']
+    }
@@ -0,0 +1,125 @@
+import re
+import numpy as np
+from models import db, DesempenhoJogo, DesempenhoFato
+
+# -------------------------------------------------------------
+# FATOS DE MULTIPLICAÇÃO (desempenho_fato)
+# -------------------------------------------------------------
+# Os jogos enviam acertos/erros como listas de textos no formato "AxB" (ex.: "3x4"). Cada texto
+# reconhecido vira uma linha em desempenho_fato (fator_a, fator_b, correto), gravada junto com a
+# tentativa; textos em outro formato continuam só no JSON de DesempenhoJogo.
+# O comando 'flask preencher-fatos' gera as linhas das tentativas gravadas antes desta tabela.
+
+_FORMATO_FATO = re.compile(r'^\s*(\d{1,4})\s*[xX×*]\s*(\d{1,4})\b')
+
+def interpretar_fato(texto):
+    # "3x4" -> (3, 4); None se o texto não estiver no formato AxB
+    if not isinstance(texto, str):
+        return None
+    encontrado = _FORMATO_FATO.match(texto)
+    if not encontrado:
+        return None
+    return int(encontrado.group(1)), int(encontrado.group(2))
+
+def linhas_de_fatos(desempenho_id, aluno_id, sala_id, trilha_id, jogo_id, acertos, erros):
+    linhas = []
+    for textos, correto in ((acertos, True), (erros, False)):
+        for texto in textos or ():
+            fato = interpretar_fato(texto)
+            if fato is not None:
+                linhas.append({
+                    'desempenho_id': desempenho_id,
+                    'aluno_id': aluno_id,
+                    'sala_id': sala_id,
+                    'trilha_id': trilha_id,
+                    'jogo_id': jogo_id,
+                    'fator_a': fato[0],
+                    'fator_b': fato[1],
+                    'correto': correto
+                })
+    return linhas
+
+def inserir_fatos(desempenhos):
+    # desempenhos: dicts com id, aluno_id, sala_id, trilha_id, jogo_id, acertos e erros.
+    # Um único INSERT executemany para todos os fatos; o commit fica com quem chamou.
+    linhas = []
+    for d in desempenhos:
+        linhas.extend(linhas_de_fatos(d['id'], d['aluno_id'], d['sala_id'], d['trilha_id'], d['jogo_id'],
+                                      d.get('acertos'), d.get('erros')))
+    if linhas:
+        db.session.execute(db.insert(DesempenhoFato), linhas)
+    return len(linhas)
+
+def fato_to_str(fator_a, fator_b):
+    return f'{fator_a}x{fator_b}'
+
+def agregar_fatos(*filtros):
+    # [(fator_a, fator_b, total, acertos)] agregados no banco, com filtros sobre DesempenhoFato
+    return db.session.query(
+        DesempenhoFato.fator_a,
+        DesempenhoFato.fator_b,
+        db.func.count(),
+        db.func.sum(db.case((DesempenhoFato.correto, 1), else_=0))
+    ).filter(*filtros)\
+     .group_by(DesempenhoFato.fator_a, DesempenhoFato.fator_b)\
+     .all()
+
+def matriz_de_fatos(alunos_ids, *filtros):
+    # Matriz alunos × fatos para o mapa de calor da sala. Uma consulta agrupada por (aluno, fator_a,
+    # fator_b) — no máximo alunos × fatos linhas, qualquer que seja o número de tentativas — e as
+    # matrizes montadas com NumPy, sem laço em Python por célula.
+    # Retorna (fatos [(fator_a, fator_b)] em ordem, tentativas, acertos): matrizes int de
+    # len(alunos_ids) × len(fatos), na ordem de alunos_ids.
+    linhas = db.session.query(
+        DesempenhoFato.aluno_id,
+        DesempenhoFato.fator_a,
+        DesempenhoFato.fator_b,
+        db.func.count(),
+        db.func.sum(db.case((DesempenhoFato.correto, 1), else_=0))
+    ).filter(DesempenhoFato.aluno_id.in_(alunos_ids), *filtros)\
+     .group_by(DesempenhoFato.aluno_id, DesempenhoFato.fator_a, DesempenhoFato.fator_b)\
+     .all()
+
+    alunos = np.asarray(alunos_ids, dtype=np.int64)
+    if not linhas:
+        vazia = np.zeros((len(alunos), 0), dtype=np.int64)
+        return [], vazia, vazia.copy()
+
+    dados = np.array([tuple(linha) for linha in linhas], dtype=np.int64) # (aluno, a, b, total, acertos)
+    ordem = np.argsort(alunos)
+    linha_do_aluno = ordem[np.searchsorted(alunos, dados[:, 0], sorter=ordem)]
+    # Colunas: fatos distintos em ordem (fator_a, fator_b), pela chave a * 2^16 + b
+    chaves, coluna_do_fato = np.unique((dados[:, 1] << 16) + dados[:, 2], return_inverse=True)
+
+    tentativas = np.zeros((len(alunos), len(chaves)), dtype=np.int64)
+    acertos = np.zeros_like(tentativas)
+    tentativas[linha_do_aluno, coluna_do_fato] = dados[:, 3]
+    acertos[linha_do_aluno, coluna_do_fato] = dados[:, 4]
+
+    fatos = [(int(chave >> 16), int(chave & 0xFFFF)) for chave in chaves]
+    return fatos, tentativas, acertos
+
+def preencher_fatos(tamanho_lote=5000, desde_id=0):
+    # Gera os fatos das tentativas que ainda não têm nenhum, em lotes por faixa de id (um commit por
+    # lote: o comando pode ser interrompido e executado de novo). Lê só as colunas necessárias.
+    ultimo_id = desde_id
+    total_desempenhos = total_fatos = 0
+    while True:
+        sem_fatos = ~db.session.query(DesempenhoFato.id)\
+                               .filter(DesempenhoFato.desempenho_id == DesempenhoJogo.id)\
+                               .exists()
+        lote = db.session.query(
+            DesempenhoJogo.id, DesempenhoJogo.aluno_id, DesempenhoJogo.sala_id, DesempenhoJogo.trilha_id,
+            DesempenhoJogo.jogo_id, DesempenhoJogo.acertos, DesempenhoJogo.erros
+        ).filter(DesempenhoJogo.id > ultimo_id, sem_fatos)\
+         .order_by(DesempenhoJogo.id)\
+         .limit(tamanho_lote)\
+         .all()
+        if not lote:
+            break
+
+        total_fatos += inserir_fatos(linha._asdict() for linha in lote)
+        db.session.commit()
+        total_desempenhos += len(lote)
+        ultimo_id = lote[-1].id
+        yield ultimo_id, total_desempenhos, total_fatos
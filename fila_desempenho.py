@@ -0,0 +1,378 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError, DataError
+from models import db
+from catalogo import catalogo
+from progresso import atualizar_progresso
+from idempotencia import idempotencia
+from desempenho import inserir_desempenhos
+from fatos import inserir_fatos
+from resumos import atualizar_resumos
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------
+# ESCRITA ADIADA DOS DESEMPENHOS (WRITE-BEHIND)
+# -------------------------------------------------------------
+# Opcional (DESEMPENHO_WRITE_BEHIND = True). As rotas de desempenho validam a tentativa, anexam
+# uma linha JSON a um journal local (um arquivo por processo, gravado com fsync antes da resposta)
+# e respondem 202. Uma thread de fundo "drena" o journal a cada DESEMPENHO_DRAIN_INTERVAL_SECONDS:
+# o arquivo atual é rotacionado para '<...>.drenando' e gravado em desempenho_jogo com INSERTs de
+# várias linhas + a progressão dos alunos, numa única transação; só depois do commit o arquivo é
+# apagado. Assim nenhuma tentativa aceita se perde:
+#   - ao iniciar, arquivos deixados por processos que morreram (pid inexistente) são assumidos
+#     por este processo (rename atômico) e gravados;
+#   - ao encerrar (atexit), a thread para e o que restou no journal é gravado na hora.
+# A entrega é "pelo menos uma vez": se o processo morrer entre o commit e a remoção do arquivo,
+# as tentativas daquele arquivo são gravadas de novo na próxima inicialização.
+# Se o banco estiver fora do ar (conexão perdida, lock wait timeout...), o '.drenando' fica onde está
+# e é gravado no próximo ciclo. Só as tentativas que o banco recusa (IntegrityError/DataError, ex.:
+# jogo apagado nesse meio tempo) vão para '<...>.rejeitados', para não travar o journal.
+#
+# Tentativas ainda não gravadas continuam visíveis para o mapa de progressão do próprio aluno:
+# as deste processo ficam em memória e as dos outros processos da máquina são lidas dos arquivos
+# deles (que, drenados a cada fração de segundo, ficam pequenos). Com várias máquinas, cada uma
+# tem seu journal: a visibilidade imediata vale para as requisições atendidas na mesma máquina.
+
+PREFIXO = 'desempenho-'
+
+def _pid_do_arquivo(caminho):
+    # 'desempenho-<pid>.jsonl' ou 'desempenho-<pid>-<uuid>.drenando'
+    nome = os.path.basename(caminho)[len(PREFIXO):]
+    try:
+        return int(nome.split('.', 1)[0].split('-', 1)[0])
+    except ValueError:
+        return None
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _serializar(entrada):
+    return json.dumps(dict(entrada, data_hora=entrada['data_hora'].isoformat()), ensure_ascii=False)
+
+def _falha_transitoria(erro):
+    # Erros do banco que não dependem da tentativa: gravar de novo mais tarde pode dar certo
+    return isinstance(erro, SQLAlchemyError) and not isinstance(erro, (IntegrityError, DataError))
+
+def _primeiro_envio_por_chave(entradas):
+    # Dois envios com a mesma Idempotency-Key atendidos ao mesmo tempo (nenhum viu a resposta do
+    # outro) chegam ambos ao journal: só o primeiro é gravado. As linhas de um envio são contíguas
+    # e a primeira delas leva a resposta, que marca o início do envio
+    chaves, mantidas, descartando = set(), [], False
+    for entrada in entradas:
+        if not entrada.get('idempotencia'):
+            mantidas.append(entrada)
+            continue
+        if 'resposta' in entrada:
+            chave = (entrada['aluno_id'], entrada['idempotencia'])
+            descartando = chave in chaves
+            chaves.add(chave)
+        if not descartando:
+            mantidas.append(entrada)
+    return mantidas
+
+def _desserializar(linha):
+    entrada = json.loads(linha)
+    entrada['data_hora'] = datetime.fromisoformat(entrada['data_hora'])
+    return entrada
+
+class FilaDesempenho:
+    def __init__(self):
+        self.habilitada = False
+        self.app = None
+        self.diretorio = None
+        self.intervalo = 0.5
+        self.tamanho_lote = 500
+        self.fsync = True
+        self._lock = threading.Lock()       # escrita no journal, rotação e pendentes em memória
+        self._lock_dreno = threading.Lock() # um dreno por vez (thread de fundo ou encerramento)
+        self._pid = None
+        self._fd = None
+        self._pendentes = {}                # aluno_id -> tentativas ainda não gravadas no banco
+        self._thread = None
+        self._parar = threading.Event()
+
+    def init_app(self, app):
+        config = app.config
+        self.habilitada = config.get('DESEMPENHO_WRITE_BEHIND', False)
+        app.extensions['fila_desempenho'] = self
+        if not self.habilitada:
+            return
+
+        self.app = app
+        self.diretorio = config.get('DESEMPENHO_JOURNAL_DIR') or os.path.join(app.instance_path, 'journal_desempenho')
+        os.makedirs(self.diretorio, exist_ok=True)
+        self.intervalo = config.get('DESEMPENHO_DRAIN_INTERVAL_SECONDS', 0.5)
+        self.tamanho_lote = config.get('DESEMPENHO_DRAIN_BATCH', 500)
+        self.fsync = config.get('DESEMPENHO_JOURNAL_FSYNC', True)
+        atexit.register(self.encerrar)
+        with self._lock:
+            self._garantir_processo()
+
+    # ---------- processo / thread de fundo ----------
+
+    def _arquivo_ativo(self):
+        return os.path.join(self.diretorio, f'{PREFIXO}{self._pid}.jsonl')
+
+    def _garantir_processo(self):
+        # Chamado com self._lock. Após um fork (workers do gunicorn) o filho não herda a thread:
+        # começa com journal, pendentes e thread próprios.
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        self._pid = pid
+        self._fd = None
+        self._pendentes = {}
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._executar, name='fila-desempenho', daemon=True)
+        self._thread.start()
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.drenar()
+            except Exception:
+                logger.exception("Erro ao drenar o journal de desempenhos; nova tentativa no próximo ciclo.")
+
+    def encerrar(self):
+        if not self.habilitada or self._pid != os.getpid():
+            return
+        self._parar.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=10)
+        try:
+            self.drenar()
+        except Exception:
+            logger.exception("Erro ao drenar o journal de desempenhos no encerramento; ele será gravado na próxima inicialização.")
+
+    # ---------- escrita (rotas) ----------
+
+    def enfileirar(self, aluno_id, sala_id, tentativas, chave_idempotencia=None, resposta=None):
+        # Com 'Idempotency-Key', todas as linhas levam a chave e a primeira leva a resposta dada ao
+        # jogo: o dreno grava a chave junto com as tentativas e ignora as que já foram gravadas
+        entradas = [dict(tentativa, aluno_id=aluno_id, sala_id=sala_id, chave=uuid.uuid4().hex) for tentativa in tentativas]
+        if chave_idempotencia:
+            if not entradas:
+                # Lote sem tentativas válidas: uma linha só com a chave, para o reenvio repetir a resposta
+                entradas.append({'aluno_id': aluno_id, 'sala_id': sala_id, 'chave': uuid.uuid4().hex,
+                                 'data_hora': datetime.utcnow(), 'somente_chave': True})
+            for entrada in entradas:
+                entrada['idempotencia'] = chave_idempotencia
+            entradas[0]['resposta'] = resposta
+        dados = ''.join(_serializar(entrada) + '\n' for entrada in entradas).encode('utf-8')
+
+        with self._lock:
+            self._garantir_processo()
+            if self._fd is None:
+                self._fd = os.open(self._arquivo_ativo(), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            os.write(self._fd, dados)
+            if self.fsync:
+                os.fsync(self._fd)
+            self._pendentes.setdefault(aluno_id, []).extend(entradas)
+        return entradas
+
+    # ---------- leitura das tentativas pendentes ----------
+
+    def pendentes_do_aluno(self, aluno_id):
+        if not self.habilitada:
+            return []
+        with self._lock:
+            self._garantir_processo()
+            pendentes = list(self._pendentes.get(aluno_id, ()))
+
+        # Journals dos outros processos desta máquina
+        for caminho in glob.glob(os.path.join(self.diretorio, f'{PREFIXO}*')):
+            if _pid_do_arquivo(caminho) == self._pid or caminho.endswith('.rejeitados'):
+                continue
+            try:
+                with open(caminho, encoding='utf-8') as arquivo:
+                    for linha in arquivo:
+                        if f'"aluno_id": {aluno_id},' not in linha:
+                            continue
+                        try:
+                            entrada = _desserializar(linha)
+                        except ValueError:
+                            continue # linha incompleta (escrita em andamento)
+                        if entrada['aluno_id'] == aluno_id:
+                            pendentes.append(entrada)
+            except FileNotFoundError:
+                continue # drenado e apagado pelo dono enquanto líamos
+        return pendentes
+
+    def concluidos_pendentes(self, aluno_id, trilha_id):
+        return {
+            entrada['jogo_id'] for entrada in self.pendentes_do_aluno(aluno_id)
+            if not entrada.get('somente_chave') and entrada['trilha_id'] == trilha_id and entrada['passou']
+        }
+
+    def resposta_pendente(self, aluno_id, chave_idempotencia):
+        # (corpo, status) de um envio com esta Idempotency-Key que ainda está no journal, ou None
+        for entrada in self.pendentes_do_aluno(aluno_id):
+            if entrada.get('idempotencia') == chave_idempotencia and entrada.get('resposta'):
+                corpo, status = entrada['resposta']
+                return corpo, status
+        return None
+
+    # ---------- dreno (thread de fundo) ----------
+
+    def _nome_drenando(self):
+        # Único mesmo entre processos: um worker novo pode receber o pid de um que morreu (containers)
+        # e não pode sobrescrever o '.drenando' órfão que ele deixou
+        return os.path.join(self.diretorio, f'{PREFIXO}{self._pid}-{uuid.uuid4().hex}.drenando')
+
+    def _rotacionar(self):
+        with self._lock:
+            if self._fd is None:
+                return
+            os.close(self._fd)
+            self._fd = None
+            os.rename(self._arquivo_ativo(), self._nome_drenando())
+
+    def _assumir_orfaos(self):
+        # Arquivos de processos que não existem mais (queda, deploy) passam para este processo
+        for caminho in glob.glob(os.path.join(self.diretorio, f'{PREFIXO}*')):
+            pid = _pid_do_arquivo(caminho)
+            if pid is None or pid == self._pid or caminho.endswith('.rejeitados') or _processo_vivo(pid):
+                continue
+            try:
+                os.rename(caminho, self._nome_drenando())
+                logger.warning("Journal de desempenhos órfão %s assumido pelo processo %s.", caminho, self._pid)
+            except FileNotFoundError:
+                continue # outro processo assumiu primeiro
+
+    def drenar(self):
+        if not self.habilitada:
+            return 0
+        with self._lock_dreno:
+            self._rotacionar()
+            self._assumir_orfaos()
+            total = 0
+            padrao = os.path.join(self.diretorio, f'{PREFIXO}{self._pid}-*.drenando')
+            for caminho in sorted(glob.glob(padrao), key=os.path.getmtime):
+                total += self._gravar_arquivo(caminho)
+            return total
+
+    def _ler(self, caminho):
+        entradas = []
+        with open(caminho, encoding='utf-8') as arquivo:
+            for numero, linha in enumerate(arquivo, 1):
+                if not linha.strip():
+                    continue
+                try:
+                    entradas.append(_desserializar(linha))
+                except ValueError:
+                    # Só a última linha pode estar incompleta (queda no meio de um write)
+                    logger.error("Linha %s inválida no journal %s ignorada: %r", numero, caminho, linha[:200])
+        return entradas
+
+    def _gravar_arquivo(self, caminho):
+        entradas = self._ler(caminho)
+        with self.app.app_context():
+            foto = catalogo.atual()
+            ja_gravadas = None
+            try:
+                # Chaves de idempotência já gravadas, lidas uma vez antes de gravar o arquivo: a chave
+                # que o próprio dreno registra não pode esconder as outras tentativas do mesmo envio
+                ja_gravadas = idempotencia.existentes(
+                    {(entrada['aluno_id'], entrada['idempotencia']) for entrada in entradas if entrada.get('idempotencia')}
+                )
+                self._gravar(entradas, foto, ja_gravadas)
+                db.session.commit()
+            except Exception as erro:
+                db.session.rollback()
+                if ja_gravadas is None or _falha_transitoria(erro):
+                    raise # o arquivo continua em '.drenando': o próximo ciclo tenta de novo
+                # Uma tentativa problemática (ex.: jogo apagado nesse meio tempo) não pode travar o
+                # journal: grava uma a uma e separa as recusadas em '<...>.rejeitados'
+                logger.exception("Falha ao gravar o journal %s em lote; gravando tentativa por tentativa.", caminho)
+                self._gravar_uma_a_uma(entradas, foto, caminho, ja_gravadas)
+            finally:
+                db.session.remove()
+
+        os.remove(caminho)
+        chaves = {entrada['chave'] for entrada in entradas}
+        with self._lock:
+            for aluno_id in {entrada['aluno_id'] for entrada in entradas}:
+                restantes = [p for p in self._pendentes.get(aluno_id, ()) if p['chave'] not in chaves]
+                if restantes:
+                    self._pendentes[aluno_id] = restantes
+                else:
+                    self._pendentes.pop(aluno_id, None)
+        return len(entradas)
+
+    def _gravar(self, entradas, foto, ja_gravadas):
+        # Envios cuja chave de idempotência já estava no banco antes do dreno (journal regravado após
+        # uma queda, reenvio atendido por outro worker) são ignorados; os demais gravam a chave junto
+        entradas = [e for e in entradas if (e['aluno_id'], e.get('idempotencia')) not in ja_gravadas]
+        entradas = _primeiro_envio_por_chave(entradas)
+        for entrada in entradas:
+            if entrada.get('resposta'):
+                corpo, status = entrada['resposta']
+                idempotencia.registrar(entrada['aluno_id'], entrada['idempotencia'], corpo, status)
+        entradas = [entrada for entrada in entradas if not entrada.get('somente_chave')]
+
+        ids = inserir_desempenhos(entradas, self.tamanho_lote)
+        inserir_fatos(dict(entrada, id=desempenho_id) for entrada, desempenho_id in zip(entradas, ids))
+        atualizar_resumos(entradas)
+
+        por_aluno = {}
+        for entrada in entradas:
+            por_aluno.setdefault(entrada['aluno_id'], []).append(entrada)
+        for aluno_id, tentativas in por_aluno.items():
+            atualizar_progresso(aluno_id, tentativas, foto)
+
+    def _gravar_uma_a_uma(self, entradas, foto, caminho, ja_gravadas):
+        # As tentativas de um envio com Idempotency-Key são gravadas juntas, com a chave, num único
+        # commit (gravadas ou recusadas todas); as demais, uma a uma
+        envios = {}
+        for entrada in entradas:
+            envio = (entrada['aluno_id'], entrada['idempotencia']) if entrada.get('idempotencia') else entrada['chave']
+            envios.setdefault(envio, []).append(entrada)
+        envios = list(envios.values())
+
+        rejeitadas = []
+        try:
+            for posicao, envio in enumerate(envios):
+                try:
+                    self._gravar(envio, foto, ja_gravadas)
+                    db.session.commit()
+                except Exception as erro:
+                    db.session.rollback()
+                    if _falha_transitoria(erro):
+                        # O banco caiu no meio: o '.drenando' passa a ter só o que ainda não foi gravado
+                        self._reescrever(caminho, [entrada for restante in envios[posicao:] for entrada in restante])
+                        raise
+                    rejeitadas.extend(envio)
+        finally:
+            self._rejeitar(rejeitadas, caminho)
+
+    def _reescrever(self, caminho, entradas):
+        # Nome temporário fora do padrão 'desempenho-*' (não é lido nem assumido como journal)
+        temporario = os.path.join(self.diretorio, f'.{os.path.basename(caminho)}.tmp')
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            arquivo.writelines(_serializar(entrada) + '\n' for entrada in entradas)
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, caminho)
+
+    def _rejeitar(self, rejeitadas, caminho):
+        if rejeitadas:
+            destino = os.path.join(self.diretorio, f'{PREFIXO}{self._pid}.rejeitados')
+            with open(destino, 'a', encoding='utf-8') as arquivo:
+                arquivo.writelines(_serializar(entrada) + '\n' for entrada in rejeitadas)
+            logger.error("%s tentativa(s) do journal %s recusadas pelo banco, guardadas em %s.",
+                         len(rejeitadas), caminho, destino)
+
+fila_desempenho = FilaDesempenho()
@@ -0,0 +1,81 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# -------------------------------------------------------------
+# SERVIÇO DE HASH DE SENHAS
+# -------------------------------------------------------------
+# O hash/verificação de senha (scrypt/pbkdf2) é puro trabalho de CPU. Em vez de rodar na thread
+# da requisição, ele é enviado para um pool de processos de tamanho fixo (PASSWORD_HASH_WORKERS),
+# e no máximo PASSWORD_HASH_MAX_PENDENTES tarefas ficam na fila: o excesso espera na entrada,
+# em vez de empilhar trabalho que ninguém vai conseguir atender a tempo.
+# Com PASSWORD_HASH_WORKERS = 0 o hash é calculado na própria thread (desenvolvimento/testes).
+# O pool é por processo: com N workers do gunicorn a máquina tem N x PASSWORD_HASH_WORKERS processos
+# de hash. Mantenha esse total perto do número de núcleos (ver o padrão em config.py).
+
+class ServicoHash:
+    def __init__(self, app=None):
+        self.metodo = 'scrypt:32768:8:1'
+        self.salt_length = 16
+        self.workers = 0
+        self.max_pendentes = 1
+        self._pool = None
+        self._pool_pid = None
+        self._vagas = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        algoritmo = config.get('PASSWORD_HASH_ALGORITHM', 'scrypt')
+
+        if algoritmo == 'scrypt':
+            self.metodo = (f"scrypt:{config.get('PASSWORD_SCRYPT_N', 2 ** 15)}"
+                           f":{config.get('PASSWORD_SCRYPT_R', 8)}"
+                           f":{config.get('PASSWORD_SCRYPT_P', 1)}")
+        elif algoritmo == 'pbkdf2':
+            self.metodo = f"pbkdf2:sha256:{config.get('PASSWORD_PBKDF2_ITERATIONS', 600000)}"
+        else:
+            raise ValueError(f"PASSWORD_HASH_ALGORITHM inválido: '{algoritmo}' (use 'scrypt' ou 'pbkdf2').")
+
+        self.salt_length = config.get('PASSWORD_SALT_LENGTH', 16)
+        self.workers = config.get('PASSWORD_HASH_WORKERS', 0)
+        self.max_pendentes = config.get('PASSWORD_HASH_MAX_PENDENTES') or max(self.workers, 1) * 4
+        self._vagas = threading.BoundedSemaphore(self.max_pendentes)
+        app.extensions['servico_hash'] = self
+
+    def _executor(self):
+        # O pool é criado sob demanda e recriado após um fork (ex.: workers do gunicorn),
+        # pois os processos filhos de um pool não sobrevivem ao fork do processo pai.
+        pid = os.getpid()
+        if self._pool is None or self._pool_pid != pid:
+            with self._lock:
+                if self._pool is None or self._pool_pid != pid:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                    self._pool_pid = pid
+        return self._pool
+
+    def _executar(self, funcao, *args):
+        if self.workers <= 0:
+            return funcao(*args)
+        with self._vagas:
+            return self._executor().submit(funcao, *args).result()
+
+    def gerar(self, senha_texto_puro):
+        return self._executar(generate_password_hash, senha_texto_puro, self.metodo, self.salt_length)
+
+    def verificar(self, senha_hash, senha_texto_puro):
+        return self._executar(check_password_hash, senha_hash, senha_texto_puro)
+
+    def precisa_rehash(self, senha_hash):
+        # O hash do werkzeug começa com os parâmetros usados ("scrypt:32768:8:1$salt$hash")
+        return senha_hash.split('$', 1)[0] != self.metodo
+
+    def encerrar(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+servico_hash = ServicoHash()
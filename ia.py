@@ -0,0 +1,532 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import google.generativeai as genai
+from sqlalchemy.exc import IntegrityError
+from models import db, Aluno, AnaliseIA, DesempenhoJogo, DesempenhoFato, JobAnaliseIA
+from catalogo import catalogo
+from fatos import agregar_fatos, fato_to_str
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------
+# ANÁLISE DE DESEMPENHO PELA IA (GEMINI)
+# -------------------------------------------------------------
+# O modelo, o prompt e o cache das análises ficam aqui; a rota do professor só monta a resposta.
+#
+# Cache: a chave de uma análise é o hash de (aluno, trilha, ids das tentativas usadas, versão do
+# prompt). Uma tentativa nova do aluno na trilha muda a chave — qualquer que seja o caminho de
+# gravação (rota de uma tentativa, lote, journal) — e a próxima consulta gera uma análise nova;
+# enquanto não houver tentativa nova, a análise guardada é devolvida sem chamar o modelo.
+# Cada worker mantém um LRU em memória (IA_CACHE_SIZE) na frente da tabela analise_ia, que guarda
+# a última análise de cada par aluno/trilha. As duas expiram após IA_CACHE_SECONDS.
+# Mudou o texto do prompt? Incremente VERSAO_PROMPT: as análises antigas deixam de valer.
+#
+# Jobs: gerar uma análise leva segundos, então as rotas não chamam o modelo na thread da requisição.
+# A rota grava um job (analise_ia_job), o entrega ao pool de threads deste worker (IA_JOB_WORKERS) e
+# responde 202 com o id; o professor consulta o job até ele ficar 'concluido' (ou 'erro').
+# As chamadas ao modelo passam por um semáforo (IA_MAX_CONCURRENT) e o pool aceita no máximo
+# IA_JOB_MAX_PENDENTES jobs na fila: acima disso a rota responde 503 em vez de acumular trabalho.
+# Cada job tem um prazo (prazo_em): IA_JOB_TIMEOUT_SECONDS a partir do início da execução ou, enquanto
+# espera na fila, a partir da sua vez estimada (jobs à frente / threads). Vencido o prazo sem terminar
+# (ex.: o worker reiniciou), o job é dado como 'erro'.
+# IA_MODEL_BACKEND='local' troca o Gemini por ModeloLocal, que responde sem rede (testes/desenvolvimento).
+# Cada chamada ao modelo tem o tempo limite IA_CALL_TIMEOUT_SECONDS.
+# gerar_em_partes() repassa o texto do modelo em partes, à medida que ele é gerado (rota SSE).
+#
+# Lotes (sala inteira): um job por aluno, todos com o mesmo lote_id. Os dados de todos os alunos são
+# lidos de uma vez (consultas agrupadas por aluno) e no máximo IA_SALA_MAX_CONCURRENT jobs do lote
+# executam ao mesmo tempo; a consulta do lote devolve cada análise assim que ela termina.
+# Cada job do lote ocupa uma vaga de IA_JOB_MAX_PENDENTES até terminar, e pedir de novo a análise da
+# sala enquanto um lote com as mesmas tentativas ainda executa devolve esse lote.
+
+VERSAO_PROMPT = 2
+
+try:
+    IA_MODEL = genai.GenerativeModel('gemini-1.5-flash')
+except Exception:
+    IA_MODEL = None
+
+def chave_analise(aluno_id, trilha_id, desempenhos_ids):
+    ids = ','.join(str(desempenho_id) for desempenho_id in sorted(desempenhos_ids))
+    return hashlib.sha256(f'{aluno_id}:{trilha_id}:{VERSAO_PROMPT}:{ids}'.encode()).hexdigest()
+
+# ---------- prompt ----------
+# O prompt não cresce com o histórico do aluno: as tentativas chegam agregadas por jogo e por fato
+# ("3x4"), com só alguns erros recentes em texto, e o total é limitado a IA_PROMPT_MAX_TOKENS.
+# Ordem de prioridade dentro do orçamento: instruções e cabeçalho (sempre), jogos, fatos com mais
+# erros primeiro, erros recentes. O que não couber fica de fora e o prompt diz quantos itens omitiu.
+
+INSTRUCOES = (
+    "Você é um assistente de análise de desempenho escolar. "
+    "Sua tarefa é analisar os dados de um aluno e gerar um relatório detalhado e útil para o professor. "
+    "A resposta deve ser um objeto JSON válido, contendo as seguintes chaves: "
+    "'resumo_geral', 'habilidades', 'melhorias', 'analise_detalhada', 'progresso' (se houver dados suficientes) e 'sugestoes'. "
+    "Cada chave deve conter um texto explicativo. Não inclua texto extra, apenas o JSON. "
+)
+
+ERROS_RECENTES = 20 # tentativas mais recentes lidas para a seção de erros
+
+def estimar_tokens(texto):
+    # Aproximação de ~4 caracteres por token (sem chamar o tokenizador do modelo)
+    return (len(texto) + 3) // 4
+
+def dados_do_prompt(aluno_id, trilha_id, ultimo_desempenho_id):
+    # Agregados das tentativas do aluno na trilha até ultimo_desempenho_id, calculados no banco
+    # (as linhas de desempenho_jogo não são carregadas, só as ERROS_RECENTES mais recentes com erros)
+    filtro = (DesempenhoJogo.aluno_id == aluno_id, DesempenhoJogo.trilha_id == trilha_id,
+              DesempenhoJogo.id <= ultimo_desempenho_id)
+    por_jogo = db.session.query(
+        DesempenhoJogo.jogo_id,
+        db.func.count(),
+        db.func.sum(db.case((DesempenhoJogo.passou, 1), else_=0))
+    ).filter(*filtro).group_by(DesempenhoJogo.jogo_id).all()
+    fatos = agregar_fatos(DesempenhoFato.aluno_id == aluno_id, DesempenhoFato.trilha_id == trilha_id,
+                          DesempenhoFato.desempenho_id <= ultimo_desempenho_id)
+    recentes = db.session.query(DesempenhoJogo.jogo_id, DesempenhoJogo.erros)\
+                         .filter(*filtro)\
+                         .order_by(DesempenhoJogo.data_hora.desc(), DesempenhoJogo.id.desc())\
+                         .limit(ERROS_RECENTES)\
+                         .all()
+    return {
+        'por_jogo': [(jogo_id, total, int(aprovacoes or 0)) for jogo_id, total, aprovacoes in por_jogo],
+        'fatos': [(fator_a, fator_b, total, int(acertos or 0)) for fator_a, fator_b, total, acertos in fatos],
+        'erros_recentes': [(jogo_id, erros) for jogo_id, erros in recentes if erros]
+    }
+
+def dados_da_sala(alunos_ids, trilha_id, maior_desempenho_id):
+    # dados_do_prompt() de vários alunos com as mesmas três consultas, agrupadas também por aluno:
+    # {aluno_id: dados}. Os erros recentes usam ROW_NUMBER() por aluno (MySQL 8+, SQLite 3.25+).
+    filtro = (DesempenhoJogo.aluno_id.in_(alunos_ids), DesempenhoJogo.trilha_id == trilha_id,
+              DesempenhoJogo.id <= maior_desempenho_id)
+    dados = {aluno_id: {'por_jogo': [], 'fatos': [], 'erros_recentes': []} for aluno_id in alunos_ids}
+
+    for aluno_id, jogo_id, total, aprovacoes in db.session.query(
+        DesempenhoJogo.aluno_id,
+        DesempenhoJogo.jogo_id,
+        db.func.count(),
+        db.func.sum(db.case((DesempenhoJogo.passou, 1), else_=0))
+    ).filter(*filtro).group_by(DesempenhoJogo.aluno_id, DesempenhoJogo.jogo_id):
+        dados[aluno_id]['por_jogo'].append((jogo_id, total, int(aprovacoes or 0)))
+
+    for aluno_id, fator_a, fator_b, total, acertos in db.session.query(
+        DesempenhoFato.aluno_id,
+        DesempenhoFato.fator_a,
+        DesempenhoFato.fator_b,
+        db.func.count(),
+        db.func.sum(db.case((DesempenhoFato.correto, 1), else_=0))
+    ).filter(DesempenhoFato.aluno_id.in_(alunos_ids), DesempenhoFato.trilha_id == trilha_id,
+             DesempenhoFato.desempenho_id <= maior_desempenho_id)\
+     .group_by(DesempenhoFato.aluno_id, DesempenhoFato.fator_a, DesempenhoFato.fator_b):
+        dados[aluno_id]['fatos'].append((fator_a, fator_b, total, int(acertos or 0)))
+
+    posicao = db.func.row_number().over(
+        partition_by=DesempenhoJogo.aluno_id,
+        order_by=(DesempenhoJogo.data_hora.desc(), DesempenhoJogo.id.desc())
+    ).label('posicao')
+    recentes = db.session.query(DesempenhoJogo.aluno_id, DesempenhoJogo.jogo_id, DesempenhoJogo.erros, posicao)\
+                         .filter(*filtro)\
+                         .subquery()
+    for aluno_id, jogo_id, erros in db.session.query(recentes.c.aluno_id, recentes.c.jogo_id, recentes.c.erros)\
+                                              .filter(recentes.c.posicao <= ERROS_RECENTES)\
+                                              .order_by(recentes.c.aluno_id, recentes.c.posicao):
+        if erros:
+            dados[aluno_id]['erros_recentes'].append((jogo_id, erros))
+    return dados
+
+def montar_prompt(aluno_nome, trilha_nome, dados, foto, max_tokens=2000):
+    # Retorna (prompt, tokens estimados). 'dados' vem de dados_do_prompt().
+    partes = [INSTRUCOES, f"Análise de desempenho do aluno {aluno_nome} na trilha '{trilha_nome}'."]
+    tokens = estimar_tokens(''.join(partes))
+
+    def incluir(linha):
+        nonlocal tokens
+        partes.append(linha)
+        tokens += estimar_tokens(linha) + 1
+
+    def secao(titulo, linhas):
+        # Título + linhas enquanto houver orçamento, sempre com espaço reservado para informar
+        # quantas linhas ficaram de fora
+        reserva = estimar_tokens("\n(99999 item(ns) omitido(s) pelo limite de tamanho)") + 1
+        titulo = f"\n{titulo}"
+        if not linhas or tokens + estimar_tokens(titulo) + 1 + reserva > max_tokens:
+            return
+        incluir(titulo)
+        for indice, linha in enumerate(linhas):
+            linha = f"\n- {linha}"
+            ultima = indice == len(linhas) - 1
+            if tokens + estimar_tokens(linha) + 1 + (0 if ultima else reserva) > max_tokens:
+                incluir(f"\n({len(linhas) - indice} item(ns) omitido(s) pelo limite de tamanho)")
+                return
+            incluir(linha)
+
+    jogos = []
+    for jogo_id, total, aprovacoes in sorted(dados['por_jogo']):
+        jogo = foto.jogos.get(jogo_id)
+        jogos.append(f"{jogo['nome'] if jogo else 'Jogo Desconhecido'}: {total} tentativa(s), passou em {aprovacoes}.")
+    secao("Resultados por jogo:", jogos)
+
+    fatos = sorted(dados['fatos'], key=lambda f: (-(f[2] - f[3]), f[3] / f[2] if f[2] else 1, f[0], f[1]))
+    secao("Contas de multiplicação (mais erradas primeiro):",
+          [f"{fato_to_str(fator_a, fator_b)}: {acertos} acerto(s) e {total - acertos} erro(s)" for fator_a, fator_b, total, acertos in fatos])
+
+    erros_recentes = []
+    vistos = set()
+    for jogo_id, erros in dados['erros_recentes']:
+        novos = [erro for erro in erros if isinstance(erro, str) and erro not in vistos]
+        vistos.update(novos)
+        if novos:
+            jogo = foto.jogos.get(jogo_id)
+            erros_recentes.append(f"{jogo['nome'] if jogo else 'Jogo Desconhecido'}: {', '.join(novos)}")
+    secao("Erros das tentativas mais recentes:", erros_recentes)
+
+    prompt = ''.join(partes)
+    return prompt, estimar_tokens(prompt)
+
+class CacheAnalises:
+    def __init__(self):
+        self._analises = OrderedDict() # (aluno_id, trilha_id) -> (chave, analise, expira_em)
+        self._lock = threading.Lock()
+        self.validade = 7 * 24 * 3600
+        self.tamanho = 1000
+
+    def init_app(self, app):
+        self.validade = app.config.get('IA_CACHE_SECONDS', 7 * 24 * 3600)
+        self.tamanho = app.config.get('IA_CACHE_SIZE', 1000)
+        app.extensions['cache_analises'] = self
+
+    def _lembrar(self, aluno_id, trilha_id, chave, analise, expira_em):
+        with self._lock:
+            self._analises[(aluno_id, trilha_id)] = (chave, analise, expira_em)
+            self._analises.move_to_end((aluno_id, trilha_id))
+            while len(self._analises) > self.tamanho:
+                self._analises.popitem(last=False)
+
+    def buscar(self, aluno_id, trilha_id, chave):
+        # Análise guardada para exatamente esta chave, ou None
+        with self._lock:
+            guardada = self._analises.get((aluno_id, trilha_id))
+            if guardada is not None:
+                self._analises.move_to_end((aluno_id, trilha_id))
+        if guardada is not None and guardada[0] == chave and guardada[2] > time.monotonic():
+            return guardada[1]
+
+        registro = db.session.get(AnaliseIA, (aluno_id, trilha_id))
+        if registro is None or registro.chave != chave:
+            return None
+        restante = (registro.criado_em + timedelta(seconds=self.validade) - datetime.utcnow()).total_seconds()
+        if restante <= 0:
+            return None
+        self._lembrar(aluno_id, trilha_id, chave, registro.analise, time.monotonic() + restante)
+        return registro.analise
+
+    def buscar_varios(self, trilha_id, chaves):
+        # buscar() de vários alunos na mesma trilha ({aluno_id: chave}) com uma consulta só para os
+        # que não estão na memória. Retorna {aluno_id: análise} dos encontrados.
+        encontradas = {}
+        faltando = []
+        agora = time.monotonic()
+        with self._lock:
+            for aluno_id, chave in chaves.items():
+                guardada = self._analises.get((aluno_id, trilha_id))
+                if guardada is not None and guardada[0] == chave and guardada[2] > agora:
+                    encontradas[aluno_id] = guardada[1]
+                else:
+                    faltando.append(aluno_id)
+        if faltando:
+            limite = datetime.utcnow() - timedelta(seconds=self.validade)
+            for registro in AnaliseIA.query.filter(AnaliseIA.trilha_id == trilha_id, AnaliseIA.aluno_id.in_(faltando)):
+                if registro.chave == chaves[registro.aluno_id] and registro.criado_em > limite:
+                    encontradas[registro.aluno_id] = registro.analise
+        return encontradas
+
+    def guardar(self, aluno_id, trilha_id, chave, analise):
+        # Substitui a análise anterior do par. Uma falha ao gravar não derruba a resposta da rota:
+        # a análise já foi gerada e só deixa de ficar no cache do banco.
+        self._lembrar(aluno_id, trilha_id, chave, analise, time.monotonic() + self.validade)
+        try:
+            db.session.merge(AnaliseIA(aluno_id=aluno_id, trilha_id=trilha_id, chave=chave,
+                                       analise=analise, criado_em=datetime.utcnow()))
+            db.session.commit()
+        except IntegrityError:
+            # Outra requisição gravou a análise do mesmo par ao mesmo tempo
+            db.session.rollback()
+
+cache_analises = CacheAnalises()
+
+class ModeloLocal:
+    # Substituto do Gemini sem rede: mesma interface (generate_content(prompt).text, ou as partes com
+    # stream=True) e uma resposta JSON com as chaves pedidas no prompt. A geração leva
+    # IA_STUB_DELAY_SECONDS (simula a latência do modelo), dividida entre PARTES partes.
+    PARTES = 8
+
+    def __init__(self, atraso=0):
+        self.atraso = atraso
+
+    def _texto(self, prompt):
+        linhas = prompt.count('\n')
+        return json.dumps({
+            'resumo_geral': f'Análise local (sem IA) a partir de {linhas} linha(s) de dados.',
+            'habilidades': '',
+            'melhorias': '',
+            'analise_detalhada': '',
+            'progresso': '',
+            'sugestoes': ''
+        }, ensure_ascii=False)
+
+    def _partes(self, texto, tempo_limite):
+        tamanho = -(-len(texto) // self.PARTES)
+        inicio = time.monotonic()
+        for posicao in range(0, len(texto), tamanho):
+            if self.atraso:
+                time.sleep(self.atraso / self.PARTES)
+            if tempo_limite is not None and time.monotonic() - inicio > tempo_limite:
+                raise TimeoutError("Tempo limite da chamada ao modelo excedido.")
+            yield type('RespostaLocal', (), {'text': texto[posicao:posicao + tamanho]})()
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        tempo_limite = (request_options or {}).get('timeout')
+        partes = self._partes(self._texto(prompt), tempo_limite)
+        if stream:
+            return partes
+        texto = ''.join(parte.text for parte in partes)
+        return type('RespostaLocal', (), {'text': texto})()
+
+class FilaCheia(Exception):
+    pass
+
+class ServicoAnalises:
+    def __init__(self):
+        self.app = None
+        self.modelo = IA_MODEL
+        self.trabalhadores = 4
+        self.max_pendentes = 50
+        self.tempo_limite = 300
+        self.max_tokens = 2000
+        self.tempo_limite_chamada = 60
+        self.max_simultaneos_sala = 2
+        self._semaforo = threading.BoundedSemaphore(2)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pool = None
+        self._pendentes = 0
+
+    def init_app(self, app):
+        config = app.config
+        self.app = app
+        if config.get('IA_MODEL_BACKEND', 'gemini') == 'local':
+            self.modelo = ModeloLocal(config.get('IA_STUB_DELAY_SECONDS', 0))
+        self.trabalhadores = config.get('IA_JOB_WORKERS', 4)
+        self.max_pendentes = config.get('IA_JOB_MAX_PENDENTES', 50)
+        self.tempo_limite = config.get('IA_JOB_TIMEOUT_SECONDS', 300)
+        self.max_tokens = config.get('IA_PROMPT_MAX_TOKENS', 2000)
+        self.tempo_limite_chamada = config.get('IA_CALL_TIMEOUT_SECONDS', 60)
+        self.max_simultaneos_sala = config.get('IA_SALA_MAX_CONCURRENT', 2)
+        self._semaforo = threading.BoundedSemaphore(config.get('IA_MAX_CONCURRENT', 2))
+        app.extensions['servico_analises'] = self
+
+    def disponivel(self):
+        return self.modelo is not None
+
+    def gerar(self, prompt):
+        # Única porta de saída para o modelo: no máximo IA_MAX_CONCURRENT chamadas por worker,
+        # cada uma com o tempo limite IA_CALL_TIMEOUT_SECONDS
+        with self._semaforo:
+            return self.modelo.generate_content(prompt, request_options={'timeout': self.tempo_limite_chamada}).text
+
+    def gerar_em_partes(self, prompt):
+        # Gerador com os pedaços de texto na ordem em que o modelo os produz. A vaga do semáforo fica
+        # ocupada até o fim da geração (ou até quem consome o gerador o fechar, ex.: cliente desconectou).
+        if not self._semaforo.acquire(timeout=self.tempo_limite_chamada):
+            raise TimeoutError("Muitas análises em andamento. Tente novamente em instantes.")
+        try:
+            for parte in self.modelo.generate_content(prompt, stream=True,
+                                                      request_options={'timeout': self.tempo_limite_chamada}):
+                if parte.text:
+                    yield parte.text
+        finally:
+            self._semaforo.release()
+
+    # ---------- jobs ----------
+
+    def _garantir_processo(self):
+        # Chamado com self._lock. Após um fork o filho não herda as threads do pool: cria o seu.
+        pid = os.getpid()
+        if self._pid != pid:
+            self._pid = pid
+            self._pool = ThreadPoolExecutor(max_workers=self.trabalhadores, thread_name_prefix='analise-ia')
+            self._pendentes = 0
+
+    def em_andamento(self, aluno_id, trilha_id, chave):
+        # Job ainda não terminado para a mesma chave (cliques repetidos não geram duas análises)
+        return JobAnaliseIA.query.filter(
+            JobAnaliseIA.aluno_id == aluno_id,
+            JobAnaliseIA.trilha_id == trilha_id,
+            JobAnaliseIA.chave == chave,
+            JobAnaliseIA.status.in_(('pendente', 'executando')),
+            JobAnaliseIA.prazo_em >= datetime.utcnow()
+        ).first()
+
+    def lote_em_andamento(self, professor_id, trilha_id, chaves):
+        # Lote ainda não terminado do professor com exatamente as mesmas chaves ({aluno_id: chave})
+        lotes = {lote_id for (lote_id,) in db.session.query(JobAnaliseIA.lote_id).filter(
+            JobAnaliseIA.professor_id == professor_id,
+            JobAnaliseIA.trilha_id == trilha_id,
+            JobAnaliseIA.lote_id.isnot(None),
+            JobAnaliseIA.status.in_(('pendente', 'executando')),
+            JobAnaliseIA.prazo_em >= datetime.utcnow()
+        )}
+        if not lotes:
+            return None
+        chaves_por_lote = {}
+        for lote_id, aluno_id, chave in db.session.query(JobAnaliseIA.lote_id, JobAnaliseIA.aluno_id, JobAnaliseIA.chave)\
+                                                  .filter(JobAnaliseIA.lote_id.in_(lotes)):
+            chaves_por_lote.setdefault(lote_id, {})[aluno_id] = chave
+        return next((lote_id for lote_id, chaves_lote in chaves_por_lote.items() if chaves_lote == chaves), None)
+
+    def _prazo(self, agora, rodadas):
+        # Fim do prazo de um job que só começa depois de 'rodadas - 1' levas de jobs à frente dele
+        return agora + timedelta(seconds=self.tempo_limite * rodadas)
+
+    def submeter(self, professor_id, aluno_id, trilha_id, chave, ultimo_desempenho_id, analise=None):
+        # Grava o job e o entrega ao pool. Com 'analise' (encontrada no cache) o job já nasce concluído.
+        # Levanta FilaCheia se o pool deste worker já tem IA_JOB_MAX_PENDENTES jobs esperando.
+        agora = datetime.utcnow()
+        job = JobAnaliseIA(id=uuid.uuid4().hex, professor_id=professor_id, aluno_id=aluno_id, trilha_id=trilha_id,
+                           chave=chave, ultimo_desempenho_id=ultimo_desempenho_id, status='pendente',
+                           criado_em=agora, prazo_em=self._prazo(agora, 1))
+        if analise is not None:
+            job.status, job.analise, job.concluido_em = 'concluido', analise, agora
+            db.session.add(job)
+            db.session.commit()
+            return job
+
+        a_frente = self._reservar(1)
+        job.prazo_em = self._prazo(agora, a_frente // self.trabalhadores + 1)
+        try:
+            db.session.add(job)
+            db.session.commit()
+            self._pool.submit(self._executar, job.id)
+        except Exception:
+            self._liberar()
+            raise
+        return job
+
+    def _reservar(self, quantidade):
+        # Devolve quantos jobs deste worker já estavam na frente
+        with self._lock:
+            self._garantir_processo()
+            a_frente = self._pendentes
+            if a_frente + quantidade > self.max_pendentes:
+                raise FilaCheia()
+            self._pendentes += quantidade
+            return a_frente
+
+    def _liberar(self, quantidade=1):
+        with self._lock:
+            self._pendentes -= quantidade
+
+    def submeter_lote(self, professor_id, trilha_id, pedidos, dados):
+        # pedidos: [(aluno_id, chave, ultimo_desempenho_id, análise do cache ou None)];
+        # dados: {aluno_id: (aluno_nome, dados_do_prompt)} lidos uma vez para a sala toda.
+        # Grava todos os jobs com o mesmo lote_id num commit e inicia no máximo
+        # IA_SALA_MAX_CONCURRENT executores, que tiram os jobs do lote de uma fila em memória.
+        # Cada job a gerar reserva uma vaga do pool (FilaCheia se não houver vagas para o lote todo).
+        lote_id = self.lote_em_andamento(professor_id, trilha_id, {pedido[0]: pedido[1] for pedido in pedidos})
+        if lote_id:
+            return lote_id
+
+        lote_id = uuid.uuid4().hex
+        agora = datetime.utcnow()
+        gerar = sum(1 for pedido in pedidos if pedido[3] is None)
+        executores = min(self.max_simultaneos_sala, gerar)
+        a_frente = self._reservar(gerar) if gerar else 0
+        try:
+            fila = deque()
+            for aluno_id, chave, ultimo_desempenho_id, analise in pedidos:
+                job = JobAnaliseIA(id=uuid.uuid4().hex, lote_id=lote_id, professor_id=professor_id, aluno_id=aluno_id,
+                                   trilha_id=trilha_id, chave=chave, ultimo_desempenho_id=ultimo_desempenho_id,
+                                   status='pendente', criado_em=agora)
+                if analise is not None:
+                    job.status, job.analise, job.concluido_em, job.prazo_em = 'concluido', analise, agora, agora
+                else:
+                    # Vez estimada: jobs do worker à frente do lote e, dentro do lote, a posição na fila
+                    job.prazo_em = self._prazo(agora, a_frente // self.trabalhadores + len(fila) // executores + 1)
+                    fila.append((job.id, dados[aluno_id]))
+                db.session.add(job)
+
+            db.session.commit()
+            for _ in range(executores):
+                self._pool.submit(self._executar_lote, fila)
+        except Exception:
+            self._liberar(gerar)
+            raise
+        return lote_id
+
+    def _executar_lote(self, fila):
+        # Cada job tirado da fila devolve a sua vaga ao terminar
+        with self.app.app_context():
+            while True:
+                try:
+                    job_id, (aluno_nome, dados) = fila.popleft()
+                except IndexError:
+                    return
+                try:
+                    self._processar(job_id, aluno_nome, dados)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Erro inesperado no job de análise %s.", job_id)
+                finally:
+                    self._liberar()
+
+    def _executar(self, job_id):
+        try:
+            with self.app.app_context():
+                self._processar(job_id)
+        except Exception:
+            logger.exception("Erro inesperado no job de análise %s.", job_id)
+        finally:
+            self._liberar()
+
+    def _processar(self, job_id, aluno_nome=None, dados=None):
+        # aluno_nome/dados já lidos (lote da sala) ou lidos aqui, para um job avulso
+        job = db.session.get(JobAnaliseIA, job_id)
+        if job is None:
+            return
+        # O prazo passa a contar do início da execução (o job pode ter esperado na fila do pool/lote)
+        job.status, job.prazo_em = 'executando', self._prazo(datetime.utcnow(), 1)
+        db.session.commit()
+
+        try:
+            foto = catalogo.atual()
+            trilha = foto.trilhas.get(job.trilha_id)
+            if dados is None:
+                aluno_nome = db.session.query(Aluno.nome).filter(Aluno.id == job.aluno_id).scalar()
+                dados = dados_do_prompt(job.aluno_id, job.trilha_id, job.ultimo_desempenho_id)
+            prompt, job.prompt_tokens = montar_prompt(aluno_nome, trilha['nome'] if trilha else '', dados, foto, self.max_tokens)
+            db.session.commit() # grava o tamanho do prompt e não segura a transação durante a chamada ao modelo
+            analise = self.gerar(prompt)
+        except Exception as e:
+            db.session.rollback()
+            job.status, job.erro, job.concluido_em = 'erro', f"Erro ao gerar análise da IA: {str(e)}", datetime.utcnow()
+            db.session.commit()
+            return
+
+        job.status, job.analise, job.concluido_em = 'concluido', analise, datetime.utcnow()
+        db.session.commit()
+        cache_analises.guardar(job.aluno_id, job.trilha_id, job.chave, analise)
+
+    def situacao(self, job):
+        # Job 'pendente'/'executando' além do prazo: o worker que o executava não existe mais
+        if job.status in ('pendente', 'executando') and job.prazo_em < datetime.utcnow():
+            return 'erro', "A análise não terminou no tempo limite. Solicite novamente."
+        return job.status, job.erro
+
+servico_analises = ServicoAnalises()
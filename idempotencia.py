@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from models import db, ChaveIdempotencia
+
+# -------------------------------------------------------------
+# CHAVES DE IDEMPOTÊNCIA (REENVIOS DO JOGO)
+# -------------------------------------------------------------
+# O jogo envia o header 'Idempotency-Key' (um id gerado por tentativa, ex.: UUID) e repete o mesmo
+# valor quando reenvia a requisição após um timeout. A primeira resposta de sucesso é gravada em
+# chave_idempotencia (única por aluno + chave) na mesma transação do desempenho; um reenvio com a
+# mesma chave recebe a resposta original, sem validar nem gravar de novo.
+# Na frente do banco, cada worker mantém um cache LRU em memória com validade de
+# IDEMPOTENCY_CACHE_SECONDS: o reenvio típico (segundos depois, no mesmo worker) não consulta o banco.
+# As chaves gravadas podem ser podadas após IDEMPOTENCY_RETENTION_HOURS ('flask podar-idempotencia').
+
+TAMANHO_MAXIMO_CHAVE = 64
+
+class CacheIdempotencia:
+    def __init__(self):
+        self._respostas = OrderedDict() # (aluno_id, chave) -> (corpo, status, expira_em)
+        self._lock = threading.Lock()
+        self.validade = 600
+        self.tamanho = 10000
+        self.retencao_horas = 48
+
+    def init_app(self, app):
+        config = app.config
+        self.validade = config.get('IDEMPOTENCY_CACHE_SECONDS', 600)
+        self.tamanho = config.get('IDEMPOTENCY_CACHE_SIZE', 10000)
+        self.retencao_horas = config.get('IDEMPOTENCY_RETENTION_HOURS', 48)
+        app.extensions['idempotencia'] = self
+
+    def chave_invalida(self, chave):
+        return not chave or len(chave) > TAMANHO_MAXIMO_CHAVE
+
+    def lembrar(self, aluno_id, chave, corpo, status):
+        # Guarda a resposta só em memória (use depois do commit que gravou a chave)
+        with self._lock:
+            self._respostas[(aluno_id, chave)] = (corpo, status, time.monotonic() + self.validade)
+            self._respostas.move_to_end((aluno_id, chave))
+            while len(self._respostas) > self.tamanho:
+                self._respostas.popitem(last=False)
+
+    def _em_memoria(self, aluno_id, chave):
+        with self._lock:
+            resposta = self._respostas.get((aluno_id, chave))
+            if resposta is None:
+                return None
+            if resposta[2] < time.monotonic():
+                del self._respostas[(aluno_id, chave)]
+                return None
+            return resposta[0], resposta[1]
+
+    def buscar(self, aluno_id, chave):
+        # (corpo, status) da resposta original, ou None se a chave ainda não foi usada por este aluno
+        resposta = self._em_memoria(aluno_id, chave)
+        if resposta is not None:
+            return resposta
+
+        registro = ChaveIdempotencia.query.filter_by(aluno_id=aluno_id, chave=chave).first()
+        if registro is not None:
+            self.lembrar(aluno_id, chave, registro.resposta, registro.status)
+            return registro.resposta, registro.status
+        return None
+
+    def registrar(self, aluno_id, chave, corpo, status):
+        # Participa da transação da rota: um reenvio simultâneo com a mesma chave falha no commit
+        # (índice único) e a rota responde com a resposta gravada pela outra requisição
+        db.session.add(ChaveIdempotencia(aluno_id=aluno_id, chave=chave, status=status, resposta=corpo))
+
+    def existentes(self, pares):
+        # Quais pares (aluno_id, chave) já estão gravados; usado ao drenar o journal da escrita adiada
+        if not pares:
+            return set()
+        alunos_ids = {aluno_id for aluno_id, _ in pares}
+        chaves = {chave for _, chave in pares}
+        return {
+            (aluno_id, chave) for aluno_id, chave in db.session.query(ChaveIdempotencia.aluno_id, ChaveIdempotencia.chave)
+            .filter(ChaveIdempotencia.aluno_id.in_(alunos_ids), ChaveIdempotencia.chave.in_(chaves))
+            if (aluno_id, chave) in pares
+        }
+
+    def podar(self):
+        limite = datetime.utcnow() - timedelta(hours=self.retencao_horas)
+        return ChaveIdempotencia.query.filter(ChaveIdempotencia.criado_em < limite).delete(synchronize_session=False)
+
+idempotencia = CacheIdempotencia()
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import Counter
+
+# -------------------------------------------------------------
+# LIMITE DE TENTATIVAS DE LOGIN (TOKEN BUCKET)
+# -------------------------------------------------------------
+# Cada email e cada IP de cliente tem um "balde" com LOGIN_LIMIT_*_CAPACITY fichas, reabastecido a
+# LOGIN_LIMIT_*_PER_MINUTE fichas por minuto; cada tentativa de login gasta uma ficha de cada balde.
+# Sem ficha, o login é recusado com 429 antes de qualquer consulta ao banco ou hash de senha.
+# Backend 'memoria' vale por processo; 'redis' compartilha os baldes entre workers e máquinas.
+# O IP é o request.remote_addr: atrás de um proxy reverso, configure PROXY_FIX_HOPS (app.py aplica
+# o ProxyFix) ou todos os clientes vão gastar as fichas do mesmo balde, o do IP do proxy.
+
+class BaldesEmMemoria:
+    MAX_BALDES = 100000 # acima disso, os baldes já cheios (inativos) são descartados
+
+    def __init__(self):
+        # chave -> (fichas, momento da última atualização, capacidade, fichas por segundo).
+        # Baldes de email e de IP dividem o dict: cada um guarda o próprio limite para o descarte.
+        self._baldes = {}
+        self._lock = threading.Lock()
+
+    def consumir(self, chave, capacidade, por_segundo):
+        agora = time.monotonic()
+        with self._lock:
+            fichas, atualizado_em, _, _ = self._baldes.get(chave, (capacidade, agora, capacidade, por_segundo))
+            fichas = min(capacidade, fichas + (agora - atualizado_em) * por_segundo)
+            permitido = fichas >= 1
+            if permitido:
+                fichas -= 1
+            self._baldes[chave] = (fichas, agora, capacidade, por_segundo)
+            if len(self._baldes) > self.MAX_BALDES:
+                self._descartar_cheios(agora)
+        return permitido, fichas
+
+    def _descartar_cheios(self, agora):
+        self._baldes = {
+            chave: balde for chave, balde in self._baldes.items()
+            if balde[0] + (agora - balde[1]) * balde[3] < balde[2]
+        }
+
+class BaldesRedis:
+    # O reabastecimento e o consumo rodam num script Lua, atômico no servidor
+    SCRIPT = """
+    local capacidade = tonumber(ARGV[1])
+    local por_segundo = tonumber(ARGV[2])
+    local agora = tonumber(ARGV[3])
+    local dados = redis.call('HMGET', KEYS[1], 'fichas', 'ts')
+    local fichas = tonumber(dados[1]) or capacidade
+    local ts = tonumber(dados[2]) or agora
+    fichas = math.min(capacidade, fichas + math.max(0, agora - ts) * por_segundo)
+    local permitido = 0
+    if fichas >= 1 then
+        fichas = fichas - 1
+        permitido = 1
+    end
+    redis.call('HSET', KEYS[1], 'fichas', tostring(fichas), 'ts', tostring(agora))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacidade / por_segundo) + 1)
+    return {permitido, tostring(fichas)}
+    """
+
+    def __init__(self, url, prefixo='mathmagic:login:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("LOGIN_LIMIT_BACKEND='redis' requer o pacote 'redis' (pip install redis).")
+        self._redis = redis.Redis.from_url(url)
+        self._script = self._redis.register_script(self.SCRIPT)
+        self.prefixo = prefixo
+
+    def consumir(self, chave, capacidade, por_segundo):
+        permitido, fichas = self._script(keys=[self.prefixo + chave], args=[capacidade, por_segundo, time.time()])
+        return bool(permitido), float(fichas)
+
+class LimitadorLogin:
+    def __init__(self):
+        self._baldes = BaldesEmMemoria()
+        self.limites = {
+            'email': (5, 5 / 60),
+            'ip': (300, 300 / 60)
+        }
+        self.habilitado = True
+        self._contadores = Counter()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        config = app.config
+        backend = config.get('LOGIN_LIMIT_BACKEND', 'memoria')
+
+        if backend == 'memoria':
+            self._baldes = BaldesEmMemoria()
+        elif backend == 'redis':
+            self._baldes = BaldesRedis(config['LOGIN_LIMIT_REDIS_URL'])
+        else:
+            raise ValueError(f"LOGIN_LIMIT_BACKEND inválido: '{backend}' (use 'memoria' ou 'redis').")
+
+        self.habilitado = config.get('LOGIN_LIMIT_ENABLED', True)
+        self.limites = {
+            'email': (config.get('LOGIN_LIMIT_EMAIL_CAPACITY', 5), config.get('LOGIN_LIMIT_EMAIL_PER_MINUTE', 5) / 60),
+            'ip': (config.get('LOGIN_LIMIT_IP_CAPACITY', 300), config.get('LOGIN_LIMIT_IP_PER_MINUTE', 300) / 60)
+        }
+        app.extensions['limitador_login'] = self
+
+    def _contar(self, nome):
+        with self._lock:
+            self._contadores[nome] += 1
+
+    def permitir(self, email, ip):
+        # Retorna None se a tentativa pode seguir, ou os segundos até a próxima ficha (Retry-After)
+        if not self.habilitado:
+            return None
+
+        for tipo, valor in (('ip', ip), ('email', email.strip().lower())):
+            capacidade, por_segundo = self.limites[tipo]
+            permitido, fichas = self._baldes.consumir(f'{tipo}:{valor}', capacidade, por_segundo)
+            if not permitido:
+                self._contar(f'bloqueadas_{tipo}')
+                return max(1, int((1 - fichas) / por_segundo + 0.999))
+
+        self._contar('permitidas')
+        return None
+
+    def metricas(self):
+        with self._lock:
+            return {
+                "permitidas": self._contadores['permitidas'],
+                "bloqueadas_ip": self._contadores['bloqueadas_ip'],
+                "bloqueadas_email": self._contadores['bloqueadas_email'],
+                "limites": {
+                    tipo: {"capacidade": capacidade, "por_minuto": round(por_segundo * 60, 2)}
+                    for tipo, (capacidade, por_segundo) in self.limites.items()
+                }
+            }
+
+limitador_login = LimitadorLogin()
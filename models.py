@@ -1,6 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from hashing import servico_hash
 
 db = SQLAlchemy()
 
@@ -10,6 +10,55 @@ sala_trilha_association = db.Table('sala_trilha',
     db.Column('trilha_id', db.Integer, db.ForeignKey('trilha.id'))
 )
 
+class Credencial(db.Model):
+    # Índice único de login: email -> (função, id do usuário, hash da senha).
+    # Mantido em sincronia pelas rotas que criam/editam/deletam Admin, Professor e Aluno,
+    # para que o login resolva o usuário com uma única consulta indexada.
+    __tablename__ = 'credencial'
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    funcao = db.Column(db.String(20), nullable=False)
+    usuario_id = db.Column(db.Integer, nullable=False)
+    senha_hash = db.Column(db.String(255), nullable=False, name='senha')
+
+    __table_args__ = (
+        db.UniqueConstraint('funcao', 'usuario_id', name='uq_credencial_usuario'),
+    )
+
+    def __repr__(self):
+        return f'<Credencial {self.funcao} {self.usuario_id}>'
+
+    def verificar_senha(self, senha_texto_puro):
+        return servico_hash.verificar(self.senha_hash, senha_texto_puro)
+
+    @classmethod
+    def email_em_uso(cls, email, funcao=None, usuario_id=None):
+        # Verifica o email em todas as funções; (funcao, usuario_id) exclui o próprio usuário numa edição
+        query = cls.query.filter(cls.email == email)
+        if funcao is not None and usuario_id is not None:
+            query = query.filter(db.or_(cls.funcao != funcao, cls.usuario_id != usuario_id))
+        return db.session.query(query.exists()).scalar()
+
+    @classmethod
+    def sincronizar(cls, usuario, funcao):
+        # Cria ou atualiza a credencial do usuário (ele precisa já ter um id, use db.session.flush())
+        credencial = cls.query.filter_by(funcao=funcao, usuario_id=usuario.id).first()
+        if credencial is None:
+            credencial = cls(funcao=funcao, usuario_id=usuario.id)
+            db.session.add(credencial)
+        credencial.email = usuario.email
+        credencial.senha_hash = usuario.senha_hash
+        return credencial
+
+    @classmethod
+    def remover(cls, funcao, usuario_ids):
+        if not usuario_ids:
+            return
+        cls.query.filter(
+            cls.funcao == funcao,
+            cls.usuario_id.in_(usuario_ids)
+        ).delete(synchronize_session=False)
+
 class Admin(db.Model):
     __tablename__ = 'admin'
     id = db.Column(db.Integer, primary_key=True)
@@ -26,10 +75,10 @@ class Admin(db.Model):
 
     @senha.setter
     def senha(self, senha_texto_puro):
-        self.senha_hash = generate_password_hash(senha_texto_puro)
+        self.senha_hash = servico_hash.gerar(senha_texto_puro)
 
     def verificar_senha(self, senha_texto_puro):
-        return check_password_hash(self.senha_hash, senha_texto_puro)
+        return servico_hash.verificar(self.senha_hash, senha_texto_puro)
 
     def to_dict(self):
         return {
@@ -55,10 +104,10 @@ class Aluno(db.Model):
 
     @senha.setter
     def senha(self, senha_texto_puro):
-        self.senha_hash = generate_password_hash(senha_texto_puro)
+        self.senha_hash = servico_hash.gerar(senha_texto_puro)
 
     def verificar_senha(self, senha_texto_puro):
-        return check_password_hash(self.senha_hash, senha_texto_puro)
+        return servico_hash.verificar(self.senha_hash, senha_texto_puro)
 
     def to_dict(self):
         # CORREÇÃO: Retornar o email correto
@@ -85,10 +134,10 @@ class Professor(db.Model):
 
     @senha.setter
     def senha(self, senha_texto_puro):
-        self.senha_hash = generate_password_hash(senha_texto_puro)
+        self.senha_hash = servico_hash.gerar(senha_texto_puro)
 
     def verificar_senha(self, senha_texto_puro):
-        return check_password_hash(self.senha_hash, senha_texto_puro)
+        return servico_hash.verificar(self.senha_hash, senha_texto_puro)
 
     def to_dict(self):
         return {
@@ -181,4 +230,163 @@ class DesempenhoJogo(db.Model):
             'passou': self.passou,
             'acertos': self.acertos,
             'erros': self.erros
-        }
\ No newline at end of file
+        }
+
+class DesempenhoFato(db.Model):
+    # Uma linha por fato (ex.: "3x4") de DesempenhoJogo.acertos/erros, com os fatores como inteiros
+    # e os ids de aluno/sala/trilha/jogo copiados da tentativa, para agregar acertos por fato em SQL
+    # com os índices abaixo (sem carregar nem interpretar o JSON em Python). Ver fatos.py.
+    __tablename__ = 'desempenho_fato'
+    id = db.Column(db.Integer, primary_key=True)
+    desempenho_id = db.Column(db.Integer, db.ForeignKey('desempenho_jogo.id', ondelete='CASCADE'), nullable=False, index=True)
+    aluno_id = db.Column(db.Integer, nullable=False)
+    sala_id = db.Column(db.Integer, nullable=False)
+    trilha_id = db.Column(db.Integer, nullable=False)
+    jogo_id = db.Column(db.Integer, nullable=False)
+    fator_a = db.Column(db.SmallInteger, nullable=False)
+    fator_b = db.Column(db.SmallInteger, nullable=False)
+    correto = db.Column(db.Boolean, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_desempenho_fato_sala', 'sala_id', 'fator_a', 'fator_b', 'correto'),
+        db.Index('ix_desempenho_fato_sala_aluno', 'sala_id', 'aluno_id', 'fator_a', 'fator_b', 'correto'),
+        db.Index('ix_desempenho_fato_aluno_trilha', 'aluno_id', 'trilha_id', 'fator_a', 'fator_b', 'correto'),
+    )
+
+    def __repr__(self):
+        return f'<DesempenhoFato {self.fator_a}x{self.fator_b} Correto: {self.correto}>'
+
+class ProgressoAlunoTrilha(db.Model):
+    # Estado de progressão do aluno em uma trilha, atualizado na mesma transação de cada
+    # DesempenhoJogo salvo (progresso.py): o mapa de progressão lê só esta linha + o catálogo,
+    # sem varrer desempenho_jogo. Pode ser reconstruído com 'flask reconstruir-progresso'.
+    __tablename__ = 'progresso_aluno_trilha'
+    aluno_id = db.Column(db.Integer, db.ForeignKey('aluno.id', ondelete='CASCADE'), primary_key=True)
+    trilha_id = db.Column(db.Integer, db.ForeignKey('trilha.id', ondelete='CASCADE'), primary_key=True)
+    jogos_concluidos = db.Column(db.JSON, nullable=False, default=list) # ids dos jogos com passou=True
+    maior_jogo_liberado = db.Column(db.Integer, nullable=True) # id do último jogo liberado no mapa
+    ultima_tentativa = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<ProgressoAlunoTrilha Aluno: {self.aluno_id}, Trilha: {self.trilha_id}>'
+
+class ResumoAlunoJogoDia(db.Model):
+    # Totais diários (UTC) das tentativas de um aluno em um jogo, somados a cada DesempenhoJogo salvo
+    # (resumos.py): relatórios leem uma linha por dia em vez de uma por tentativa.
+    # Pode ser reconstruído com 'flask reconstruir-resumos'.
+    __tablename__ = 'resumo_aluno_jogo_dia'
+    aluno_id = db.Column(db.Integer, db.ForeignKey('aluno.id', ondelete='CASCADE'), primary_key=True)
+    trilha_id = db.Column(db.Integer, primary_key=True)
+    jogo_id = db.Column(db.Integer, primary_key=True)
+    dia = db.Column(db.Date, primary_key=True)
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    aprovacoes = db.Column(db.Integer, nullable=False, default=0)
+    acertos = db.Column(db.Integer, nullable=False, default=0) # itens das listas acertos
+    erros = db.Column(db.Integer, nullable=False, default=0) # itens das listas erros
+    primeira_aprovacao = db.Column(db.DateTime, nullable=True) # primeira tentativa com passou=True no dia
+    ultima_tentativa = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<ResumoAlunoJogoDia Aluno: {self.aluno_id}, Jogo: {self.jogo_id}, Dia: {self.dia}>'
+
+class ResumoSalaJogoDia(db.Model):
+    # Os mesmos totais diários, somados por sala (painel do professor)
+    __tablename__ = 'resumo_sala_jogo_dia'
+    sala_id = db.Column(db.Integer, db.ForeignKey('sala.id', ondelete='CASCADE'), primary_key=True)
+    trilha_id = db.Column(db.Integer, primary_key=True)
+    jogo_id = db.Column(db.Integer, primary_key=True)
+    dia = db.Column(db.Date, primary_key=True)
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    aprovacoes = db.Column(db.Integer, nullable=False, default=0)
+    acertos = db.Column(db.Integer, nullable=False, default=0)
+    erros = db.Column(db.Integer, nullable=False, default=0)
+    primeira_aprovacao = db.Column(db.DateTime, nullable=True)
+    ultima_tentativa = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<ResumoSalaJogoDia Sala: {self.sala_id}, Jogo: {self.jogo_id}, Dia: {self.dia}>'
+
+class ChaveIdempotencia(db.Model):
+    # Resposta original de um POST de desempenho, por aluno + header 'Idempotency-Key' (idempotencia.py)
+    __tablename__ = 'chave_idempotencia'
+    id = db.Column(db.Integer, primary_key=True)
+    aluno_id = db.Column(db.Integer, db.ForeignKey('aluno.id', ondelete='CASCADE'), nullable=False)
+    chave = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer, nullable=False)
+    resposta = db.Column(db.JSON, nullable=False)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('aluno_id', 'chave', name='uq_chave_idempotencia_aluno'),
+    )
+
+    def __repr__(self):
+        return f'<ChaveIdempotencia Aluno: {self.aluno_id}, Chave: {self.chave}>'
+
+class AnaliseIA(db.Model):
+    # Última análise da IA de cada par aluno/trilha, com a chave (hash das tentativas usadas e da
+    # versão do prompt) que a gerou: só é reaproveitada enquanto a chave for a mesma (ia.py)
+    __tablename__ = 'analise_ia'
+    aluno_id = db.Column(db.Integer, db.ForeignKey('aluno.id', ondelete='CASCADE'), primary_key=True)
+    trilha_id = db.Column(db.Integer, db.ForeignKey('trilha.id', ondelete='CASCADE'), primary_key=True)
+    chave = db.Column(db.String(64), nullable=False)
+    analise = db.Column(db.Text, nullable=False)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AnaliseIA Aluno: {self.aluno_id}, Trilha: {self.trilha_id}>'
+
+class JobAnaliseIA(db.Model):
+    # Pedido de análise da IA executado em segundo plano (ia.py): o professor consulta pelo id.
+    # status: 'pendente' -> 'executando' -> 'concluido' (com a análise) ou 'erro' (com a mensagem)
+    __tablename__ = 'analise_ia_job'
+    id = db.Column(db.String(32), primary_key=True)
+    professor_id = db.Column(db.Integer, db.ForeignKey('professor.id', ondelete='CASCADE'), nullable=False, index=True)
+    lote_id = db.Column(db.String(32), nullable=True, index=True) # análise da sala inteira (um job por aluno)
+    aluno_id = db.Column(db.Integer, db.ForeignKey('aluno.id', ondelete='CASCADE'), nullable=False)
+    trilha_id = db.Column(db.Integer, db.ForeignKey('trilha.id', ondelete='CASCADE'), nullable=False)
+    chave = db.Column(db.String(64), nullable=False) # chave do cache das tentativas analisadas
+    ultimo_desempenho_id = db.Column(db.Integer, nullable=False) # maior id de tentativa incluído
+    status = db.Column(db.String(16), nullable=False, default='pendente')
+    analise = db.Column(db.Text, nullable=True)
+    erro = db.Column(db.Text, nullable=True)
+    prompt_tokens = db.Column(db.Integer, nullable=True) # tamanho estimado do prompt enviado ao modelo
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    prazo_em = db.Column(db.DateTime, nullable=False) # sem terminar até aqui: 'erro' (ver ServicoAnalises.situacao)
+    concluido_em = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_analise_ia_job_aluno_trilha', 'aluno_id', 'trilha_id', 'chave', 'status'),
+    )
+
+    def __repr__(self):
+        return f'<JobAnaliseIA {self.id} {self.status}>'
+
+class ContadorVersao(db.Model):
+    # Contadores de versão por chave (ex.: 'sala:12'), usados para invalidar dados cacheados
+    # fora do banco (claims do JWT, caches em memória de cada worker). Chave ausente = versão 1.
+    __tablename__ = 'contador_versao'
+    chave = db.Column(db.String(64), primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=1)
+
+    @classmethod
+    def obter(cls, chave):
+        versao = db.session.query(cls.versao).filter(cls.chave == chave).scalar()
+        return versao if versao is not None else 1
+
+    @classmethod
+    def incrementar(cls, chave):
+        # Participa da transação da rota: a nova versão só vale após o commit
+        atualizados = cls.query.filter_by(chave=chave).update(
+            {cls.versao: cls.versao + 1}, synchronize_session=False
+        )
+        if not atualizados:
+            db.session.add(cls(chave=chave, versao=2))
+
+# Modelos de usuário por função (mesmo valor gravado em Credencial.funcao e na claim 'funcao' do JWT).
+# A ordem define a prioridade quando um mesmo email existir em mais de uma tabela.
+MODELOS_POR_FUNCAO = {
+    'admin': Admin,
+    'professor': Professor,
+    'aluno': Aluno
+}
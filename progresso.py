@@ -0,0 +1,132 @@
+from models import db, DesempenhoJogo, ProgressoAlunoTrilha
+
+# -------------------------------------------------------------
+# PROGRESSÃO DO ALUNO NAS TRILHAS
+# -------------------------------------------------------------
+# O mapa de progressão de uma trilha depende só da ordem dos jogos (catálogo) e do conjunto de
+# jogos que o aluno já concluiu. Esse conjunto fica em progresso_aluno_trilha, atualizado na mesma
+# transação em que o DesempenhoJogo é salvo: abrir o mapa é uma leitura por chave primária.
+#
+# Regra do mapa: o primeiro jogo está sempre liberado; os demais só são liberados quando o jogo
+# anterior foi concluído; um jogo concluído aparece como "concluido" mesmo que um anterior não esteja.
+
+def montar_mapa(jogos_da_trilha, jogos_concluidos_ids):
+    # jogos_da_trilha: dicts do catálogo, na ordem da trilha. Retorna cópias com a chave 'status'.
+    mapa_jogos = []
+    jogo_anterior_concluido = True # O primeiro jogo sempre começa liberado
+
+    for jogo in jogos_da_trilha:
+        jogo_dict = dict(jogo) # cópia: o dict do catálogo é compartilhado entre requisições
+
+        if jogo['id'] in jogos_concluidos_ids:
+            status = "concluido"
+            jogo_anterior_concluido = True
+        else:
+            status = "liberado" if jogo_anterior_concluido else "bloqueado"
+            # Se o jogo não foi concluído, ele bloqueia o próximo
+            jogo_anterior_concluido = False
+
+        jogo_dict['status'] = status
+        mapa_jogos.append(jogo_dict)
+
+    return mapa_jogos
+
+def maior_jogo_liberado(jogos_da_trilha, jogos_concluidos_ids):
+    # Id do último jogo do mapa que não está bloqueado (None se a trilha não tem jogos)
+    maior = None
+    for jogo in montar_mapa(jogos_da_trilha, jogos_concluidos_ids):
+        if jogo['status'] != "bloqueado":
+            maior = jogo['id']
+    return maior
+
+def jogos_concluidos(aluno_id, trilha_id):
+    progresso = db.session.get(ProgressoAlunoTrilha, (aluno_id, trilha_id))
+    return set(progresso.jogos_concluidos) if progresso else set()
+
+def _travar_progressos(aluno_id, trilhas_ids):
+    # {trilha_id: ProgressoAlunoTrilha} lidos com SELECT ... FOR UPDATE
+    return {
+        progresso.trilha_id: progresso
+        for progresso in ProgressoAlunoTrilha.query.filter(
+            ProgressoAlunoTrilha.aluno_id == aluno_id,
+            ProgressoAlunoTrilha.trilha_id.in_(trilhas_ids)
+        ).with_for_update()
+    }
+
+def _criar_progressos(aluno_id, trilhas_ids):
+    # INSERT das linhas que faltam, sem erro se um save simultâneo já criou alguma
+    # (ON DUPLICATE KEY UPDATE sem mudança no MySQL, ON CONFLICT DO NOTHING no SQLite/PostgreSQL)
+    tabela = ProgressoAlunoTrilha.__table__
+    linhas = [{'aluno_id': aluno_id, 'trilha_id': trilha_id, 'jogos_concluidos': []} for trilha_id in sorted(trilhas_ids)]
+    dialeto = db.session.get_bind().dialect.name
+    if dialeto == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        comando = insert(tabela).on_duplicate_key_update(aluno_id=tabela.c.aluno_id)
+    elif dialeto in ('sqlite', 'postgresql'):
+        from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+        from sqlalchemy.dialects.postgresql import insert as insert_postgresql
+        comando = (insert_sqlite if dialeto == 'sqlite' else insert_postgresql)(tabela).on_conflict_do_nothing()
+    else:
+        raise NotImplementedError(f"Criação da progressão não suportada no banco '{dialeto}'.")
+    db.session.execute(comando, linhas)
+
+def atualizar_progresso(aluno_id, tentativas, catalogo_atual):
+    # Aplica as tentativas (dicts com trilha_id, jogo_id, passou e data_hora) ao estado do aluno.
+    # Chamado dentro da transação que salva os desempenhos (o commit fica com a rota).
+    # As linhas das trilhas envolvidas são lidas e travadas numa única consulta (SELECT ... FOR UPDATE),
+    # para que dois saves simultâneos do mesmo aluno não sobrescrevam os jogos concluídos um do outro.
+    # O FOR UPDATE não trava uma linha que ainda não existe: as que faltam (primeira tentativa do aluno
+    # na trilha) são criadas antes com um INSERT que tolera a linha criada por um save simultâneo,
+    # e então lidas e travadas como as demais.
+    trilhas_ids = {tentativa['trilha_id'] for tentativa in tentativas}
+    progressos = _travar_progressos(aluno_id, trilhas_ids)
+    faltando = trilhas_ids - progressos.keys()
+    if faltando:
+        _criar_progressos(aluno_id, faltando)
+        progressos.update(_travar_progressos(aluno_id, faltando))
+
+    for trilha_id in trilhas_ids:
+        progresso = progressos[trilha_id]
+
+        da_trilha = [tentativa for tentativa in tentativas if tentativa['trilha_id'] == trilha_id]
+        concluidos = set(progresso.jogos_concluidos or [])
+        novos = {tentativa['jogo_id'] for tentativa in da_trilha if tentativa['passou']} - concluidos
+        if novos:
+            concluidos |= novos
+            # Nova lista (e não .append): o SQLAlchemy só detecta a mudança no JSON por atribuição
+            progresso.jogos_concluidos = sorted(concluidos)
+
+        progresso.maior_jogo_liberado = maior_jogo_liberado(catalogo_atual.jogos_da_trilha(trilha_id), concluidos)
+        ultima = max(tentativa['data_hora'] for tentativa in da_trilha)
+        if progresso.ultima_tentativa is None or ultima > progresso.ultima_tentativa:
+            progresso.ultima_tentativa = ultima
+
+def reconstruir_progresso(catalogo_atual):
+    # Recalcula todo o estado a partir de desempenho_jogo (comando 'flask reconstruir-progresso').
+    # Uma consulta agrupada por (aluno, trilha, jogo); o commit fica com quem chamou.
+    linhas = db.session.query(
+        DesempenhoJogo.aluno_id,
+        DesempenhoJogo.trilha_id,
+        DesempenhoJogo.jogo_id,
+        db.func.max(db.case((DesempenhoJogo.passou, 1), else_=0)),
+        db.func.max(DesempenhoJogo.data_hora)
+    ).group_by(DesempenhoJogo.aluno_id, DesempenhoJogo.trilha_id, DesempenhoJogo.jogo_id)
+
+    estados = {} # (aluno_id, trilha_id) -> [jogos concluídos, última tentativa]
+    for aluno_id, trilha_id, jogo_id, passou, ultima in linhas:
+        estado = estados.setdefault((aluno_id, trilha_id), [set(), None])
+        if passou:
+            estado[0].add(jogo_id)
+        if estado[1] is None or (ultima is not None and ultima > estado[1]):
+            estado[1] = ultima
+
+    ProgressoAlunoTrilha.query.delete()
+    for (aluno_id, trilha_id), (concluidos, ultima) in estados.items():
+        db.session.add(ProgressoAlunoTrilha(
+            aluno_id=aluno_id,
+            trilha_id=trilha_id,
+            jogos_concluidos=sorted(concluidos),
+            maior_jogo_liberado=maior_jogo_liberado(catalogo_atual.jogos_da_trilha(trilha_id), concluidos),
+            ultima_tentativa=ultima
+        ))
+    return len(estados)
@@ -0,0 +1,111 @@
+from models import db, DesempenhoJogo, ResumoAlunoJogoDia, ResumoSalaJogoDia
+
+# -------------------------------------------------------------
+# RESUMOS DIÁRIOS DE DESEMPENHO
+# -------------------------------------------------------------
+# Totais por aluno × jogo × dia e por sala × jogo × dia (tentativas, aprovações, quantidade de
+# acertos/erros, primeira aprovação e última tentativa), somados na mesma transação em que as
+# tentativas são gravadas (rota de uma tentativa, lote e journal da escrita adiada).
+# A soma é um upsert atômico no banco (INSERT ... ON DUPLICATE KEY UPDATE no MySQL,
+# ON CONFLICT DO UPDATE no SQLite/PostgreSQL): saves simultâneos não perdem tentativas.
+# O dia é a data UTC de data_hora, como gravada em desempenho_jogo.
+# O comando 'flask reconstruir-resumos' recalcula as duas tabelas a partir de desempenho_jogo.
+
+CHAVES = {
+    ResumoAlunoJogoDia: ('aluno_id', 'trilha_id', 'jogo_id', 'dia'),
+    ResumoSalaJogoDia: ('sala_id', 'trilha_id', 'jogo_id', 'dia'),
+}
+
+def _somar(totais, chave, tentativa):
+    # Acumula uma tentativa (dict com passou, acertos, erros e data_hora) no total da chave
+    total = totais.get(chave)
+    if total is None:
+        total = totais[chave] = {
+            'tentativas': 0, 'aprovacoes': 0, 'acertos': 0, 'erros': 0,
+            'primeira_aprovacao': None, 'ultima_tentativa': None
+        }
+    data_hora = tentativa['data_hora']
+    total['tentativas'] += 1
+    total['acertos'] += len(tentativa.get('acertos') or ())
+    total['erros'] += len(tentativa.get('erros') or ())
+    if tentativa['passou']:
+        total['aprovacoes'] += 1
+        if total['primeira_aprovacao'] is None or data_hora < total['primeira_aprovacao']:
+            total['primeira_aprovacao'] = data_hora
+    if total['ultima_tentativa'] is None or data_hora > total['ultima_tentativa']:
+        total['ultima_tentativa'] = data_hora
+
+def totais_por_dia(tentativas):
+    # {modelo: {chave primária: totais}} para tentativas com aluno_id, sala_id, trilha_id e jogo_id
+    totais = {ResumoAlunoJogoDia: {}, ResumoSalaJogoDia: {}}
+    for tentativa in tentativas:
+        dia = tentativa['data_hora'].date()
+        _somar(totais[ResumoAlunoJogoDia], (tentativa['aluno_id'], tentativa['trilha_id'], tentativa['jogo_id'], dia), tentativa)
+        _somar(totais[ResumoSalaJogoDia], (tentativa['sala_id'], tentativa['trilha_id'], tentativa['jogo_id'], dia), tentativa)
+    return totais
+
+def _menor(atual, novo):
+    # Menor de duas datas, ignorando NULL (LEAST do MySQL devolve NULL se um dos lados for NULL)
+    return db.case((atual.is_(None), novo), (novo.is_(None), atual), (novo < atual, novo), else_=atual)
+
+def _maior(atual, novo):
+    return db.case((atual.is_(None), novo), (novo.is_(None), atual), (novo > atual, novo), else_=atual)
+
+def _upsert(modelo, linhas):
+    tabela = modelo.__table__
+    dialeto = db.session.get_bind().dialect.name
+    if dialeto == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        comando = insert(tabela)
+        novo = comando.inserted
+    elif dialeto in ('sqlite', 'postgresql'):
+        from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+        from sqlalchemy.dialects.postgresql import insert as insert_postgresql
+        comando = (insert_sqlite if dialeto == 'sqlite' else insert_postgresql)(tabela)
+        novo = comando.excluded
+    else:
+        raise NotImplementedError(f"Upsert dos resumos diários não suportado no banco '{dialeto}'.")
+
+    atualizar = {
+        'tentativas': tabela.c.tentativas + novo.tentativas,
+        'aprovacoes': tabela.c.aprovacoes + novo.aprovacoes,
+        'acertos': tabela.c.acertos + novo.acertos,
+        'erros': tabela.c.erros + novo.erros,
+        'primeira_aprovacao': _menor(tabela.c.primeira_aprovacao, novo.primeira_aprovacao),
+        'ultima_tentativa': _maior(tabela.c.ultima_tentativa, novo.ultima_tentativa),
+    }
+    if dialeto == 'mysql':
+        comando = comando.on_duplicate_key_update(**atualizar)
+    else:
+        comando = comando.on_conflict_do_update(index_elements=list(CHAVES[modelo]), set_=atualizar)
+    db.session.execute(comando, linhas)
+
+def _linhas(modelo, totais):
+    return [dict(zip(CHAVES[modelo], chave), **total) for chave, total in totais.items()]
+
+def atualizar_resumos(tentativas):
+    # Soma as tentativas gravadas aos resumos diários: um upsert (executemany) por tabela.
+    # Chamado dentro da transação que salva os desempenhos (o commit fica com quem chamou).
+    for modelo, totais in totais_por_dia(tentativas).items():
+        if totais:
+            # Ordem fixa das chaves: dois saves simultâneos travam as linhas na mesma ordem
+            _upsert(modelo, _linhas(modelo, dict(sorted(totais.items()))))
+
+def reconstruir_resumos(tamanho_lote=5000):
+    # Recalcula as duas tabelas a partir de desempenho_jogo (comando 'flask reconstruir-resumos').
+    # Lê só as colunas necessárias, em streaming; a memória usada é proporcional ao número de
+    # linhas dos resumos (dias), não de tentativas. O commit fica com quem chamou.
+    colunas = db.session.query(
+        DesempenhoJogo.aluno_id, DesempenhoJogo.sala_id, DesempenhoJogo.trilha_id, DesempenhoJogo.jogo_id,
+        DesempenhoJogo.passou, DesempenhoJogo.acertos, DesempenhoJogo.erros, DesempenhoJogo.data_hora
+    ).execution_options(yield_per=tamanho_lote)
+    totais = totais_por_dia(linha._asdict() for linha in colunas)
+
+    total_linhas = 0
+    for modelo, totais_modelo in totais.items():
+        modelo.query.delete()
+        linhas = _linhas(modelo, totais_modelo)
+        for inicio in range(0, len(linhas), tamanho_lote):
+            db.session.execute(db.insert(modelo), linhas[inicio:inicio + tamanho_lote])
+        total_linhas += len(linhas)
+    return total_linhas
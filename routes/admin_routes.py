@@ -1,7 +1,10 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from sqlalchemy import or_
-from models import db, Trilha, Jogo, Professor
+from models import db, Trilha, Jogo, Professor, Aluno, Sala, Credencial
+from autorizacao import requer_funcao, incrementar_versao_salas
+from limitador import limitador_login
+from catalogo import catalogo
+from serializadores import JOGO
 
 # Definição do Blueprint    
 admin_bp = Blueprint('admin_bp', __name__, url_prefix='/api/admin')
@@ -10,12 +13,8 @@ admin_bp = Blueprint('admin_bp', __name__, url_prefix='/api/admin')
 
 # ROTA PARA PESQUISAR TRILHAS POR NOME - TESTADA E FUNCIONANDO
 @admin_bp.route('/trilhas/search', methods=['GET'])
-@jwt_required()
+@requer_funcao('admin')
 def search_trilhas_admin():
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem pesquisar trilhas."}), 403
-
     # Obtém o termo de pesquisa da query string (ex: /search?query=subtracao)
     search_term = request.args.get('query', None)
 
@@ -23,39 +22,30 @@ def search_trilhas_admin():
         # Se não houver termo, retorna todas as trilhas ou um erro
         return jsonify({"message": "O termo de pesquisa 'query' é obrigatório."}), 400
 
-    # Adiciona o wildcard (%) para busca parcial e case-insensitive
-    termo_like = f"%{search_term}%"
-    
-    trilhas = Trilha.query.filter(Trilha.nome.ilike(termo_like)).all()
+    # Busca parcial e case-insensitive no catálogo em memória
+    termo = search_term.casefold()
+    trilhas = [t for t in catalogo.atual().lista_trilhas if termo in t['nome'].casefold()]
 
     if not trilhas:
         return jsonify({"message": f"Nenhuma trilha encontrada com o nome: '{search_term}'"}), 404
 
-    return jsonify([t.to_dict() for t in trilhas]), 200
+    return jsonify(trilhas), 200
 
 # ROTA PARA VER AS TRILHAS - TESTADA E FUNCIONANDO
 @admin_bp.route('/trilhas', methods=['GET'])
-@jwt_required()
+@requer_funcao('admin')
 def get_trilhas():
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem acessar esta rota."}), 403
-
-    trilhas = Trilha.query.all()
+    trilhas = catalogo.atual().lista_trilhas
 
     if not trilhas:
         return jsonify({"message": "Nenhuma trilha encontrada."})
 
-    return jsonify([t.to_dict() for t in trilhas]), 200
+    return jsonify(list(trilhas)), 200
 
 # ROTA DE CRIAR TRILHA - TESTADA E FUNCIONANDO
 @admin_bp.route('/trilhas', methods=['POST'])
-@jwt_required()
+@requer_funcao('admin')
 def create_trilha():
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem acessar esta rota."}), 403
-
     data = request.get_json()
     nome = data.get('nome')
     descricao = data.get('descricao')
@@ -70,20 +60,19 @@ def create_trilha():
     try:
         nova_trilha = Trilha(nome=nome, descricao=descricao)
         db.session.add(nova_trilha)
+        catalogo.invalidar()
         db.session.commit()
-        return jsonify({"message": "Trilha criada com sucesso!", "trilha": nova_trilha.to_dict()}), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": f"Erro ao criar trilha: {str(e)}"}), 500
 
+    catalogo.recarregar() # após o commit: uma falha aqui não desfaz nem esconde a alteração gravada
+    return jsonify({"message": "Trilha criada com sucesso!", "trilha": nova_trilha.to_dict()}), 201
+
 # ROTA DE EDITAR TRILHA - TESTADA E FUNCIONANDO
 @admin_bp.route('/trilhas/<int:trilha_id>', methods=['PUT'])
-@jwt_required()
+@requer_funcao('admin')
 def update_trilha(trilha_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem acessar esta rota."}), 403
-
     trilha = Trilha.query.get(trilha_id)
     if not trilha:
         return jsonify({"message": "Trilha não encontrada."}), 404
@@ -104,87 +93,79 @@ def update_trilha(trilha_id):
         trilha.descricao = data['descricao']
 
     try:
+        catalogo.invalidar()
         db.session.commit()
-        return jsonify({"message": "Trilha atualizada com sucesso!", "trilha": trilha.to_dict()}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": f"Erro ao atualizar trilha: {str(e)}"}), 500
 
+    catalogo.recarregar()
+    return jsonify({"message": "Trilha atualizada com sucesso!", "trilha": trilha.to_dict()}), 200
+
 # ROTA DE DELETAR TRILHA - TESTADA E FUNCIONANDO
 @admin_bp.route('/trilhas/<int:trilha_id>', methods=['DELETE'])
-@jwt_required()
+@requer_funcao('admin')
 def delete_trilha(trilha_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem acessar esta rota."}), 403
-    
     trilha = Trilha.query.get(trilha_id)
     if not trilha:
         return jsonify({"message": "Trilha não encontrada."}), 404
         
     try:
+        # As salas que tinham esta trilha mudam de escopo: invalida o escopo dos tokens dos alunos delas
+        incrementar_versao_salas([sala.id for sala in trilha.salas])
         db.session.delete(trilha)
+        catalogo.invalidar()
         db.session.commit()
-        return jsonify({"message": "Trilha deletada com sucesso!"}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": f"Erro ao deletar trilha: {str(e)}"}), 500
 
+    catalogo.recarregar()
+    return jsonify({"message": "Trilha deletada com sucesso!"}), 200
+
 # --------------------ROTAS DE CRUD DE JOGOS-------------------
 
 # ROTA DE PESQUISAR JOGOS POR NOME - NÃO TESTADA
 @admin_bp.route('/jogos/search', methods=['GET'])
-@jwt_required()
+@requer_funcao('admin')
 def search_jogos_admin():
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem pesquisar jogos."}), 403
-
     search_term = request.args.get('query', None)
 
     if not search_term:
         return jsonify({"message": "O termo de pesquisa 'query' é obrigatório."}), 400
 
-    termo_like = f"%{search_term}%"
-    
-    # Busca jogos pelo nome, ignorando maiúsculas/minúsculas
-    jogos = Jogo.query.filter(Jogo.nome.ilike(termo_like)).all()
+    # Busca jogos pelo nome no catálogo em memória, ignorando maiúsculas/minúsculas
+    termo = search_term.casefold()
+    jogos = [j for j in catalogo.atual().lista_jogos if termo in j['nome'].casefold()]
 
     if not jogos:
         return jsonify({"message": f"Nenhum jogo encontrado com o nome: '{search_term}'"}), 404
 
-    return jsonify([j.to_dict() for j in jogos]), 200
+    return jsonify(jogos), 200
 
 # ROTA DE VER OS JOGOS - TESTADA E FUNCIONANDO
 @admin_bp.route('/jogos', methods=['GET'])
-@jwt_required()
+@requer_funcao('admin')
 def get_jogos():
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem acessar esta rota."}), 403
-    
-    jogos = Jogo.query.all()
+    # Campos pedidos (?fields=id,nome,...); sem o parâmetro, todos
+    campos, erro = JOGO.campos_pedidos(request.args.get('fields'))
+    if erro:
+        return jsonify({"message": erro}), 400
+
+    # Jogos já serializados com o 'trilha_nome' (sem carregar jogo.trilha de cada um)
+    jogos = catalogo.atual().lista_jogos_com_trilha
     
     if not  jogos:
         return jsonify({"message": "Nenhum jogo encontrado."})
 
-    jogos_list = []
-    for jogo in jogos:
-        jogo_dict = jogo.to_dict()
-        if jogo.trilha:
-            jogo_dict['trilha_nome'] = jogo.trilha.nome
-        jogos_list.append(jogo_dict)
-        
-    return jsonify(jogos_list), 200
+    if campos == JOGO.campos:
+        return jsonify(list(jogos)), 200
+    return jsonify(JOGO.lista_de_dicts(jogos, campos)), 200
 
 # ROTA PARA CRIAR UM NOVO JOGO - TESTADA E FUNCIONANDO
 @admin_bp.route('/jogos', methods=['POST'])
-@jwt_required()
+@requer_funcao('admin')
 def create_jogo():
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem acessar esta rota."}), 403
-        
     data = request.get_json()
     nome = data.get('nome')
     descricao = data.get('descricao')
@@ -205,23 +186,21 @@ def create_jogo():
     try:
         novo_jogo = Jogo(nome=nome, descricao=descricao, trilha=trilha)
         db.session.add(novo_jogo)
+        catalogo.invalidar()
         db.session.commit()
-        
-        jogo_dict = novo_jogo.to_dict()
-        jogo_dict['trilha_nome'] = trilha.nome
-        return jsonify({"message": "Jogo criado com sucesso!", "jogo": jogo_dict}), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": f"Erro ao criar jogo: {str(e)}"}), 500
 
+    catalogo.recarregar()
+    jogo_dict = novo_jogo.to_dict()
+    jogo_dict['trilha_nome'] = trilha.nome
+    return jsonify({"message": "Jogo criado com sucesso!", "jogo": jogo_dict}), 201
+
 # ROTA PARA EDITAR UM JOGO - TESTADA E FUNCIONANDO
 @admin_bp.route('/jogos/<int:jogo_id>', methods=['PUT'])
-@jwt_required()
+@requer_funcao('admin')
 def update_jogo(jogo_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem acessar esta rota."}), 403
-    
     jogo = Jogo.query.get(jogo_id)
     if not jogo:
         return jsonify({"message": "Jogo não encontrado."}), 404
@@ -248,23 +227,21 @@ def update_jogo(jogo_id):
         jogo.trilha = trilha
 
     try:
+        catalogo.invalidar()
         db.session.commit()
-        
-        jogo_dict = jogo.to_dict()
-        jogo_dict['trilha_nome'] = jogo.trilha.nome if jogo.trilha else None
-        return jsonify({"message": "Jogo atualizado com sucesso!", "jogo": jogo_dict}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": f"Erro ao atualizar jogo: {str(e)}"}), 500
 
+    catalogo.recarregar()
+    jogo_dict = jogo.to_dict()
+    jogo_dict['trilha_nome'] = jogo.trilha.nome if jogo.trilha else None
+    return jsonify({"message": "Jogo atualizado com sucesso!", "jogo": jogo_dict}), 200
+
 # ROTA DE DELETAR UM JOGO - TESTADA E FUNCIONANDO
 @admin_bp.route('/jogos/<int:jogo_id>', methods=['DELETE'])
-@jwt_required()
+@requer_funcao('admin')
 def delete_jogo(jogo_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem acessar esta rota."}), 403
-    
     jogo = Jogo.query.get(jogo_id)
     
     if not jogo:
@@ -272,23 +249,21 @@ def delete_jogo(jogo_id):
         
     try:
         db.session.delete(jogo)
+        catalogo.invalidar()
         db.session.commit()
-        
-        return jsonify({"message": "Jogo deletado com sucesso!"}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": f"Erro ao deletar jogo: {str(e)}"}), 500
 
+    catalogo.recarregar()
+    return jsonify({"message": "Jogo deletado com sucesso!"}), 200
+
 # ------------------ROTAS DE CRUD DE PROFESSORES----------------
 
 #ROTA DE PESQUISAR PROFESSORES POR NOME - NÃO TESTADA
 @admin_bp.route('/professores/search', methods=['GET'])
-@jwt_required()
+@requer_funcao('admin')
 def search_professores_admin():
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem pesquisar professores."}), 403
-
     search_term = request.args.get('query', None)
 
     if not search_term:
@@ -311,12 +286,8 @@ def search_professores_admin():
 
 # ROTA DE VER PROFESSORES - TESTADA E FUNCIONANDO
 @admin_bp.route('/professores', methods=['GET'])
-@jwt_required()
+@requer_funcao('admin')
 def get_professores():
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem acessar esta rota."}), 403
-
     professores = Professor.query.all()
     
     if not professores:
@@ -326,12 +297,8 @@ def get_professores():
 
 # ROTA DE CRIAR UM NOVO PROFESSOR - TESTADA E FUNCIONANDO
 @admin_bp.route('/professores', methods=['POST'])
-@jwt_required()
+@requer_funcao('admin')
 def create_professor():
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem acessar esta rota."}), 403
-
     data = request.get_json()
     nome = data.get('nome')
     email = data.get('email')
@@ -340,13 +307,16 @@ def create_professor():
     if not all([nome, email, senha]):
         return jsonify({"message": "Nome, email e senha são obrigatórios."}), 400
 
-    if Professor.query.filter_by(email=email).first():
+    # O email é único entre admins, professores e alunos (índice de credenciais)
+    if Credencial.email_em_uso(email):
         return jsonify({"message": "Email já cadastrado."}), 409
 
     try:
         novo_professor = Professor(nome=nome, email=email)
         novo_professor.senha = senha # O setter do modelo faz o hash
         db.session.add(novo_professor)
+        db.session.flush() # Gera o id para a credencial
+        Credencial.sincronizar(novo_professor, 'professor')
         db.session.commit()
         return jsonify({"message": "Professor criado com sucesso!", "professor": novo_professor.to_dict()}), 201
     except Exception as e:
@@ -355,12 +325,8 @@ def create_professor():
 
 # ROTA DE EDITAR UM PROFESSOR - TESTADA E FUNCIONANDO
 @admin_bp.route('/professores/<int:professor_id>', methods=['PUT'])
-@jwt_required()
+@requer_funcao('admin')
 def update_professor(professor_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem acessar esta rota."}), 403
-
     professor = Professor.query.get(professor_id)
     if not professor:
         return jsonify({"message": "Professor não encontrado."}), 404
@@ -375,14 +341,15 @@ def update_professor(professor_id):
     
     if 'email' in data:
         novo_email = data['email']
-        if Professor.query.filter(Professor.email == novo_email, Professor.id != professor_id).first():
-            return jsonify({"message": "O novo email já está em uso por outro professor."}), 409
+        if Credencial.email_em_uso(novo_email, 'professor', professor_id):
+            return jsonify({"message": "O novo email já está em uso por outro usuário."}), 409
         professor.email = novo_email
 
     if 'senha' in data:
         professor.senha = data['senha']
     
     try:
+        Credencial.sincronizar(professor, 'professor')
         db.session.commit()
         return jsonify({"message": "Professor atualizado com sucesso!", "professor": professor.to_dict()}), 200
     except Exception as e:
@@ -391,21 +358,33 @@ def update_professor(professor_id):
 
 # ROTA DE DELETAR UM PROFESSOR - TESTADA E FUNCIONANDO
 @admin_bp.route('/professores/<int:professor_id>', methods=['DELETE'])
-@jwt_required()
+@requer_funcao('admin')
 def delete_professor(professor_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'admin':
-        return jsonify({"message": "Acesso negado: Apenas administradores podem acessar esta rota."}), 403
-
     professor = Professor.query.get(professor_id)
     if not professor:
         return jsonify({"message": "Professor não encontrado."}), 404
         
     try:
+        # Remove do índice de login o professor e os alunos das salas dele (apagados em cascata)
+        alunos_ids = [aluno_id for (aluno_id,) in db.session.query(Aluno.id)
+                      .join(Sala, Aluno.sala_id == Sala.id)
+                      .filter(Sala.professor_id == professor_id)]
+        Credencial.remover('aluno', alunos_ids)
+        Credencial.remover('professor', [professor_id])
+        incrementar_versao_salas([sala.id for sala in professor.salas])
         db.session.delete(professor)
         db.session.commit()
         return jsonify({"message": "Professor deletado com sucesso!"}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": f"Erro ao deletar professor: {str(e)}"}), 500
+
+# ------------------ROTAS DE MONITORAMENTO----------------
+
+# ROTA PARA VER OS CONTADORES DO LIMITE DE TENTATIVAS DE LOGIN (deste worker)
+@admin_bp.route('/metricas/login', methods=['GET'])
+@requer_funcao('admin')
+def get_metricas_login():
+    return jsonify(limitador_login.metricas()), 200
+
 # ===========================================FIM DAS ROTAS DO ADM==================================================
\ No newline at end of file
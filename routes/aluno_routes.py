@@ -1,52 +1,38 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from sqlalchemy.orm import joinedload
-from blacklist import BLACKLIST 
+from datetime import datetime
+from flask import Blueprint, request, jsonify, g, current_app
+from autorizacao import requer_funcao
+from catalogo import catalogo
+from progresso import montar_mapa, jogos_concluidos
+from desempenho import validar_tentativa, novo_desempenho, inserir_em_lote, tentativa_to_dict
+from fila_desempenho import fila_desempenho
+from idempotencia import idempotencia
 
 # Importações dos Modelos
-from models import db, Aluno, Trilha, Jogo, DesempenhoJogo, Sala 
+from models import db
 
 # Definição do Blueprint
 aluno_bp = Blueprint('aluno_bp', __name__, url_prefix='/api/aluno')
 
 # =================================ROTAS DO ALUNO================================================
 @aluno_bp.route('/me', methods=['GET'])
-@jwt_required()
+@requer_funcao('aluno')
 def get_me_completo():
-    claims = get_jwt()
-
-    # 1. Permitir somente ALUNO
-    if claims.get('funcao') != 'aluno':
-        return jsonify({"message": "Acesso negado: Apenas alunos podem acessar esta rota."}), 403
-
-    # 2. ID do aluno
-    try:
-        aluno_id = int(get_jwt_identity())
-    except ValueError:
-        return jsonify({"message": "ID inválido no token."}), 401
-
-    aluno = Aluno.query.get(aluno_id)
-    if not aluno:
-        return jsonify({"message": "Aluno não encontrado."}), 404
-
-    # 3. Sala do aluno
-    sala = aluno.sala
+    # 1. Aluno logado e sala dele (carregados pelo @requer_funcao)
+    aluno = g.aluno
+    sala = g.sala
 
     if not sala:
         return jsonify({"message": "O aluno não está associado a nenhuma sala."}), 404
 
-    # 4. Trilhas + jogos de cada trilha
-    trilhas_formatadas = []
+    # 2. Trilhas + jogos de cada trilha
+    # Vêm prontas do catálogo em memória (ids das trilhas da sala carregados pelo @requer_funcao),
+    # sem nenhuma consulta a mais, independente do tamanho do catálogo
+    foto = catalogo.atual()
+    trilhas_formatadas = [
+        foto.trilhas_com_jogos[trilha_id] for trilha_id in sorted(g.trilhas_ids) if trilha_id in foto.trilhas_com_jogos
+    ]
 
-    for trilha in sala.trilhas:
-        trilhas_formatadas.append({
-            "id": trilha.id,
-            "nome": trilha.nome,
-            "descricao": trilha.descricao if hasattr(trilha, "descricao") else None,
-            "jogos": [jogo.to_dict() for jogo in trilha.jogos]
-        })
-
-    # 5. Resposta final
+    # 3. Resposta final
     return jsonify({
         "id": aluno.id,
         "nome": aluno.nome,
@@ -62,96 +48,48 @@ def get_me_completo():
 
 # ROTA PARA PESQUISAR AS TRILHAS POR NOME - NÃO TESTADA
 @aluno_bp.route('/trilhas/search', methods=['GET'])
-@jwt_required()
+@requer_funcao('aluno')
 def search_trilhas_aluno():
-    claims = get_jwt()
-    
-    # 1. VALIDAÇÃO DE FUNÇÃO
-    if claims.get('funcao') != 'aluno':
-        return jsonify({"message": "Acesso negado: Apenas alunos podem pesquisar trilhas."}), 403
-
-    # 2. EXTRAÇÃO DO ID DO ALUNO LOGADO E OBTER OBJETO
-    identity = get_jwt_identity()
-    try:
-        aluno_id = int(identity)
-    except ValueError:
-        return jsonify({"message": "ID de aluno no token inválido."}), 401
-    
-    aluno = Aluno.query.get(aluno_id)
-    if not aluno:
-        return jsonify({"message": "Aluno não encontrado."}), 404
-    
-    # Obtém a sala do aluno (relação singular)
-    sala_do_aluno = aluno.sala
+    # 1. SALA DO ALUNO LOGADO (carregada pelo @requer_funcao)
+    sala_do_aluno = g.sala
     
     if not sala_do_aluno:
         return jsonify({"message": "Você não está associado a nenhuma sala com trilhas."}), 404
 
-    # 3. OBTÉM O TERMO DE PESQUISA
+    # 2. OBTÉM O TERMO DE PESQUISA
     search_term = request.args.get('query', None)
     
     # Se não houver termo de pesquisa, o aluno pode querer ver todas as trilhas disponíveis na sua sala
+    # Trilhas associadas à sala do aluno (ids já carregados pelo @requer_funcao), do catálogo em memória
+    trilhas_na_sala = catalogo.atual().trilhas_de(g.trilhas_ids)
+
     if not search_term:
-        trilhas = sala_do_aluno.trilhas
-        
-        if not trilhas:
+        if not trilhas_na_sala:
             return jsonify({"message": "Sua sala não possui trilhas cadastradas."}), 404
         
-        return jsonify([t.to_dict() for t in trilhas]), 200
+        return jsonify(trilhas_na_sala), 200
 
-    termo_like = f"%{search_term}%"
-    
-    # 4. FILTRO DE PESQUISA E AUTORIZAÇÃO
-
-    # Obtém os IDs das trilhas associadas à sala do aluno
-    trilhas_na_sala_ids = [t.id for t in sala_do_aluno.trilhas]
-    
-    # Busca trilhas cujo nome contenha o termo
-    # E que estejam na lista de IDs da sala do aluno
-    trilhas_encontradas = Trilha.query.filter(
-        Trilha.id.in_(trilhas_na_sala_ids), # Filtro de Autorização: A trilha deve estar na sala do aluno
-        Trilha.nome.ilike(termo_like)       # Filtro de Pesquisa: Nome da trilha contém o termo
-    ).all()
+    # 3. FILTRO DE PESQUISA (nome da trilha contém o termo, ignorando maiúsculas/minúsculas)
+    termo = search_term.casefold()
+    trilhas_encontradas = [t for t in trilhas_na_sala if termo in t['nome'].casefold()]
 
     if not trilhas_encontradas:
         return jsonify({"message": f"Nenhuma trilha encontrada com o termo '{search_term}' na sua sala."}), 404
 
-    return jsonify([t.to_dict() for t in trilhas_encontradas]), 200
+    return jsonify(trilhas_encontradas), 200
 
 # ROTA PARA VER AS TRILHAS DISPONIVEIS NA SALA, PELO ALUNO - TESTADA E FUNCIONANDO
 @aluno_bp.route('/trilhas', methods=['GET'])
-@jwt_required()
+@requer_funcao('aluno')
 def get_aluno_trilhas():
-    claims = get_jwt()
-    
-    # 1. VALIDAÇÃO DE FUNÇÃO: Garante que apenas ALUNOS acessem esta rota.
-    if claims.get('funcao') != 'aluno':
-        return jsonify({"message": "Acesso negado: Apenas Alunos podem acessar esta rota."}), 403
-
-    # 2. EXTRAÇÃO DO ID: O identity agora é apenas o ID (string)
-    identity = get_jwt_identity()
-    
-    try:
-        # Tenta converter o ID (que é o identity) para inteiro
-        aluno_id = int(identity)
-    except ValueError:
-        return jsonify({"message": "ID de aluno no token inválido."}), 401
-
-    # 3. Encontra o aluno no banco
-    aluno = Aluno.query.get(aluno_id)
-
-    if not aluno:
-        return jsonify({"message": "Aluno não encontrado."}), 404
-
-    # 4. Busca a sala do aluno (Usando .sala no singular, conforme o modelo 1:N)
-    sala = aluno.sala
+    # 1. Sala do aluno logado (carregada pelo @requer_funcao)
+    sala = g.sala
     
     if not sala:
         return jsonify({"message": "Você não está associado a nenhuma sala."}), 404
 
-    # 5. Busca as trilhas da sala
-    # Assumindo que a sala tem uma relação 'trilhas' que retorna uma lista
-    trilhas_da_sala = [t.to_dict() for t in sala.trilhas]
+    # 2. Trilhas da sala (ids carregados pelo @requer_funcao, dados do catálogo em memória)
+    trilhas_da_sala = catalogo.atual().trilhas_de(g.trilhas_ids)
     
     return jsonify({
         "sala_id": sala.id,
@@ -161,203 +99,215 @@ def get_aluno_trilhas():
 
 # ROTA PARA VER OS JOGOS DE UMA TRILHA, PELO ALUNO - TESTADA E FUNCIONANDO
 @aluno_bp.route('/trilhas/<int:trilha_id>/jogos', methods=['GET'])
-@jwt_required()
+@requer_funcao('aluno', carregar=False)
 def get_jogos_da_trilha(trilha_id):
-    claims = get_jwt()
-    
-    # 1. VALIDAÇÃO DE FUNÇÃO: Garante que apenas ALUNOS acessem esta rota.
-    if claims.get('funcao') != 'aluno':
-        return jsonify({"message": "Acesso negado: Apenas Alunos podem acessar esta rota."}), 403
-
-    # 2. ENCONTRAR O ALUNO LOGADO
-    try:
-        aluno_id = int(get_jwt_identity())
-    except ValueError:
-        return jsonify({"message": "ID de aluno no token inválido."}), 401
-
-    aluno = Aluno.query.get(aluno_id)
-    if not aluno:
-        return jsonify({"message": "Aluno não encontrado."}), 404
-
-    # 3. VERIFICAR AUTORIZAÇÃO: O aluno tem acesso a esta trilha?
-    
-    # Obtém a sala do aluno (assumindo 1:N com 'aluno.sala')
-    sala_do_aluno = aluno.sala
-    
-    if not sala_do_aluno:
+    # 1. VERIFICAR AUTORIZAÇÃO: O aluno tem acesso a esta trilha?
+    if not g.sala_id:
         return jsonify({"message": "Você não está associado a nenhuma sala com trilhas disponíveis."}), 403
 
-    # Verifica se o trilha_id está na lista de trilhas da sala do aluno
-    trilha_valida_para_aluno = False
-    
-    # Percorre a coleção de trilhas da sala (sala_do_aluno.trilhas)
-    for trilha in sala_do_aluno.trilhas:
-        if trilha.id == trilha_id:
-            trilha_valida_para_aluno = True
-            break
-            
-    if not trilha_valida_para_aluno:
+    # Verifica se o trilha_id está entre as trilhas da sala do aluno (vindas do escopo do token)
+    if trilha_id not in g.trilhas_ids:
         return jsonify({"message": "Trilha indisponível: Esta trilha não está associada à sua sala."}), 403 # Forbidden
 
-    # 4. ENCONTRAR A TRILHA (já sabemos que ela existe e está na sala)
-    trilha = Trilha.query.get(trilha_id)
-    
-    # 5. RETORNA OS JOGOS
-    # Como a relação já foi definida no modelo, é fácil acessar os jogos
-    jogos_da_trilha = [j.to_dict() for j in trilha.jogos]
+    # 2. ENCONTRAR A TRILHA NO CATÁLOGO (já sabemos que ela está na sala)
+    foto = catalogo.atual()
+    trilha = foto.trilhas.get(trilha_id)
+    if not trilha:
+        return jsonify({"message": "Trilha não encontrada."}), 404
     
+    # 3. RETORNA OS JOGOS
     return jsonify({
-        "trilha_id": trilha.id,
-        "trilha_nome": trilha.nome,
-        "jogos": jogos_da_trilha
+        "trilha_id": trilha['id'],
+        "trilha_nome": trilha['nome'],
+        "jogos": list(foto.jogos_da_trilha(trilha_id))
     }), 200
 
+def _resposta_anterior(aluno_id, chave):
+    # Resposta original de um envio com a mesma Idempotency-Key: cache/banco ou, com escrita adiada,
+    # o journal ainda não gravado
+    return idempotencia.buscar(aluno_id, chave) or fila_desempenho.resposta_pendente(aluno_id, chave)
+
 # ROTA PARA SALVAR DESEMPENHO DO ALUNO - TESTADA E FUNCIONANDO
 @aluno_bp.route('/desempenho', methods=['POST'])
-@jwt_required()
+@requer_funcao('aluno', carregar=False)
 def save_desempenho():
-    claims = get_jwt()
-
-    if claims.get('funcao') != 'aluno':
-        return jsonify({"message": "Acesso negado: Apenas Alunos podem salvar desempenho."}), 403
-    
-    # 2. EXTRAÇÃO DE ID: Pega o ID puro do token
-    identity = get_jwt_identity()
-    try:
-        aluno_id = int(identity)
-    except ValueError:
-        return jsonify({"message": "ID de aluno no token inválido."}), 401
-    
-    aluno = Aluno.query.get(aluno_id)
-    if not aluno:
-        return jsonify({"message": "Aluno não encontrado."}), 404
-
-    # 3. Recebe os dados
-    data = request.get_json()
-    jogo_id = data.get('jogo_id')
-    trilha_id = data.get('trilha_id')
-    passou = data.get('passou')          
-    
-    # Campos que agora aceitam LISTAS/JSON
-    acertos = data.get('acertos', [])    # Garante que seja pelo menos uma lista vazia
-    erros = data.get('erros', [])        # Garante que seja pelo menos uma lista vazia
-
-    # 4. Validação inicial dos dados
-    # A validação agora checa se acertos e erros são listas, e se os IDs e 'passou' estão presentes.
-    if not all([jogo_id, trilha_id, passou is not None, isinstance(acertos, list), isinstance(erros, list)]):
-         return jsonify({"message": "Dados incompletos ou formatos inválidos. Verifique jogo, trilha, resultado e se acertos/erros são listas."}), 400
-
-    # 5. Encontra a sala do aluno para associar o desempenho
-    sala_do_aluno = aluno.sala # Usando a relação singular (1:N)
-    if not sala_do_aluno:
+    # 1. Aluno logado, sala e trilhas dele (vindos do escopo do token pelo @requer_funcao)
+    aluno_id = g.aluno_id
+
+    # 2. IDEMPOTÊNCIA: um reenvio com a mesma 'Idempotency-Key' recebe a resposta original,
+    # sem validar nem gravar de novo
+    chave = request.headers.get('Idempotency-Key')
+    if chave is not None:
+        if idempotencia.chave_invalida(chave):
+            return jsonify({"message": "Idempotency-Key inválida: use de 1 a 64 caracteres."}), 400
+        resposta = _resposta_anterior(aluno_id, chave)
+        if resposta:
+            corpo, status = resposta
+            return jsonify(corpo), status
+
+    # 3. Sala do aluno para associar o desempenho
+    sala_id = g.sala_id
+    if not sala_id:
         return jsonify({"message": "Você não está associado a nenhuma sala. Não é possível salvar o desempenho."}), 404
 
-    # 6. Validação adicional: garante que o jogo e trilha existem e são válidos
-    jogo = Jogo.query.get(jogo_id)
-    trilha = Trilha.query.get(trilha_id)
-    
-    if not jogo or not trilha:
-        return jsonify({"message": "Jogo ou trilha não encontrados."}), 404
-        
-    # VERIFICAÇÃO DE AUTORIZAÇÃO: Garante que a trilha é da sala do aluno
-    if trilha not in sala_do_aluno.trilhas:
-        return jsonify({"message": "Trilha não pertence à sua sala. Desempenho não pode ser salvo."}), 403
-
-    # 7. Salva o desempenho no banco de dados
+    # 4. Validação dos dados e VERIFICAÇÃO DE AUTORIZAÇÃO (trilha da sala do aluno, jogo e trilha
+    # existentes), sem consultar o banco: escopo do token + catálogo em memória
+    foto = catalogo.atual()
+    tentativa, erro = validar_tentativa(request.get_json(silent=True) or {}, g.trilhas_ids, foto)
+    if erro:
+        mensagem, codigo = erro
+        return jsonify({"message": mensagem}), codigo
+
+    # 5a. Escrita adiada: a tentativa vai para o journal local e é gravada em segundo plano
+    if fila_desempenho.habilitada:
+        corpo = {
+            "message": "Desempenho recebido! Ele será salvo em instantes.",
+            "desempenho": tentativa_to_dict(dict(tentativa, aluno_id=aluno_id, sala_id=sala_id))
+        }
+        try:
+            fila_desempenho.enfileirar(aluno_id, sala_id, [tentativa], chave, (corpo, 202))
+        except OSError as e:
+            return jsonify({"message": f"Erro ao salvar desempenho: {str(e)}"}), 500
+        if chave:
+            idempotencia.lembrar(aluno_id, chave, corpo, 202)
+        return jsonify(corpo), 202
+
+    # 5b. Salva o desempenho, a progressão do aluno na trilha e a chave de idempotência (mesma transação)
     try:
-        novo_desempenho = DesempenhoJogo(
-            aluno_id=aluno.id,
-            jogo_id=jogo.id,
-            trilha_id=trilha.id,
-            sala_id=sala_do_aluno.id,
-            passou=passou,
-            acertos=acertos,  # SQLAlchemy salvará esta lista como JSON
-            erros=erros       # SQLAlchemy salvará esta lista como JSON
-        )
-        db.session.add(novo_desempenho)
+        desempenho = novo_desempenho(aluno_id, sala_id, tentativa, foto)
+        db.session.flush() # id do desempenho para a resposta
+        corpo = {"message": "Desempenho salvo com sucesso!", "desempenho": desempenho.to_dict()}
+        if chave:
+            idempotencia.registrar(aluno_id, chave, corpo, 201)
         db.session.commit()
-
-        return jsonify({"message": "Desempenho salvo com sucesso!", "desempenho": novo_desempenho.to_dict()}), 201
     except Exception as e:
         db.session.rollback()
+        # Reenvio simultâneo com a mesma chave: a outra requisição gravou primeiro (índice único)
+        resposta = chave and idempotencia.buscar(aluno_id, chave)
+        if resposta:
+            corpo, status = resposta
+            return jsonify(corpo), status
         return jsonify({"message": f"Erro ao salvar desempenho: {str(e)}"}), 500
 
+    if chave:
+        idempotencia.lembrar(aluno_id, chave, corpo, 201)
+    return jsonify(corpo), 201
+
+# ROTA PARA SALVAR VÁRIAS TENTATIVAS DE UMA VEZ (jogos que acumulam tentativas offline)
+@aluno_bp.route('/desempenho/batch', methods=['POST'])
+@requer_funcao('aluno', carregar=False)
+def save_desempenho_batch():
+    # 1. Aluno logado, sala e trilhas dele (escopo do token): uma única autorização para o lote inteiro
+    aluno_id = g.aluno_id
+
+    # 2. IDEMPOTÊNCIA: a 'Idempotency-Key' vale para o lote inteiro
+    chave = request.headers.get('Idempotency-Key')
+    if chave is not None:
+        if idempotencia.chave_invalida(chave):
+            return jsonify({"message": "Idempotency-Key inválida: use de 1 a 64 caracteres."}), 400
+        resposta = _resposta_anterior(aluno_id, chave)
+        if resposta:
+            corpo, status = resposta
+            return jsonify(corpo), status
+
+    sala_id = g.sala_id
+    if not sala_id:
+        return jsonify({"message": "Você não está associado a nenhuma sala. Não é possível salvar o desempenho."}), 404
+
+    # 3. Recebe o lote: {"tentativas": [...]} ou a lista diretamente
+    data = request.get_json(silent=True)
+    itens = data.get('tentativas') if isinstance(data, dict) else data
+    limite = current_app.config.get('DESEMPENHO_BATCH_MAX', 500)
+
+    if not isinstance(itens, list) or not itens:
+        return jsonify({"message": "Envie uma lista de tentativas não vazia."}), 400
+    if len(itens) > limite:
+        return jsonify({"message": f"Lote muito grande: envie no máximo {limite} tentativas por requisição."}), 413
+
+    # 4. Valida cada item (sem consultar o banco); itens inválidos não impedem os demais
+    foto = catalogo.atual()
+    agora = datetime.utcnow()
+    escrita_adiada = fila_desempenho.habilitada
+    status_item, mensagem_item = (202, "Desempenho recebido! Ele será salvo em instantes.") if escrita_adiada \
+        else (201, "Desempenho salvo com sucesso!")
+    resultados = []
+    validas = []
+
+    for indice, item in enumerate(itens):
+        tentativa, erro = validar_tentativa(item, g.trilhas_ids, foto, agora)
+        if erro:
+            mensagem, codigo = erro
+            resultados.append({"indice": indice, "status": codigo, "message": mensagem})
+        else:
+            validas.append(tentativa)
+            resultados.append({"indice": indice, "status": status_item, "message": mensagem_item})
+
+    corpo = {
+        "salvos": len(validas),
+        "rejeitados": len(itens) - len(validas),
+        "resultados": resultados
+    }
+    status = 202 if escrita_adiada else 200
+
+    # 5a. Escrita adiada: o lote vai para o journal local e é gravado em segundo plano
+    if escrita_adiada:
+        try:
+            fila_desempenho.enfileirar(aluno_id, sala_id, validas, chave, (corpo, status))
+        except OSError as e:
+            return jsonify({"message": f"Erro ao salvar desempenhos: {str(e)}"}), 500
+
+    # 5b. Grava as válidas num único INSERT + progressão + chave de idempotência, numa única transação
+    else:
+        try:
+            inserir_em_lote(aluno_id, sala_id, validas, foto)
+            if chave:
+                idempotencia.registrar(aluno_id, chave, corpo, status)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            resposta = chave and idempotencia.buscar(aluno_id, chave)
+            if resposta:
+                corpo, status = resposta
+                return jsonify(corpo), status
+            return jsonify({"message": f"Erro ao salvar desempenhos: {str(e)}"}), 500
+
+    if chave:
+        idempotencia.lembrar(aluno_id, chave, corpo, status)
+    return jsonify(corpo), status
+
 # ROTA PARA OBTER O MAPA DE JOGOS E STATUS DE PROGRESSÃO
 @aluno_bp.route('/trilhas/<int:trilha_id>/progressao', methods=['GET'])
-@jwt_required()
+@requer_funcao('aluno', carregar=False)
 def get_progressao_trilha(trilha_id):
-    # 1. VALIDAÇÃO E OBTENÇÃO DO ALUNO
-    claims = get_jwt()
-    if claims.get('funcao') != 'aluno':
-        return jsonify({"message": "Acesso negado: Apenas Alunos podem acessar esta rota."}), 403
-
-    try:
-        aluno_id = int(get_jwt_identity())
-    except ValueError:
-        return jsonify({"message": "ID de aluno no token inválido."}), 401
-
-    aluno = Aluno.query.get(aluno_id)
-    if not aluno or not aluno.sala:
+    # 1. ALUNO LOGADO (sala e trilhas vindas do escopo do token pelo @requer_funcao)
+    aluno_id = g.aluno_id
+    if not g.sala_id:
         return jsonify({"message": "Aluno ou Sala não encontrados."}), 404
 
     # 2. VERIFICAÇÃO DE AUTORIZAÇÃO E TRILHA
-    trilha = Trilha.query.get(trilha_id)
-    if not trilha:
-        return jsonify({"message": "Trilha não encontrada."}), 404
-
     # Garante que a trilha está associada à sala do aluno
-    if trilha not in aluno.sala.trilhas:
+    if trilha_id not in g.trilhas_ids:
         return jsonify({"message": "Trilha indisponível para sua sala."}), 403
+
+    foto = catalogo.atual()
+    trilha = foto.trilhas.get(trilha_id)
+    if not trilha:
+        return jsonify({"message": "Trilha não encontrada."}), 404
     
     # 3. OBTÉM JOGOS E DESEMPENHO CONCLUÍDO
-    
-    # Carrega os jogos da trilha (assume-se que a ordem é pelo ID do jogo, 
-    # ou você pode adicionar uma coluna 'ordem' no futuro)
-    jogos_da_trilha = sorted(trilha.jogos, key=lambda j: j.id)
-
-    # Busca todos os desempenhos CONCLUÍDOS (passou=True) do aluno nesta trilha
-    # Isso é mais eficiente do que buscar um por um
-    desempenhos_concluidos = DesempenhoJogo.query.filter_by(
-        aluno_id=aluno_id,
-        trilha_id=trilha_id,
-        passou=True
-    ).all()
-
-    # Cria um set (conjunto) dos IDs dos jogos que o aluno já CONCLUIU
-    jogos_concluidos_ids = {d.jogo_id for d in desempenhos_concluidos}
+    # Jogos da trilha do catálogo, já em ordem de ID (ou uma coluna 'ordem' no futuro), e os jogos
+    # que o aluno já CONCLUIU, lidos do estado de progressão (uma leitura por chave primária)
+    jogos_da_trilha = foto.jogos_da_trilha(trilha_id)
+    jogos_concluidos_ids = jogos_concluidos(aluno_id, trilha_id)
+    # Com escrita adiada, inclui as tentativas do aluno que ainda estão no journal
+    jogos_concluidos_ids |= fila_desempenho.concluidos_pendentes(aluno_id, trilha_id)
 
     # 4. LÓGICA DE PROGRESSÃO E MONTAGEM DO MAPA
-    mapa_jogos = []
-    jogo_anterior_concluido = True # O primeiro jogo sempre começa liberado (assume True)
-
-    for i, jogo in enumerate(jogos_da_trilha):
-        jogo_dict = jogo.to_dict()
-        
-        # O Jogo 1 (índice 0) está sempre liberado
-        if i == 0:
-            status = "liberado"
-        # O jogo anterior precisa ter sido concluído
-        elif jogo_anterior_concluido:
-            status = "liberado"
-        else:
-            status = "bloqueado"
-
-        # SOBRESCREVE o status se o jogo JÁ FOI CONCLUÍDO
-        if jogo.id in jogos_concluidos_ids:
-            status = "concluido"
-            # O jogo anterior para o PRÓXIMO jogo é este, e ele foi concluído.
-            jogo_anterior_concluido = True
-        else:
-            # Se o jogo não foi concluído, ele (ou um anterior) bloqueia o próximo
-            # Este status é usado para verificar a regra 'jogo_anterior_concluido'
-            jogo_anterior_concluido = False
-            
-        jogo_dict['status'] = status
-        mapa_jogos.append(jogo_dict)
+    mapa_jogos = montar_mapa(jogos_da_trilha, jogos_concluidos_ids)
 
     # 5. RETORNO FINAL
     return jsonify({
-        "trilha_id": trilha.id,
-        "trilha_nome": trilha.nome,
+        "trilha_id": trilha['id'],
+        "trilha_nome": trilha['nome'],
         "mapa_jogos": mapa_jogos
     }), 200
\ No newline at end of file
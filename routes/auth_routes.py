@@ -1,7 +1,10 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token, jwt_required, get_jwt, get_jwt_identity
 from blacklist import BLACKLIST
-from models import db, Admin, Professor, Aluno
+from models import db, Admin, Credencial, MODELOS_POR_FUNCAO
+from hashing import servico_hash
+from autorizacao import escopo_do_aluno
+from limitador import limitador_login
 from flask_cors import CORS
 
 auth_bp = Blueprint('auth_bp', __name__, url_prefix='/api/auth')
@@ -17,7 +20,8 @@ def register_admin():
     if not nome or not email or not senha:
         return jsonify({"message": "Nome, email e senha são obrigatórios para o cadastro."}), 400
 
-    if Admin.query.filter_by(email=email).first():
+    # O email é único entre admins, professores e alunos (índice de credenciais)
+    if Credencial.email_em_uso(email):
         return jsonify({"message": "Email já cadastrado."}), 409
     
     try:
@@ -25,6 +29,8 @@ def register_admin():
         novo_admin.senha = senha
 
         db.session.add(novo_admin)
+        db.session.flush() # Gera o id para a credencial
+        Credencial.sincronizar(novo_admin, 'admin')
         db.session.commit()
 
         return jsonify({"message": "Administrador cadastrado com sucesso!"}), 201
@@ -42,56 +48,113 @@ def login():
     if not email or not senha:
         return jsonify({"message": "Email e senha são obrigatórios para o login."}), 400
 
-    # 1. Tentar encontrar e autenticar como ADMIN (Prioridade 1)
-    user = Admin.query.filter_by(email=email).first()
-    if user and user.verificar_senha(senha):
-        funcao = 'admin'
-        # Adiciona a informação da função ao payload do token
-        additional_claims = {"funcao": funcao} 
-    
-    # 2. Tentar encontrar e autenticar como PROFESSOR (Prioridade 2)
-    else:
-        user = Professor.query.filter_by(email=email).first()
-        if user and user.verificar_senha(senha):
-            funcao = 'professor'
-            # Adiciona a informação da função ao payload do token
-            additional_claims = {"funcao": funcao}
-        
-        # 3. Tentar encontrar e autenticar como ALUNO (Prioridade 3)
-        else:
-            user = Aluno.query.filter_by(email=email).first()
-            if user and user.verificar_senha(senha):
-                funcao = 'aluno'
-                # Adiciona a informação da função ao payload do token
-                additional_claims = {"funcao": funcao}
-            
-            # Autenticação falhou em todas as tabelas
-            else:
-                return jsonify({"message": "Email ou senha incorretos."}), 401
+    # Email e senha precisam ser texto (o limitador normaliza o email e o hash lê a senha)
+    if not isinstance(email, str) or not isinstance(senha, str):
+        return jsonify({"message": "Email e senha devem ser textos."}), 400
+
+    # 0. Limite de tentativas por email e por IP, checado antes de qualquer consulta ou hash de senha
+    espera = limitador_login.permitir(email, request.remote_addr or '')
+    if espera is not None:
+        resposta = jsonify({"message": "Muitas tentativas de login. Tente novamente em alguns instantes."})
+        resposta.headers['Retry-After'] = str(espera)
+        return resposta, 429
+
+    # 1. Uma única consulta indexada no índice de credenciais resolve a função e o id do usuário
+    credencial = Credencial.query.filter_by(email=email).first()
+
+    # Autenticação falhou (email inexistente ou senha incorreta)
+    if not credencial or not credencial.verificar_senha(senha):
+        return jsonify({"message": "Email ou senha incorretos."}), 401
+
+    funcao = credencial.funcao
+
+    # 2. Hash gravado com algoritmo/custo antigos: refaz com os parâmetros atuais do Config
+    # (só é possível aqui, enquanto temos a senha em texto puro). Uma falha não impede o login.
+    if servico_hash.precisa_rehash(credencial.senha_hash):
+        try:
+            usuario = MODELOS_POR_FUNCAO[funcao].query.get(credencial.usuario_id)
+            usuario.senha = senha
+            credencial.senha_hash = usuario.senha_hash
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+
+    # Adiciona a informação da função ao payload do token
+    additional_claims = {"funcao": funcao}
+    # Aluno: sala e trilhas liberadas vão no token, para autorizar as rotas de jogo sem consultar o banco
+    if funcao == 'aluno':
+        additional_claims["escopo"] = escopo_do_aluno(credencial.usuario_id)
 
     # Autenticação bem-sucedida
     
     # Criamos o token com o ID do usuário e a função (role) em 'additional_claims'
     access_token = create_access_token(
-        identity=str(user.id), 
+        identity=str(credencial.usuario_id), 
+        additional_claims=additional_claims
+    )
+    # O refresh token (30 dias) permite renovar o access token em /refresh sem repetir o hash da senha
+    refresh_token = create_refresh_token(
+        identity=str(credencial.usuario_id),
         additional_claims=additional_claims
     )
     
     # Retorna o token e a função do usuário para o frontend saber qual fluxo seguir
     return jsonify(
         access_token=access_token,
-        usuario_id=user.id,
+        refresh_token=refresh_token,
+        usuario_id=credencial.usuario_id,
         funcao=funcao
     ), 200
 
+# ROTA PARA RENOVAR O ACCESS TOKEN USANDO O REFRESH TOKEN (Authorization: Bearer <refresh_token>)
+@auth_bp.route('/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    token = get_jwt()
+    identity = get_jwt_identity()
+    additional_claims = {"funcao": token.get('funcao')}
+    # O escopo do aluno é recalculado a cada refresh (a sala pode ter ganhado ou perdido trilhas)
+    if additional_claims["funcao"] == 'aluno':
+        escopo = escopo_do_aluno(int(identity))
+        if escopo is None:
+            return jsonify({"message": "Aluno não encontrado."}), 404
+        additional_claims["escopo"] = escopo
+
+    # Rotação: o refresh token usado é revogado e um novo é emitido junto com o access token.
+    # Reapresentar um refresh token já usado é recusado pela blacklist (401).
+    BLACKLIST.add(token["jti"], token["exp"])
+
+    access_token = create_access_token(identity=identity, additional_claims=additional_claims)
+    refresh_token = create_refresh_token(identity=identity, additional_claims=additional_claims)
+
+    return jsonify(
+        access_token=access_token,
+        refresh_token=refresh_token,
+        usuario_id=int(identity),
+        funcao=additional_claims["funcao"]
+    ), 200
+
 @auth_bp.route('/logout', methods=['POST'])
 @jwt_required()
 def logout():
-    jti = get_jwt()["jti"]
+    token = get_jwt()
+    jti = token["jti"]
+
+    # O refresh token da sessão, se enviado no corpo ({"refresh_token": ...}), também é revogado
+    data = request.get_json(silent=True) or {}
+    refresh_token = data.get('refresh_token')
+    if refresh_token:
+        try:
+            refresh_payload = decode_token(refresh_token)
+        except Exception:
+            return jsonify({"message": "Refresh token inválido."}), 400
+        if refresh_payload.get('type') != 'refresh' or refresh_payload.get('sub') != token.get('sub'):
+            return jsonify({"message": "Refresh token inválido."}), 400
+        BLACKLIST.add(refresh_payload["jti"], refresh_payload["exp"])
     
-    # Adiciona o JTI à lista de bloqueio
+    # Adiciona o JTI à lista de bloqueio (mantido somente até o token expirar)
     if jti:
-        BLACKLIST.add(jti)
+        BLACKLIST.add(jti, token["exp"])
         return jsonify({"message": "Logout bem-sucedido. Token revogado."}), 200
     
     return jsonify({"message": "Erro ao revogar token."}), 500
\ No newline at end of file
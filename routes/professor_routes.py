@@ -1,22 +1,35 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from sqlalchemy.orm import joinedload
+from flask import Blueprint, request, jsonify, g, Response, stream_with_context
 from sqlalchemy import or_
 
-# Importações de Ferramentas (IA)
-import google.generativeai as genai
 import json
+import logging
+import numpy as np
+from collections import Counter
+from datetime import datetime, timedelta
 
 # Importações dos Modelos
-from models import db, Aluno, Trilha, Jogo, DesempenhoJogo, Professor, Sala
+from models import db, Aluno, Trilha, DesempenhoJogo, DesempenhoFato, ResumoAlunoJogoDia, ResumoSalaJogoDia, ProgressoAlunoTrilha, JobAnaliseIA, Sala, Credencial, sala_trilha_association
+from autorizacao import requer_funcao, incrementar_versao_salas
+from catalogo import catalogo
+from fatos import agregar_fatos, fato_to_str, matriz_de_fatos
+from desempenho import tentativa_to_dict
+from progresso import montar_mapa
+from serializadores import SALA, ALUNO, TRILHA, incluir_pedidos
+import ia
 
 # Definição do Blueprint
 professor_bp = Blueprint('professor_bp', __name__, url_prefix='/api/professor')
 
-try:
-    IA_MODEL = genai.GenerativeModel('gemini-1.5-flash')
-except Exception:
-    IA_MODEL = None
+logger = logging.getLogger(__name__)
+
+def _trilha_na_sala(sala_id, trilha_id):
+    # Consulta direta na tabela de junção, sem carregar a lista de trilhas da sala
+    return db.session.query(
+        sala_trilha_association.select().where(
+            sala_trilha_association.c.sala_id == sala_id,
+            sala_trilha_association.c.trilha_id == trilha_id
+        ).exists()
+    ).scalar()
 
 #============================================ROTAS DO PROFESSOR====================================================
 
@@ -24,22 +37,12 @@ except Exception:
 
 #ROTAS PARA PESQUISAR SALAS POR NOME - NÃO TESTADA
 @professor_bp.route('/salas/search', methods=['GET'])
-@jwt_required()
+@requer_funcao('professor', carregar=False)
 def search_salas_professor():
-    claims = get_jwt()
-    
-    # 1. VALIDAÇÃO DE FUNÇÃO
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas professores podem pesquisar salas."}), 403
-
-    # 2. EXTRAÇÃO DO ID DO PROFESSOR LOGADO
-    professor_id_str = get_jwt_identity()
-    try:
-        professor_id = int(professor_id_str)
-    except ValueError:
-        return jsonify({"message": "ID de professor no token inválido."}), 401
+    # 1. ID DO PROFESSOR LOGADO (validado pelo @requer_funcao)
+    professor_id = g.professor_id
     
-    # 3. OBTÉM O TERMO DE PESQUISA
+    # 2. OBTÉM O TERMO DE PESQUISA
     search_term = request.args.get('query', None)
 
     if not search_term:
@@ -54,7 +57,7 @@ def search_salas_professor():
 
     termo_like = f"%{search_term}%"
     
-    # 4. EXECUTA A BUSCA COM FILTRO DE AUTORIZAÇÃO
+    # 3. EXECUTA A BUSCA COM FILTRO DE AUTORIZAÇÃO
     
     # Busca salas cujo nome contenha o termo
     # E que pertençam ao professor logado (professor_id)
@@ -70,81 +73,55 @@ def search_salas_professor():
 
 # ROTA PARA VER AS SALAS - TESTADA E FUNCIONANDO
 @professor_bp.route('/salas', methods=['GET'])
-@jwt_required()
+@requer_funcao('professor', carregar=False)
 def get_sala():
-    claims = get_jwt()
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas Professores podem acessar esta rota."}), 403
-
-    professor_id = get_jwt_identity()
-
-    # O uso do .options(joinedload()) pode otimizar a busca, mas vamos focar na contagem.
-    salas = Sala.query.filter_by(professor_id=professor_id).all()
+    professor_id = g.professor_id
+
+    # Uma única consulta: dados da sala + contagens de alunos e trilhas por subconsultas correlacionadas
+    # (índices de aluno.sala_id e sala_trilha.sala_id), sem carregar nem serializar alunos e trilhas
+    contagem_alunos = db.select(db.func.count(Aluno.id))\
+                        .where(Aluno.sala_id == Sala.id)\
+                        .correlate(Sala)\
+                        .scalar_subquery()
+    contagem_trilhas = db.select(db.func.count())\
+                         .select_from(sala_trilha_association)\
+                         .where(sala_trilha_association.c.sala_id == Sala.id)\
+                         .correlate(Sala)\
+                         .scalar_subquery()
+    salas = db.session.query(Sala.id, Sala.nome, Sala.professor_id, contagem_alunos, contagem_trilhas)\
+                      .filter(Sala.professor_id == professor_id)\
+                      .order_by(Sala.id)\
+                      .all()
     
     if not salas:
         return jsonify({"message": "Nenhuma sala encontrada para este professor."})
 
-    salas_com_contagem = []
-    
-    # Itera sobre as salas e calcula as contagens
-    for sala in salas:
-        # Pega os dados básicos da sala
-        sala_dict = sala.to_dict() 
-        
-        # *** ADICIONANDO AS CONTIDADES DE ALUNOS E TRILHAS ***
-        
-        # 1. Contagem de Alunos: Usa a coleção de relacionamento e o método count()
-        # Nota: 'alunos' é o nome do relacionamento na sua model Sala
-        sala_dict['contagem_alunos'] = sala.alunos.count()
-        sala_dict['contagem_trilhas'] = sala.trilhas.count()
-        
-        # 2. Contagem de Trilhas: Usa a coleção de relacionamento (sala_trilha)
-        # Nota: 'trilhas' deve ser o nome do relacionamento com a tabela sala_trilha
-        # Se você tiver um relacionamento direto 'sala.trilhas' ou 'sala.sala_trilhas':
-        try:
-             sala_dict['contagem_trilhas'] = sala.trilhas.count() 
-        except AttributeError:
-             # Caso o relacionamento seja diferente, ajuste o nome da propriedade
-             print(f"Aviso: O relacionamento 'trilhas' não existe no modelo Sala. Verifique o nome correto.")
-             sala_dict['contagem_trilhas'] = 0 # ou use o nome correto
-        
-        # Removendo a lista completa de alunos, pois o frontend só precisa da contagem
-        if 'alunos' in sala_dict:
-             del sala_dict['alunos']
-             
-        if 'trilhas' in sala_dict:
-         del sala_dict['trilhas']
-             
-        salas_com_contagem.append(sala_dict)
+    salas_com_contagem = [{
+        "id": sala_id,
+        "nome": nome,
+        "professor_id": professor_id_sala,
+        "contagem_alunos": total_alunos,
+        "contagem_trilhas": total_trilhas
+    } for sala_id, nome, professor_id_sala, total_alunos, total_trilhas in salas]
     
     return jsonify(salas_com_contagem), 200
 
 @professor_bp.route('/trilhas', methods=['GET'])
-@jwt_required()
+@requer_funcao('professor', carregar=False)
 def get_trilhas():
-    claims = get_jwt()
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas Professores podem acessar esta rota."}), 403
-
-    # Busca todas as trilhas (sem filtrar por professor)
-    trilhas = Trilha.query.all()
+    # Todas as trilhas (sem filtrar por professor), do catálogo em memória
+    trilhas = catalogo.atual().lista_trilhas
 
     if not trilhas:
         return jsonify({"message": "Nenhuma trilha cadastrada no sistema."}), 200
 
-    trilhas_data = [trilha.to_dict() for trilha in trilhas]
-
-    return jsonify(trilhas_data), 200
+    return jsonify(list(trilhas)), 200
 
 # ROTA PARA CRIAR SALAS - TESTADA E FUNCIONANDO
 @professor_bp.route('/salas', methods=['POST'])
-@jwt_required()
+@requer_funcao('professor', carregar=False)
 def create_sala():
-    claims = get_jwt()
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas Professores podem acessar esta rota."}), 403
-        
-    professor_id = get_jwt_identity()
+    professor_id = g.professor_id
     data = request.get_json()
     nome_sala = data.get('nome')
     trilhas_ids = data.get('trilhas_ids', []) 
@@ -182,39 +159,197 @@ def create_sala():
         return jsonify({"message": f"Erro ao criar sala: {str(e)}"}), 500
     
 @professor_bp.route('/salas/<int:sala_id>', methods=['GET'])
-@jwt_required()
+@requer_funcao('professor', carregar=False)
 def get_sala_by_id(sala_id):
-    claims = get_jwt()
+    # 1. ID do professor autenticado (validado pelo @requer_funcao)
+    professor_id = g.professor_id
+
+    # 2. Campos pedidos (?fields=, ?fields[alunos]=, ?fields[trilhas]=) e relacionamentos a incluir
+    # (?include=alunos,trilhas; sem o parâmetro, os dois, como antes)
+    campos_sala, erro = SALA.campos_pedidos(request.args.get('fields'))
+    campos_alunos, erro_alunos = ALUNO.campos_pedidos(request.args.get('fields[alunos]'))
+    campos_trilhas, erro_trilhas = TRILHA.campos_pedidos(request.args.get('fields[trilhas]'))
+    incluir, erro_incluir = incluir_pedidos(request.args.get('include'), ('alunos', 'trilhas'), ('alunos', 'trilhas'))
+    erro = erro or erro_alunos or erro_trilhas or erro_incluir
+    if erro:
+        return jsonify({"message": erro}), 400
+
+    # 3. Busca a sala com o ID informado e pertencente ao professor logado (só as colunas pedidas)
+    sala = Sala.query.options(SALA.opcoes(campos_sala)).filter_by(id=sala_id, professor_id=professor_id).first()
 
-    # 1. Verifica se o usuário logado é um professor
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas Professores podem acessar esta rota."}), 403
+    if not sala:
+        return jsonify({"message": "Sala não encontrada ou você não tem permissão para acessá-la."}), 404
 
-    # 2. Obtém o ID do professor autenticado
-    professor_id = get_jwt_identity()
+    # 4. Monta o dicionário da sala e só os relacionamentos pedidos: alunos com load_only numa consulta,
+    # trilhas pelos ids da tabela de junção + catálogo em memória
+    sala_dict = SALA.objeto(sala, campos_sala)
+    if 'alunos' in incluir:
+        alunos = Aluno.query.options(ALUNO.opcoes(campos_alunos)).filter_by(sala_id=sala_id).order_by(Aluno.id)
+        sala_dict['alunos'] = ALUNO.lista(alunos, campos_alunos)
+    if 'trilhas' in incluir:
+        trilhas_ids = {trilha_id for (trilha_id,) in db.session.query(sala_trilha_association.c.trilha_id)
+                       .filter(sala_trilha_association.c.sala_id == sala_id)}
+        sala_dict['trilhas'] = TRILHA.lista_de_dicts(catalogo.atual().trilhas_de(trilhas_ids), campos_trilhas)
+
+    # 5. Retorna os dados da sala
+    return jsonify(sala_dict), 200
 
-    # 3. Busca a sala com o ID informado e pertencente ao professor logado
-    sala = Sala.query.filter_by(id=sala_id, professor_id=professor_id).first()
+# ROTA PARA VER OS FATOS (EX.: "3x4") QUE A SALA MAIS ERRA
+@professor_bp.route('/salas/<int:sala_id>/fatos', methods=['GET'])
+@requer_funcao('professor')
+def get_fatos_da_sala(sala_id):
+    # 1. A sala precisa ser do professor logado (salas carregadas pelo @requer_funcao)
+    if sala_id not in g.salas_ids:
+        return jsonify({"message": "Sala não encontrada ou você não tem permissão para acessá-la."}), 404
 
-    if not sala:
+    # 2. Filtro opcional por trilha (?trilha_id=)
+    filtros = [DesempenhoFato.sala_id == sala_id]
+    trilha_id = request.args.get('trilha_id', type=int)
+    if trilha_id is not None:
+        filtros.append(DesempenhoFato.trilha_id == trilha_id)
+
+    # 3. Acertos por fato agregados no banco (índice sala_id, fator_a, fator_b, correto)
+    fatos = []
+    for fator_a, fator_b, total, acertos in agregar_fatos(*filtros):
+        acertos = int(acertos or 0)
+        fatos.append({
+            "fato": fato_to_str(fator_a, fator_b),
+            "tentativas": total,
+            "acertos": acertos,
+            "erros": total - acertos,
+            "taxa_acerto": round(acertos / total, 4) if total else None
+        })
+
+    # 4. Os mais errados primeiro
+    fatos.sort(key=lambda f: (-f["erros"], f["taxa_acerto"]))
+    return jsonify({"sala_id": sala_id, "trilha_id": trilha_id, "fatos": fatos}), 200
+
+# ROTA DO PAINEL DA SALA: TENTATIVAS E APROVAÇÕES POR DIA E POR JOGO NOS ÚLTIMOS DIAS
+@professor_bp.route('/salas/<int:sala_id>/painel', methods=['GET'])
+@requer_funcao('professor')
+def get_painel_da_sala(sala_id):
+    # 1. A sala precisa ser do professor logado (salas carregadas pelo @requer_funcao)
+    if sala_id not in g.salas_ids:
         return jsonify({"message": "Sala não encontrada ou você não tem permissão para acessá-la."}), 404
 
-    # 4. Monta o dicionário da sala com os alunos vinculados
-    sala_dict = sala.to_dict()
-    sala_dict['alunos'] = [aluno.to_dict() for aluno in sala.alunos]
+    # 2. Período (?dias=, padrão 30, máximo 365) e filtro opcional por trilha (?trilha_id=)
+    dias = min(max(request.args.get('dias', 30, type=int), 1), 365)
+    desde = datetime.utcnow().date() - timedelta(days=dias - 1)
+    consulta = ResumoSalaJogoDia.query.filter(ResumoSalaJogoDia.sala_id == sala_id, ResumoSalaJogoDia.dia >= desde)
+    trilha_id = request.args.get('trilha_id', type=int)
+    if trilha_id is not None:
+        consulta = consulta.filter(ResumoSalaJogoDia.trilha_id == trilha_id)
+
+    # 3. Soma os resumos diários da sala (uma linha por jogo × dia, sem ler as tentativas)
+    por_dia = {}
+    por_jogo = {}
+    for resumo in consulta:
+        for total in (por_dia.setdefault(resumo.dia, {"tentativas": 0, "aprovacoes": 0, "acertos": 0, "erros": 0}),
+                      por_jogo.setdefault(resumo.jogo_id, {"trilha_id": resumo.trilha_id, "tentativas": 0, "aprovacoes": 0, "acertos": 0, "erros": 0})):
+            total["tentativas"] += resumo.tentativas
+            total["aprovacoes"] += resumo.aprovacoes
+            total["acertos"] += resumo.acertos
+            total["erros"] += resumo.erros
+
+    foto = catalogo.atual()
+    jogos = []
+    for jogo_id, total in sorted(por_jogo.items()):
+        jogo = foto.jogos.get(jogo_id)
+        jogos.append(dict(total, jogo_id=jogo_id, jogo_nome=jogo['nome'] if jogo else "Jogo Desconhecido",
+                          taxa_aprovacao=round(total["aprovacoes"] / total["tentativas"], 4)))
+
+    # 4. Retorna as séries do painel
+    return jsonify({
+        "sala_id": sala_id,
+        "trilha_id": trilha_id,
+        "desde": desde.isoformat(),
+        "por_dia": [dict(total, dia=dia.isoformat(), taxa_aprovacao=round(total["aprovacoes"] / total["tentativas"], 4))
+                    for dia, total in sorted(por_dia.items())],
+        "por_jogo": jogos
+    }), 200
 
-    # 5. Retorna os dados completos da sala
-    return jsonify(sala_dict), 200
+# ROTA DO MAPA DE CALOR DA SALA: ACERTO DE CADA ALUNO EM CADA FATO ("3x4")
+@professor_bp.route('/salas/<int:sala_id>/heatmap', methods=['GET'])
+@requer_funcao('professor')
+def get_heatmap_da_sala(sala_id):
+    # 1. A sala precisa ser do professor logado (salas carregadas pelo @requer_funcao)
+    if sala_id not in g.salas_ids:
+        return jsonify({"message": "Sala não encontrada ou você não tem permissão para acessá-la."}), 404
+
+    # 2. Linhas do mapa: alunos atuais da sala, por nome (só as colunas id e nome)
+    alunos = db.session.query(Aluno.id, Aluno.nome).filter_by(sala_id=sala_id).order_by(Aluno.nome, Aluno.id).all()
+
+    # 3. Filtro opcional por trilha (?trilha_id=) e matriz alunos × fatos montada com NumPy
+    filtros = [DesempenhoFato.sala_id == sala_id]
+    trilha_id = request.args.get('trilha_id', type=int)
+    if trilha_id is not None:
+        filtros.append(DesempenhoFato.trilha_id == trilha_id)
+    fatos, tentativas, acertos = matriz_de_fatos([aluno.id for aluno in alunos], *filtros)
+
+    # 4. Taxa de acerto por célula (null onde o aluno não respondeu o fato)
+    taxa_acerto = np.round(np.divide(acertos, tentativas, out=np.zeros(tentativas.shape), where=tentativas > 0), 3).astype(object)
+    taxa_acerto[tentativas == 0] = None
+
+    # 5. Retorna a matriz densa: linha i = alunos[i], coluna j = fatos[j]
+    return jsonify({
+        "sala_id": sala_id,
+        "trilha_id": trilha_id,
+        "alunos": [{"id": aluno.id, "nome": aluno.nome} for aluno in alunos],
+        "fatos": [fato_to_str(fator_a, fator_b) for fator_a, fator_b in fatos],
+        "tentativas": tentativas.tolist(),
+        "taxa_acerto": taxa_acerto.tolist()
+    }), 200
+
+# ROTA DA PROGRESSÃO DA SALA EM UMA TRILHA: STATUS DE CADA JOGO PARA CADA ALUNO
+@professor_bp.route('/salas/<int:sala_id>/trilhas/<int:trilha_id>/progressao', methods=['GET'])
+@requer_funcao('professor')
+def get_progressao_da_sala(sala_id, trilha_id):
+    # 1. A sala precisa ser do professor logado e a trilha precisa estar na sala
+    if sala_id not in g.salas_ids:
+        return jsonify({"message": "Sala não encontrada ou você não tem permissão para acessá-la."}), 404
+    if not _trilha_na_sala(sala_id, trilha_id):
+        return jsonify({"message": "Esta trilha não está associada à sala informada."}), 403
+
+    foto = catalogo.atual()
+    trilha = foto.trilhas.get(trilha_id)
+    if not trilha:
+        return jsonify({"message": "Trilha não encontrada."}), 404
+
+    # 2. Alunos da sala com os jogos concluídos na trilha, numa única consulta
+    # (estado de progressão, mantido a cada tentativa salva; aluno sem linha = nenhum jogo concluído)
+    linhas = db.session.query(Aluno.id, Aluno.nome, ProgressoAlunoTrilha.jogos_concluidos)\
+                       .outerjoin(ProgressoAlunoTrilha, db.and_(ProgressoAlunoTrilha.aluno_id == Aluno.id,
+                                                                ProgressoAlunoTrilha.trilha_id == trilha_id))\
+                       .filter(Aluno.sala_id == sala_id)\
+                       .order_by(Aluno.nome, Aluno.id)\
+                       .all()
+
+    # 3. Mapa de cada aluno com a mesma regra do mapa do aluno (jogos do catálogo, em ordem)
+    jogos_da_trilha = foto.jogos_da_trilha(trilha_id)
+    alunos = []
+    for aluno_id, nome, concluidos in linhas:
+        mapa_jogos = montar_mapa(jogos_da_trilha, set(concluidos or ()))
+        alunos.append({
+            "id": aluno_id,
+            "nome": nome,
+            "concluidos": sum(1 for jogo in mapa_jogos if jogo['status'] == "concluido"),
+            "status": [jogo['status'] for jogo in mapa_jogos]
+        })
+
+    # 4. Retorna a matriz: alunos[i].status[j] é o status do jogo jogos[j]
+    return jsonify({
+        "sala_id": sala_id,
+        "trilha_id": trilha_id,
+        "trilha_nome": trilha['nome'],
+        "jogos": [{"id": jogo['id'], "nome": jogo['nome']} for jogo in jogos_da_trilha],
+        "alunos": alunos
+    }), 200
 
 # ROTA PARA EDITAR UMA SALA - TESTADA E FUNCIONANDO
 @professor_bp.route('/salas/<int:sala_id>', methods=['PUT'])
-@jwt_required()
+@requer_funcao('professor', carregar=False)
 def update_sala(sala_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas Professores podem acessar esta rota."}), 403
-
-    professor_id = get_jwt_identity()
+    professor_id = g.professor_id
     data = request.get_json()
     
     if not data:
@@ -244,13 +379,9 @@ def update_sala(sala_id):
 
 # ROTA PARA DELETAR UMA SALA - TESTADA E FUNCIONANDO - PRECISA DELETAR ALUNOS CONECTADOS
 @professor_bp.route('/salas/<int:sala_id>', methods=['DELETE'])
-@jwt_required()
+@requer_funcao('professor', carregar=False)
 def delete_sala(sala_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas Professores podem acessar esta rota."}), 403
-
-    professor_id = get_jwt_identity()
+    professor_id = g.professor_id
 
     sala = Sala.query.filter_by(id=sala_id, professor_id=professor_id).first()
 
@@ -258,6 +389,10 @@ def delete_sala(sala_id):
         return jsonify({"message": "Sala não encontrada ou você não tem permissão para deletá-la."}), 404
         
     try:
+        # Os alunos da sala são apagados em cascata: remove também as credenciais de login deles
+        Credencial.remover('aluno', [aluno_id for (aluno_id,) in sala.alunos.with_entities(Aluno.id)])
+        # Invalida o escopo (sala/trilhas) gravado nos tokens dos alunos da sala
+        incrementar_versao_salas([sala.id])
         db.session.delete(sala)
         db.session.commit()
         return jsonify({"message": "Sala deletada com sucesso!"}), 200
@@ -269,22 +404,9 @@ def delete_sala(sala_id):
 
 #ROTA PARA PESQUISAR ALUNOS POR NOME - NÃO TESTADA
 @professor_bp.route('/alunos/search', methods=['GET'])
-@jwt_required()
+@requer_funcao('professor')
 def search_alunos_professor():
-    claims = get_jwt()
-    
-    # 1. VALIDAÇÃO DE FUNÇÃO
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas professores podem pesquisar alunos."}), 403
-
-    # 2. EXTRAÇÃO DO ID DO PROFESSOR LOGADO
-    professor_id_str = get_jwt_identity()
-    try:
-        professor_id = int(professor_id_str)
-    except ValueError:
-        return jsonify({"message": "ID de professor no token inválido."}), 401
-    
-    # 3. OBTÉM O TERMO DE PESQUISA
+    # 1. OBTÉM O TERMO DE PESQUISA
     search_term = request.args.get('query', None)
 
     if not search_term:
@@ -292,16 +414,10 @@ def search_alunos_professor():
 
     termo_like = f"%{search_term}%"
     
-    # 4. ENCONTRA O PROFESSOR E SUAS SALAS
-    professor = Professor.query.get(professor_id)
-    if not professor:
-        return jsonify({"message": "Professor não encontrado."}), 404
+    # 2. EXECUTA A BUSCA COM FILTRO DE AUTORIZAÇÃO
     
-    # 5. EXECUTA A BUSCA COM FILTRO DE AUTORIZAÇÃO
-    
-    # Primeiro, identificamos os IDs de todas as salas pertencentes a este professor
-    # Assumindo que 'professor.salas' é uma relação que lista as salas dele.
-    sala_ids = [sala.id for sala in professor.salas]
+    # IDs de todas as salas pertencentes a este professor (carregados pelo @requer_funcao)
+    sala_ids = g.salas_ids
     
     if not sala_ids:
         return jsonify({"message": "Você não possui salas cadastradas para realizar a pesquisa."}), 404
@@ -323,13 +439,9 @@ def search_alunos_professor():
 
 # ROTA PARA VER OS ALUNOS DA SALA - TESTADA E FUNCIONANDO
 @professor_bp.route('/salas/<int:sala_id>/alunos', methods=['GET'])
-@jwt_required()
+@requer_funcao('professor', carregar=False)
 def get_alunos_da_sala(sala_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas Professores podem acessar esta rota."}), 403
-
-    professor_id = get_jwt_identity()
+    professor_id = g.professor_id
     # 1. Verifica se a sala existe E se ela pertence ao professor logado
     sala = Sala.query.filter_by(id=sala_id, professor_id=professor_id).first()
     if not sala:
@@ -346,18 +458,9 @@ def get_alunos_da_sala(sala_id):
 
 # ROTA PARA CRIAR UM ALUNO - TESTADA E FUNCIONANDO
 @professor_bp.route('/salas/<int:sala_id>/alunos', methods=['POST'])
-@jwt_required()
+@requer_funcao('professor', carregar=False)
 def create_aluno_na_sala(sala_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas professores podem acessar esta rota."}), 403
-    professor_id_str = get_jwt_identity()
-
-    try:
-        professor_id = int(professor_id_str)
-    except ValueError:
-        # Isso pode acontecer se o token for manipulado ou não contiver um ID válido.
-        return jsonify({"message": "ID de usuário no token inválido."}), 401
+    professor_id = g.professor_id
     data = request.get_json()
 
     nome = data.get('nome')
@@ -373,8 +476,8 @@ def create_aluno_na_sala(sala_id):
     if not sala:
         return jsonify({"message": "Sala não encontrada ou você não tem permissão para adicionar alunos a ela."}), 404
 
-    # 2. Verifica se o email já está em uso por outro aluno
-    if Aluno.query.filter_by(email=email).first():
+    # 2. Verifica se o email já está em uso por outro usuário (admin, professor ou aluno)
+    if Credencial.email_em_uso(email):
         return jsonify({"message": "Email já cadastrado."}), 409 # Conflict
 
     # 3. Cria o novo aluno e define a senha
@@ -385,6 +488,8 @@ def create_aluno_na_sala(sala_id):
         # 4. Adiciona o aluno ao banco de dados e à sala
         db.session.add(novo_aluno)
         sala.alunos.append(novo_aluno)
+        db.session.flush() # Gera o id para a credencial
+        Credencial.sincronizar(novo_aluno, 'aluno')
         db.session.commit()
         
         return jsonify({
@@ -397,12 +502,9 @@ def create_aluno_na_sala(sala_id):
 
 # ROTA PARA EDITAR ALUNO - TESTADA E FUNCIONANDO
 @professor_bp.route('/salas/<int:sala_id>/alunos/<int:aluno_id>', methods=['PUT'])
-@jwt_required()
+@requer_funcao('professor', carregar=False)
 def update_aluno_na_sala(sala_id, aluno_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas Professores podem acessar esta rota."}), 403
-    professor_id = get_jwt_identity()
+    professor_id = g.professor_id
     data = request.get_json()
 
     # 1. Verifica se a sala e o aluno existem e se o professor tem permissão
@@ -415,8 +517,7 @@ def update_aluno_na_sala(sala_id, aluno_id):
         return jsonify({"message": "Aluno não encontrado."}), 404
 
     # 2. Garante que o aluno pertence à sala
-    # A verificação é feita através da lista de alunos da sala, carregada pelo SQLAlchemy
-    if aluno not in sala.alunos:
+    if aluno.sala_id != sala.id:
         return jsonify({"message": "Este aluno não pertence à sala informada."}), 403 # Forbidden
 
     try:
@@ -427,14 +528,15 @@ def update_aluno_na_sala(sala_id, aluno_id):
         if 'email' in data:
             novo_email = data['email']
             # Verifica se o novo email já existe, exceto para o próprio aluno
-            if Aluno.query.filter(Aluno.email == novo_email, Aluno.id != aluno_id).first():
-                return jsonify({"message": "O novo email já está em uso por outro aluno."}), 409
+            if Credencial.email_em_uso(novo_email, 'aluno', aluno_id):
+                return jsonify({"message": "O novo email já está em uso por outro usuário."}), 409
             aluno.email = novo_email
 
         if 'senha' in data:
             # O setter de senha do modelo Aluno cuidará do hash
             aluno.senha = data['senha']
         
+        Credencial.sincronizar(aluno, 'aluno')
         db.session.commit()
         
         return jsonify({"message": "Dados do aluno atualizados com sucesso!", "aluno": aluno.to_dict()}), 200
@@ -444,12 +546,9 @@ def update_aluno_na_sala(sala_id, aluno_id):
 
 # ROTA PARA DELETAR ALUNO - TESTADA E FUNCIONANDO
 @professor_bp.route('/salas/<int:sala_id>/alunos/<int:aluno_id>', methods=['DELETE'])
-@jwt_required()
+@requer_funcao('professor', carregar=False)
 def delete_aluno_da_sala(sala_id, aluno_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas Professores podem acessar esta rota."}), 403
-    professor_id = get_jwt_identity()
+    professor_id = g.professor_id
 
     # 1. Verifica se a sala e o aluno existem e se o professor tem permissão
     sala = Sala.query.filter_by(id=sala_id, professor_id=professor_id).first()
@@ -461,11 +560,14 @@ def delete_aluno_da_sala(sala_id, aluno_id):
         return jsonify({"message": "Aluno não encontrado."}), 404
 
     # 2. Garante que o aluno pertence à sala
-    if aluno not in sala.alunos:
+    if aluno.sala_id != sala.id:
         return jsonify({"message": "Este aluno não pertence à sala informada."}), 403 # Forbidden
 
     try:
-        # 3. Deleta o aluno
+        # 3. Deleta o aluno e a credencial de login dele
+        Credencial.remover('aluno', [aluno.id])
+        # Tokens com o escopo da sala deixam de valer sem consulta: o do aluno removido passa a dar 404
+        incrementar_versao_salas([sala.id])
         db.session.delete(aluno)
         db.session.commit()
         
@@ -476,29 +578,16 @@ def delete_aluno_da_sala(sala_id, aluno_id):
 
 # ROTA PARA VER PERFIL DO ALUNO - TESTADA E FUNCIONANDO
 @professor_bp.route('/alunos/<int:aluno_id>', methods=['GET'])
-@jwt_required()
+@requer_funcao('professor')
 def get_perfil_aluno(aluno_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas Professores podem acessar esta rota."}), 403
-    professor_id = get_jwt_identity()
-
     # 1. Encontra o aluno pelo ID
     aluno = Aluno.query.get(aluno_id)
     if not aluno:
         return jsonify({"message": "Aluno não encontrado."}), 404
 
     # 2. Verifica se o aluno pertence a alguma sala do professor logado
-    # Isso é crucial para garantir a autorização
-    # Fazemos um loop pelas salas do professor e verificamos se o aluno está em alguma delas
-    professor = Professor.query.get(professor_id)
-    aluno_e_do_professor = False
-    for sala in professor.salas:
-        if aluno in sala.alunos:
-            aluno_e_do_professor = True
-            break
-            
-    if not aluno_e_do_professor:
+    # Isso é crucial para garantir a autorização (salas do professor carregadas pelo @requer_funcao)
+    if aluno.sala_id not in g.salas_ids:
         return jsonify({"message": "Você não tem permissão para acessar o perfil deste aluno."}), 403 # Forbidden
 
     # 3. Retorna os dados do aluno e as trilhas da sala a que ele pertence
@@ -521,173 +610,371 @@ def get_perfil_aluno(aluno_id):
 
 # ROTA PARA VER RELATÓRIO DO ALUNO POR TRILHA - TESTADA E FUNCIONANDO
 @professor_bp.route('/alunos/<int:aluno_id>/historico/trilha/<int:trilha_id>', methods=['GET'])
-@jwt_required()
+@requer_funcao('professor')
 def get_historico_aluno_por_trilha(aluno_id, trilha_id):
-    claims = get_jwt()
-    
-    # 1. VERIFICAÇÃO DE FUNÇÃO E ID DO PROFESSOR
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas Professores podem acessar esta rota."}), 403
-    
-    professor_id_str = get_jwt_identity()
-    try:
-        professor_id = int(professor_id_str)
-    except ValueError:
-        return jsonify({"message": "ID de professor no token inválido."}), 401
-
-    # 2. VERIFICAÇÃO DE AUTORIZAÇÃO: O professor pode ver este aluno?
+    # 1. VERIFICAÇÃO DE AUTORIZAÇÃO: O professor pode ver este aluno?
     aluno = Aluno.query.get(aluno_id)
-    professor = Professor.query.get(professor_id)
     
-    if not aluno or not professor:
+    if not aluno:
         return jsonify({"message": "Aluno ou Professor não encontrado."}), 404
 
-    # Busca todas as salas do professor e verifica se o aluno está em alguma delas
-    professor_possui_aluno = False
-    aluno_sala = aluno.sala
-
-    if aluno_sala:
-        # Verifica se o ID do professor logado é o mesmo ID do professor dono da sala do aluno
-        if aluno_sala.professor_id == professor.id:
-            professor_possui_aluno = True
-    
-    if not professor_possui_aluno:
+    # A sala do aluno precisa ser uma das salas do professor (carregadas pelo @requer_funcao)
+    if aluno.sala_id not in g.salas_ids:
         return jsonify({"message": "Você não tem permissão para acessar o histórico deste aluno."}), 403
 
-    # 3. VERIFICAÇÃO DE TRILHA
-    trilha = Trilha.query.get(trilha_id)
+    # 2. VERIFICAÇÃO DE TRILHA (catálogo em memória)
+    foto = catalogo.atual()
+    trilha = foto.trilhas.get(trilha_id)
     if not trilha:
         return jsonify({"message": "Trilha não encontrada."}), 404
     
-    if aluno_sala and trilha not in aluno_sala.trilhas:
+    if not _trilha_na_sala(aluno.sala_id, trilha_id):
         return jsonify({"message": "Esta trilha não está disponível para este aluno através de nenhuma das suas salas."}), 403
 
-    # CORREÇÃO CRÍTICA: Se Aluno tem relação 1:N com Sala (aluno.sala), a lógica de trilha deve mudar.
-    # Assumiremos que o professor só está interessado no desempenho que está na sala dele.
-    
-    # 4. BUSCA E CONSOLIDAÇÃO DOS DESEMPENHOS
-    desempenhos = DesempenhoJogo.query.filter_by(aluno_id=aluno_id, trilha_id=trilha_id)\
-                                     .options(joinedload(DesempenhoJogo.jogo))\
-                                     .order_by(DesempenhoJogo.data_hora.desc())\
-                                     .all()
-    
+    # 3. ESTATÍSTICAS POR JOGO E POR DIA, A PARTIR DOS RESUMOS DIÁRIOS (uma linha por jogo × dia)
+    resumos = ResumoAlunoJogoDia.query.filter_by(aluno_id=aluno_id, trilha_id=trilha_id).all()
+
     # Se não houver desempenho, retorne uma resposta vazia, mas válida
-    if not desempenhos:
+    if not resumos:
         return jsonify({
             "aluno_nome": aluno.nome,
-            "trilha_nome": trilha.nome,
+            "trilha_nome": trilha['nome'],
             "estatisticas": {
                 "tentativas_totais": 0,
                 "passou_trilha": False,
-                "acertos_consolidados": [],
-                "erros_consolidados": []
+                "por_jogo": [],
+                "por_dia": [],
+                "frequencia_acertos": {},
+                "frequencia_erros": {}
             }
         }), 200
 
-    # Lógica de Consolidação para o Relatório:
-    tentativas_totais = len(desempenhos)
-    
-    # Para saber se o aluno 'passou na trilha', contamos quantos jogos ele passou:
-    # 1. Agrupamos os desempenhos pelo ID do Jogo (considerando a tentativa mais recente para cada jogo, se for 1 tentativa/jogo)
-    #    OU simplesmente contamos os registros 'passou=True' e comparamos com o número total de jogos na trilha.
-    
-    # Vamos contar os registros distintos de jogos que ele passou (passou=True):
-    jogos_passados = set()
-    for d in desempenhos:
-        if d.passou:
-            jogos_passados.add(d.jogo_id)
-            
-    # Para verificar se "passou_trilha", precisamos do número total de jogos na trilha.
-    # ASSUMIMOS que o número de jogos passados (len(jogos_passados)) deve ser 4 para passar, conforme sua regra.
-    
-    # Se a trilha tem 4 jogos, a regra de 'passou_trilha' é:
-    total_jogos_na_trilha = len(trilha.jogos) # Pega do modelo Trilha (relação 'jogos')
-    passou_trilha = len(jogos_passados) >= total_jogos_na_trilha # TRUE se ele passou em todos os jogos
-
-    # Consolidação de Acertos e Erros (Juntando todas as listas de JSON)
-    acertos_consolidados = []
-    erros_consolidados = []
-    
-    for d in desempenhos:
-        # d.acertos e d.erros são listas (JSON do banco)
-        if isinstance(d.acertos, list):
-            acertos_consolidados.extend(d.acertos)
-        if isinstance(d.erros, list):
-            erros_consolidados.extend(d.erros)
-
-    # 5. RETORNA O RELATÓRIO CONSOLIDADO
-    return jsonify({
+    por_jogo = {}
+    por_dia = {}
+    for resumo in resumos:
+        jogo = por_jogo.setdefault(resumo.jogo_id, {
+            "tentativas": 0, "aprovacoes": 0, "acertos": 0, "erros": 0,
+            "primeira_aprovacao": None, "ultima_tentativa": None
+        })
+        dia = por_dia.setdefault(resumo.dia, {"tentativas": 0, "aprovacoes": 0, "acertos": 0, "erros": 0})
+        for total in (jogo, dia):
+            total["tentativas"] += resumo.tentativas
+            total["aprovacoes"] += resumo.aprovacoes
+            total["acertos"] += resumo.acertos
+            total["erros"] += resumo.erros
+        if resumo.primeira_aprovacao and (jogo["primeira_aprovacao"] is None or resumo.primeira_aprovacao < jogo["primeira_aprovacao"]):
+            jogo["primeira_aprovacao"] = resumo.primeira_aprovacao
+        if resumo.ultima_tentativa and (jogo["ultima_tentativa"] is None or resumo.ultima_tentativa > jogo["ultima_tentativa"]):
+            jogo["ultima_tentativa"] = resumo.ultima_tentativa
+
+    estatisticas_jogos = []
+    for jogo_id, total in sorted(por_jogo.items()):
+        jogo = foto.jogos.get(jogo_id)
+        estatisticas_jogos.append({
+            "jogo_id": jogo_id,
+            "jogo_nome": jogo['nome'] if jogo else "Jogo Desconhecido",
+            "tentativas": total["tentativas"],
+            "aprovacoes": total["aprovacoes"],
+            "taxa_aprovacao": round(total["aprovacoes"] / total["tentativas"], 4),
+            "acertos": total["acertos"],
+            "erros": total["erros"],
+            "primeira_aprovacao": total["primeira_aprovacao"].isoformat() if total["primeira_aprovacao"] else None,
+            "ultima_tentativa": total["ultima_tentativa"].isoformat() if total["ultima_tentativa"] else None
+        })
+    tentativas_totais = sum(j["tentativas"] for j in estatisticas_jogos)
+
+    # 'passou_trilha': o aluno passou (pelo menos uma vez) em todos os jogos da trilha (catálogo)
+    jogos_passados = {jogo["jogo_id"] for jogo in estatisticas_jogos if jogo["aprovacoes"]}
+    total_jogos_na_trilha = len(foto.jogos_da_trilha(trilha_id))
+    passou_trilha = len(jogos_passados) >= total_jogos_na_trilha
+
+    # 4. FREQUÊNCIA DE CADA ACERTO/ERRO ("3x4": 5, ...), agregada no banco a partir de desempenho_fato
+    # (índice aluno_id, trilha_id, fator_a, fator_b, correto)
+    frequencia_acertos = Counter()
+    frequencia_erros = Counter()
+    for fator_a, fator_b, total, acertos in agregar_fatos(DesempenhoFato.aluno_id == aluno_id,
+                                                          DesempenhoFato.trilha_id == trilha_id):
+        acertos = int(acertos or 0)
+        if acertos:
+            frequencia_acertos[fato_to_str(fator_a, fator_b)] = acertos
+        if total - acertos:
+            frequencia_erros[fato_to_str(fator_a, fator_b)] = total - acertos
+
+    relatorio = {
         "aluno_nome": aluno.nome,
-        "trilha_nome": trilha.nome,
+        "trilha_nome": trilha['nome'],
         "estatisticas": {
             "tentativas_totais": tentativas_totais,
             "passou_trilha": passou_trilha,
-            "acertos_consolidados": acertos_consolidados,
-            "erros_consolidados": erros_consolidados
-        },
-        # Mantemos os dados brutos para que o frontend possa criar gráficos
-        "detalhes_desempenho_bruto": [d.to_dict() for d in desempenhos]
-    }), 200
-
-# ROTA PARA VER ANALISE DA IA DO DESEMPENHO DO ALUNO - AINDA NÃO TESTADA
-@professor_bp.route('/alunos/<int:aluno_id>/historico/trilha/<int:trilha_id>/analise-ia', methods=['GET'])
-@jwt_required()
-def get_analise_ia(aluno_id, trilha_id):
-    claims = get_jwt()
-    if claims.get('funcao') != 'professor':
-        return jsonify({"message": "Acesso negado: Apenas Professores podem acessar esta rota."}), 403
-    professor_id = get_jwt_identity()
-
+            "por_jogo": estatisticas_jogos,
+            "por_dia": [dict(total, dia=dia.isoformat()) for dia, total in sorted(por_dia.items())],
+            "frequencia_acertos": dict(frequencia_acertos.most_common()),
+            "frequencia_erros": dict(frequencia_erros.most_common())
+        }
+    }
+
+    # 5. TENTATIVAS BRUTAS (opcional, paginadas): ?detalhes=1&pagina=1&por_pagina=50
+    filtro = (DesempenhoJogo.aluno_id == aluno_id, DesempenhoJogo.trilha_id == trilha_id)
+    if request.args.get('detalhes', '').lower() in ('1', 'true', 'sim'):
+        pagina = max(request.args.get('pagina', 1, type=int), 1)
+        por_pagina = min(max(request.args.get('por_pagina', 50, type=int), 1), 200)
+        itens = db.session.query(
+            DesempenhoJogo.id, DesempenhoJogo.aluno_id, DesempenhoJogo.sala_id, DesempenhoJogo.jogo_id,
+            DesempenhoJogo.trilha_id, DesempenhoJogo.data_hora, DesempenhoJogo.passou,
+            DesempenhoJogo.acertos, DesempenhoJogo.erros
+        ).filter(*filtro)\
+         .order_by(DesempenhoJogo.data_hora.desc(), DesempenhoJogo.id.desc())\
+         .offset((pagina - 1) * por_pagina)\
+         .limit(por_pagina)\
+         .all()
+        relatorio["detalhes_desempenho_bruto"] = {
+            "pagina": pagina,
+            "por_pagina": por_pagina,
+            "total": tentativas_totais,
+            "itens": [tentativa_to_dict(linha._asdict()) for linha in itens]
+        }
+
+    # 6. RETORNA O RELATÓRIO CONSOLIDADO
+    return jsonify(relatorio), 200
+
+def _job_to_dict(job):
+    status, erro = ia.servico_analises.situacao(job)
+    job_dict = {
+        "job_id": job.id,
+        "status": status,
+        "aluno_id": job.aluno_id,
+        "trilha_id": job.trilha_id,
+        "criado_em": job.criado_em.isoformat(),
+        "concluido_em": job.concluido_em.isoformat() if job.concluido_em else None,
+        "prompt_tokens": job.prompt_tokens
+    }
+    if status == 'concluido':
+        job_dict["analise_ia"] = job.analise
+    elif status == 'erro':
+        job_dict["message"] = erro
+    return job_dict
+
+def _analise_do_aluno(aluno_id, trilha_id):
+    # Validações comuns a todas as rotas de análise de um aluno. Retorna (resposta de erro, None) ou
+    # (None, pedido): dict com aluno, trilha (do catálogo), ids das tentativas, chave do cache e a
+    # análise guardada (None se não houver uma válida para as tentativas atuais).
     # 1. Validação de permissão
     aluno = Aluno.query.get(aluno_id)
     if not aluno:
-        return jsonify({"message": "Aluno não encontrado."}), 404
+        return (jsonify({"message": "Aluno não encontrado."}), 404), None
 
-    professor = Professor.query.get(professor_id)
-    if not any(aluno in sala.alunos for sala in professor.salas):
-        return jsonify({"message": "Você não tem permissão para acessar o histórico deste aluno."}), 403
+    if aluno.sala_id not in g.salas_ids:
+        return (jsonify({"message": "Você não tem permissão para acessar o histórico deste aluno."}), 403), None
 
-    trilha = Trilha.query.get(trilha_id)
+    trilha = catalogo.atual().trilhas.get(trilha_id)
     if not trilha:
-        return jsonify({"message": "Trilha não encontrada."}), 404
-    
-    if IA_MODEL is None:
+        return (jsonify({"message": "Trilha não encontrada."}), 404), None
+
+    # 2. Ids das tentativas do aluno na trilha: com eles se sabe se a análise guardada ainda vale
+    desempenhos_ids = [desempenho_id for (desempenho_id,) in db.session.query(DesempenhoJogo.id).filter(
+        DesempenhoJogo.aluno_id == aluno_id, DesempenhoJogo.trilha_id == trilha_id
+    )]
+    if not desempenhos_ids:
+        return (jsonify({"message": "Nenhum dado de desempenho encontrado para este aluno nesta trilha."}), 404), None
+
+    chave = ia.chave_analise(aluno_id, trilha_id, desempenhos_ids)
+    return None, {
+        "aluno": aluno,
+        "trilha": trilha,
+        "desempenhos_ids": desempenhos_ids,
+        "chave": chave,
+        "analise": ia.cache_analises.buscar(aluno_id, trilha_id, chave)
+    }
+
+def _pedir_analise(aluno_id, trilha_id, criar_job_do_cache):
+    # Rotas de análise com job. Retorna (resposta de erro, None, None) ou
+    # (None, análise do cache ou None, job). Sem análise no cache, grava um job para o pool.
+    erro, pedido = _analise_do_aluno(aluno_id, trilha_id)
+    if erro:
+        return erro, None, None
+    chave, analise = pedido["chave"], pedido["analise"]
+    if analise is not None and not criar_job_do_cache:
+        return None, analise, None
+
+    # 3. Job: já existe um em andamento para as mesmas tentativas, já concluído pelo cache, ou novo
+    if analise is None:
+        if not ia.servico_analises.disponivel():
+            return (jsonify({"message": "Serviço de IA indisponível. Configuração inicial falhou."}), 503), None, None
+        job = ia.servico_analises.em_andamento(aluno_id, trilha_id, chave)
+        if job is not None:
+            return None, None, job
+    try:
+        job = ia.servico_analises.submeter(g.professor_id, aluno_id, trilha_id, chave, max(pedido["desempenhos_ids"]), analise)
+    except ia.FilaCheia:
+        resposta = jsonify({"message": "Muitas análises em andamento. Tente novamente em instantes."})
+        resposta.headers['Retry-After'] = '10'
+        return (resposta, 503), None, None
+    except Exception as e:
+        db.session.rollback()
+        return (jsonify({"message": f"Erro ao solicitar análise da IA: {str(e)}"}), 500), None, None
+    return None, analise, job
+
+def _resposta_job(job):
+    resposta = jsonify(_job_to_dict(job))
+    resposta.headers['Location'] = f"{professor_bp.url_prefix}/analises/{job.id}"
+    return resposta, (200 if job.status == 'concluido' else 202)
+
+# ROTA PARA VER ANALISE DA IA DO DESEMPENHO DO ALUNO
+# Com análise no cache responde 200 na hora; senão cria um job e responde 202 com o id para consulta
+@professor_bp.route('/alunos/<int:aluno_id>/historico/trilha/<int:trilha_id>/analise-ia', methods=['GET'])
+@requer_funcao('professor')
+def get_analise_ia(aluno_id, trilha_id):
+    erro, analise, job = _pedir_analise(aluno_id, trilha_id, criar_job_do_cache=False)
+    if erro:
+        return erro
+    if job is None:
+        return jsonify({"analise_ia": analise, "em_cache": True}), 200
+    return _resposta_job(job)
+
+# ROTA PARA SOLICITAR UMA ANALISE DA IA EM SEGUNDO PLANO (JOB)
+@professor_bp.route('/alunos/<int:aluno_id>/historico/trilha/<int:trilha_id>/analise-ia/jobs', methods=['POST'])
+@requer_funcao('professor')
+def create_job_analise_ia(aluno_id, trilha_id):
+    erro, _, job = _pedir_analise(aluno_id, trilha_id, criar_job_do_cache=True)
+    if erro:
+        return erro
+    return _resposta_job(job)
+
+# ROTA PARA CONSULTAR UM JOB DE ANALISE DA IA
+@professor_bp.route('/analises/<job_id>', methods=['GET'])
+@requer_funcao('professor', carregar=False)
+def get_job_analise_ia(job_id):
+    job = db.session.get(JobAnaliseIA, job_id)
+    if not job or job.professor_id != g.professor_id:
+        return jsonify({"message": "Análise não encontrada."}), 404
+    return jsonify(_job_to_dict(job)), 200
+
+def _evento_sse(evento, dados):
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+# ROTA PARA ACOMPANHAR A ANALISE DA IA ENQUANTO ELA É GERADA (SERVER-SENT EVENTS)
+# Eventos: 'parte' ({"texto": ...}) a cada pedaço gerado pelo modelo, 'fim' ao terminar e 'erro' se falhar
+@professor_bp.route('/alunos/<int:aluno_id>/historico/trilha/<int:trilha_id>/analise-ia/stream', methods=['GET'])
+@requer_funcao('professor')
+def stream_analise_ia(aluno_id, trilha_id):
+    # 1. Validação de permissão, tentativas (chave do cache) e análise guardada, se ainda valer
+    erro, pedido = _analise_do_aluno(aluno_id, trilha_id)
+    if erro:
+        return erro
+    chave, analise = pedido["chave"], pedido["analise"]
+
+    prompt = prompt_tokens = None
+    if analise is None:
+        if not ia.servico_analises.disponivel():
+            return jsonify({"message": "Serviço de IA indisponível. Configuração inicial falhou."}), 503
+        # 2. Prompt montado antes de abrir o stream; a transação de leitura termina aqui
+        dados = ia.dados_do_prompt(aluno_id, trilha_id, max(pedido["desempenhos_ids"]))
+        prompt, prompt_tokens = ia.montar_prompt(pedido["aluno"].nome, pedido["trilha"]['nome'], dados,
+                                                 catalogo.atual(), ia.servico_analises.max_tokens)
+    db.session.commit()
+
+    # 3. Repassa cada pedaço assim que o modelo o produz e guarda a análise completa no cache
+    def eventos():
+        if analise is not None:
+            yield _evento_sse('parte', {"texto": analise})
+            yield _evento_sse('fim', {"em_cache": True})
+            return
+        partes = []
+        try:
+            for texto in ia.servico_analises.gerar_em_partes(prompt):
+                partes.append(texto)
+                yield _evento_sse('parte', {"texto": texto})
+        except Exception as e:
+            yield _evento_sse('erro', {"message": f"Erro ao gerar análise da IA: {str(e)}"})
+            return
+        try:
+            ia.cache_analises.guardar(aluno_id, trilha_id, chave, ''.join(partes))
+        except Exception:
+            # A análise já foi entregue ao professor: uma falha ao guardá-la não derruba o stream
+            db.session.rollback()
+            logger.exception("Falha ao guardar no cache a análise do aluno %s na trilha %s.", aluno_id, trilha_id)
+        yield _evento_sse('fim', {"em_cache": False, "prompt_tokens": prompt_tokens})
+
+    return Response(stream_with_context(eventos()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# ROTA PARA SOLICITAR A ANALISE DA IA DE TODOS OS ALUNOS DA SALA EM UMA TRILHA (LOTE DE JOBS)
+@professor_bp.route('/salas/<int:sala_id>/trilhas/<int:trilha_id>/analise-ia', methods=['POST'])
+@requer_funcao('professor')
+def create_lote_analise_ia(sala_id, trilha_id):
+    # 1. A sala precisa ser do professor logado e a trilha precisa estar na sala
+    if sala_id not in g.salas_ids:
+        return jsonify({"message": "Sala não encontrada ou você não tem permissão para acessá-la."}), 404
+    if not _trilha_na_sala(sala_id, trilha_id):
+        return jsonify({"message": "Esta trilha não está associada à sala informada."}), 403
+    if not ia.servico_analises.disponivel():
         return jsonify({"message": "Serviço de IA indisponível. Configuração inicial falhou."}), 503
-        
-    # 2. Busca o histórico de desempenho (mesma lógica da rota anterior)
-    desempenhos = DesempenhoJogo.query.filter_by(aluno_id=aluno_id, trilha_id=trilha_id)\
-                                     .options(joinedload(DesempenhoJogo.jogo))\
-                                     .order_by(DesempenhoJogo.data_hora.desc())\
-                                     .all()
-
-    if not desempenhos:
-        return jsonify({"message": "Nenhum dado de desempenho encontrado para este aluno nesta trilha."}), 404
-
-    # 3. Cria o prompt com base nos dados do histórico
-    prompt = "Você é um assistente de análise de desempenho escolar. "
-    "Sua tarefa é analisar os dados de um aluno e gerar um relatório detalhado e útil para o professor. "
-    "A resposta deve ser um objeto JSON válido, contendo as seguintes chaves: "
-    "'resumo_geral', 'habilidades', 'melhorias', 'analise_detalhada', 'progresso' (se houver dados suficientes) e 'sugestoes'. "
-    "Cada chave deve conter um texto explicativo. Não inclua texto extra, apenas o JSON. "
-    f"Análise de desempenho do aluno {aluno.nome} na trilha '{trilha.nome}'. "
-    
-    # Adiciona os dados de desempenho ao prompt
-    for d in desempenhos:
-        jogo_nome = d.jogo.nome if d.jogo else "Jogo Desconhecido"
-        passou_texto = "passou" if d.passou else "não passou"
-        acertos_str = f"Acertos: {len(d.acertos) if d.acertos else 0}"
-        erros_str = f"Erros: {len(d.erros) if d.erros else 0}"
-        
-        prompt += f"\nNo jogo '{jogo_nome}', ele {passou_texto} com {acertos_str} e {erros_str}. "
-        prompt += f"Detalhes dos erros: {d.erros if d.erros else 'Nenhum'}. "
-    
-    # 4. Envia o prompt para a API do Gemini
+
+    # 2. Alunos da sala e ids das tentativas de cada um na trilha (uma consulta de colunas)
+    alunos = dict(db.session.query(Aluno.id, Aluno.nome).filter(Aluno.sala_id == sala_id))
+    desempenhos_ids = {}
+    for aluno_id, desempenho_id in db.session.query(DesempenhoJogo.aluno_id, DesempenhoJogo.id).filter(
+        DesempenhoJogo.aluno_id.in_(alunos), DesempenhoJogo.trilha_id == trilha_id
+    ):
+        desempenhos_ids.setdefault(aluno_id, []).append(desempenho_id)
+
+    if not desempenhos_ids:
+        return jsonify({"message": "Nenhum dado de desempenho encontrado para os alunos desta sala nesta trilha."}), 404
+
+    # 3. Análises ainda válidas no cache; os dados dos demais alunos são lidos de uma vez para a sala
+    chaves = {aluno_id: ia.chave_analise(aluno_id, trilha_id, ids) for aluno_id, ids in desempenhos_ids.items()}
+    em_cache = ia.cache_analises.buscar_varios(trilha_id, chaves)
+    sem_cache = [aluno_id for aluno_id in chaves if aluno_id not in em_cache]
+    dados = {}
+    if sem_cache:
+        maior_id = max(max(desempenhos_ids[aluno_id]) for aluno_id in sem_cache)
+        dados = {aluno_id: (alunos[aluno_id], dados_aluno)
+                 for aluno_id, dados_aluno in ia.dados_da_sala(sem_cache, trilha_id, maior_id).items()}
+
+    # 4. Um job por aluno com tentativas, todos no mesmo lote
+    pedidos = [(aluno_id, chaves[aluno_id], max(ids), em_cache.get(aluno_id))
+               for aluno_id, ids in sorted(desempenhos_ids.items())]
     try:
-        response = IA_MODEL.generate_content(prompt)
-        analise = response.text
-        
-        return jsonify({"analise_ia": analise}), 200
+        lote_id = ia.servico_analises.submeter_lote(g.professor_id, trilha_id, pedidos, dados)
+    except ia.FilaCheia:
+        resposta = jsonify({"message": "Muitas análises em andamento. Tente novamente em instantes."})
+        resposta.headers['Retry-After'] = '10'
+        return resposta, 503
     except Exception as e:
-        return jsonify({"message": f"Erro ao gerar análise da IA: {str(e)}"}), 500
+        db.session.rollback()
+        return jsonify({"message": f"Erro ao solicitar análises da IA: {str(e)}"}), 500
+
+    resposta = jsonify({
+        "lote_id": lote_id,
+        "total": len(pedidos),
+        "em_cache": len(em_cache),
+        "alunos_sem_dados": sorted(aluno_id for aluno_id in alunos if aluno_id not in desempenhos_ids)
+    })
+    resposta.headers['Location'] = f"{professor_bp.url_prefix}/analises/lotes/{lote_id}"
+    # Todas as análises vieram do cache: o lote já está concluído
+    return resposta, (200 if len(em_cache) == len(pedidos) else 202)
+
+# ROTA PARA CONSULTAR UM LOTE DE ANALISES: CADA ANALISE APARECE ASSIM QUE TERMINA
+@professor_bp.route('/analises/lotes/<lote_id>', methods=['GET'])
+@requer_funcao('professor', carregar=False)
+def get_lote_analise_ia(lote_id):
+    linhas = db.session.query(JobAnaliseIA, Aluno.nome)\
+                       .join(Aluno, Aluno.id == JobAnaliseIA.aluno_id)\
+                       .filter(JobAnaliseIA.lote_id == lote_id, JobAnaliseIA.professor_id == g.professor_id)\
+                       .order_by(Aluno.nome, Aluno.id)\
+                       .all()
+    if not linhas:
+        return jsonify({"message": "Lote de análises não encontrado."}), 404
+
+    itens = [dict(_job_to_dict(job), aluno_nome=nome) for job, nome in linhas]
+    situacoes = Counter(item["status"] for item in itens)
+    return jsonify({
+        "lote_id": lote_id,
+        "total": len(itens),
+        "concluidos": situacoes['concluido'],
+        "erros": situacoes['erro'],
+        "em_andamento": situacoes['pendente'] + situacoes['executando'],
+        "itens": itens
+    }), 200
 
 # =====================================FIM DAS ROTAS DO PROFESSOR======================================
\ No newline at end of file
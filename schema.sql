@@ -120,4 +120,174 @@ CREATE TABLE IF NOT EXISTS `desempenho_jogo` (
     REFERENCES `sala` (`id`)
     ON DELETE CASCADE
     ON UPDATE CASCADE
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
\ No newline at end of file
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `credencial` (
+  `id` INT NOT NULL AUTO_INCREMENT,
+  `email` VARCHAR(120) NOT NULL UNIQUE,
+  `funcao` VARCHAR(20) NOT NULL,
+  `usuario_id` INT NOT NULL,
+  `senha` VARCHAR(255) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE INDEX `uq_credencial_usuario` (`funcao` ASC, `usuario_id` ASC) VISIBLE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `contador_versao` (
+  `chave` VARCHAR(64) NOT NULL,
+  `versao` INT NOT NULL DEFAULT 1,
+  PRIMARY KEY (`chave`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `progresso_aluno_trilha` (
+  `aluno_id` INT NOT NULL,
+  `trilha_id` INT NOT NULL,
+  `jogos_concluidos` JSON NOT NULL,
+  `maior_jogo_liberado` INT NULL,
+  `ultima_tentativa` DATETIME NULL,
+  PRIMARY KEY (`aluno_id`, `trilha_id`),
+  INDEX `fk_progresso_trilha_idx` (`trilha_id` ASC) VISIBLE,
+  CONSTRAINT `fk_progresso_aluno`
+    FOREIGN KEY (`aluno_id`)
+    REFERENCES `aluno` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE,
+  CONSTRAINT `fk_progresso_trilha`
+    FOREIGN KEY (`trilha_id`)
+    REFERENCES `trilha` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `chave_idempotencia` (
+  `id` INT NOT NULL AUTO_INCREMENT,
+  `aluno_id` INT NOT NULL,
+  `chave` VARCHAR(64) NOT NULL,
+  `status` INT NOT NULL,
+  `resposta` JSON NOT NULL,
+  `criado_em` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE INDEX `uq_chave_idempotencia_aluno` (`aluno_id` ASC, `chave` ASC) VISIBLE,
+  INDEX `ix_chave_idempotencia_criado_em` (`criado_em` ASC) VISIBLE,
+  CONSTRAINT `fk_chave_idempotencia_aluno`
+    FOREIGN KEY (`aluno_id`)
+    REFERENCES `aluno` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `desempenho_fato` (
+  `id` INT NOT NULL AUTO_INCREMENT,
+  `desempenho_id` INT NOT NULL,
+  `aluno_id` INT NOT NULL,
+  `sala_id` INT NOT NULL,
+  `trilha_id` INT NOT NULL,
+  `jogo_id` INT NOT NULL,
+  `fator_a` SMALLINT NOT NULL,
+  `fator_b` SMALLINT NOT NULL,
+  `correto` TINYINT(1) NOT NULL,
+  PRIMARY KEY (`id`),
+  INDEX `ix_desempenho_fato_desempenho_id` (`desempenho_id` ASC) VISIBLE,
+  INDEX `ix_desempenho_fato_sala` (`sala_id` ASC, `fator_a` ASC, `fator_b` ASC, `correto` ASC) VISIBLE,
+  INDEX `ix_desempenho_fato_sala_aluno` (`sala_id` ASC, `aluno_id` ASC, `fator_a` ASC, `fator_b` ASC, `correto` ASC) VISIBLE,
+  INDEX `ix_desempenho_fato_aluno_trilha` (`aluno_id` ASC, `trilha_id` ASC, `fator_a` ASC, `fator_b` ASC, `correto` ASC) VISIBLE,
+  CONSTRAINT `fk_desempenho_fato_desempenho`
+    FOREIGN KEY (`desempenho_id`)
+    REFERENCES `desempenho_jogo` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `resumo_aluno_jogo_dia` (
+  `aluno_id` INT NOT NULL,
+  `trilha_id` INT NOT NULL,
+  `jogo_id` INT NOT NULL,
+  `dia` DATE NOT NULL,
+  `tentativas` INT NOT NULL DEFAULT 0,
+  `aprovacoes` INT NOT NULL DEFAULT 0,
+  `acertos` INT NOT NULL DEFAULT 0,
+  `erros` INT NOT NULL DEFAULT 0,
+  `primeira_aprovacao` DATETIME NULL,
+  `ultima_tentativa` DATETIME NULL,
+  PRIMARY KEY (`aluno_id`, `trilha_id`, `jogo_id`, `dia`),
+  CONSTRAINT `fk_resumo_aluno_jogo_dia_aluno`
+    FOREIGN KEY (`aluno_id`)
+    REFERENCES `aluno` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `resumo_sala_jogo_dia` (
+  `sala_id` INT NOT NULL,
+  `trilha_id` INT NOT NULL,
+  `jogo_id` INT NOT NULL,
+  `dia` DATE NOT NULL,
+  `tentativas` INT NOT NULL DEFAULT 0,
+  `aprovacoes` INT NOT NULL DEFAULT 0,
+  `acertos` INT NOT NULL DEFAULT 0,
+  `erros` INT NOT NULL DEFAULT 0,
+  `primeira_aprovacao` DATETIME NULL,
+  `ultima_tentativa` DATETIME NULL,
+  PRIMARY KEY (`sala_id`, `trilha_id`, `jogo_id`, `dia`),
+  CONSTRAINT `fk_resumo_sala_jogo_dia_sala`
+    FOREIGN KEY (`sala_id`)
+    REFERENCES `sala` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `analise_ia` (
+  `aluno_id` INT NOT NULL,
+  `trilha_id` INT NOT NULL,
+  `chave` CHAR(64) NOT NULL,
+  `analise` MEDIUMTEXT NOT NULL,
+  `criado_em` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`aluno_id`, `trilha_id`),
+  INDEX `fk_analise_ia_trilha_idx` (`trilha_id` ASC) VISIBLE,
+  CONSTRAINT `fk_analise_ia_aluno`
+    FOREIGN KEY (`aluno_id`)
+    REFERENCES `aluno` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE,
+  CONSTRAINT `fk_analise_ia_trilha`
+    FOREIGN KEY (`trilha_id`)
+    REFERENCES `trilha` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `analise_ia_job` (
+  `id` CHAR(32) NOT NULL,
+  `professor_id` INT NOT NULL,
+  `lote_id` CHAR(32) NULL,
+  `aluno_id` INT NOT NULL,
+  `trilha_id` INT NOT NULL,
+  `chave` CHAR(64) NOT NULL,
+  `ultimo_desempenho_id` INT NOT NULL,
+  `status` VARCHAR(16) NOT NULL DEFAULT 'pendente',
+  `analise` MEDIUMTEXT NULL,
+  `erro` TEXT NULL,
+  `prompt_tokens` INT NULL,
+  `criado_em` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `prazo_em` DATETIME NOT NULL,
+  `concluido_em` DATETIME NULL,
+  PRIMARY KEY (`id`),
+  INDEX `ix_analise_ia_job_professor_id` (`professor_id` ASC) VISIBLE,
+  INDEX `ix_analise_ia_job_lote_id` (`lote_id` ASC) VISIBLE,
+  INDEX `ix_analise_ia_job_aluno_trilha` (`aluno_id` ASC, `trilha_id` ASC, `chave` ASC, `status` ASC) VISIBLE,
+  INDEX `fk_analise_ia_job_trilha_idx` (`trilha_id` ASC) VISIBLE,
+  CONSTRAINT `fk_analise_ia_job_professor`
+    FOREIGN KEY (`professor_id`)
+    REFERENCES `professor` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE,
+  CONSTRAINT `fk_analise_ia_job_aluno`
+    FOREIGN KEY (`aluno_id`)
+    REFERENCES `aluno` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE,
+  CONSTRAINT `fk_analise_ia_job_trilha`
+    FOREIGN KEY (`trilha_id`)
+    REFERENCES `trilha` (`id`)
+    ON DELETE CASCADE
+    ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
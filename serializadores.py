@@ -0,0 +1,112 @@
+from operator import attrgetter, itemgetter
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy.orm import load_only
+from models import Sala, Aluno, Trilha, Jogo
+
+try:
+    import orjson
+except ImportError: # opcional: sem o orjson as respostas usam o json da biblioteca padrão
+    orjson = None
+
+# -------------------------------------------------------------
+# SERIALIZAÇÃO COM ESCOLHA DE CAMPOS (?fields= / ?include=)
+# -------------------------------------------------------------
+# Cada Serializador conhece os campos públicos de um modelo. A rota lê da query string os campos
+# pedidos (?fields=id,nome para o recurso principal, ?fields[alunos]=nome para um relacionamento)
+# e os relacionamentos a incluir (?include=alunos,trilhas). O mesmo conjunto de campos serve para:
+# - a consulta: opcoes() devolve o load_only() só com as colunas pedidas;
+# - a resposta: a função que monta o dict (attrgetter/itemgetter) é criada uma vez por conjunto
+#   de campos e reaproveitada, para objetos do ORM e para os dicts do catálogo em memória.
+# O 'id' vem sempre, mesmo que não seja pedido.
+
+class Serializador:
+    def __init__(self, modelo, campos):
+        self.modelo = modelo
+        self.campos = tuple(campos)
+        self._montadores = {} # (campos, de_dict) -> função objeto -> dict
+
+    def campos_pedidos(self, valor):
+        # Retorna (campos, None) ou (None, mensagem de erro) para o valor de ?fields=
+        if not valor:
+            return self.campos, None
+        pedidos = [campo.strip() for campo in valor.split(',') if campo.strip()]
+        invalidos = [campo for campo in pedidos if campo not in self.campos]
+        if invalidos:
+            return None, f"Campo(s) inválido(s): {', '.join(invalidos)}. Disponíveis: {', '.join(self.campos)}."
+        # Na ordem do serializador, sem repetições e sempre com o 'id'
+        return tuple(campo for campo in self.campos if campo == 'id' or campo in pedidos), None
+
+    def opcoes(self, campos):
+        # load_only() com as colunas do modelo entre os campos pedidos (campos calculados ficam de fora)
+        colunas = self.modelo.__table__.c
+        return load_only(*[getattr(self.modelo, campo) for campo in campos if campo in colunas])
+
+    def _montador(self, campos, de_dict):
+        montador = self._montadores.get((campos, de_dict))
+        if montador is None:
+            getter = (itemgetter if de_dict else attrgetter)(*campos)
+            if len(campos) == 1: # itemgetter/attrgetter de um campo só não devolvem tupla
+                montador = lambda objeto, campo=campos[0], getter=getter: {campo: getter(objeto)}
+            else:
+                montador = lambda objeto, getter=getter: dict(zip(campos, getter(objeto)))
+            self._montadores[(campos, de_dict)] = montador
+        return montador
+
+    def objeto(self, objeto, campos=None):
+        return self._montador(campos or self.campos, False)(objeto)
+
+    def lista(self, objetos, campos=None):
+        montador = self._montador(campos or self.campos, False)
+        return [montador(objeto) for objeto in objetos]
+
+    def lista_de_dicts(self, dicts, campos=None):
+        # Projeção dos dicts prontos (ex.: catálogo em memória) nos campos pedidos
+        campos = campos or self.campos
+        montador = self._montador(campos, True)
+        return [montador(d) for d in dicts]
+
+def incluir_pedidos(valor, permitidos, padrao):
+    # Retorna (relacionamentos, None) ou (None, mensagem de erro) para o valor de ?include=.
+    # Sem o parâmetro vale o padrão da rota; '?include=' vazio não inclui nenhum.
+    if valor is None:
+        return tuple(padrao), None
+    pedidos = [nome.strip() for nome in valor.split(',') if nome.strip()]
+    invalidos = [nome for nome in pedidos if nome not in permitidos]
+    if invalidos:
+        return None, f"Relacionamento(s) inválido(s) em 'include': {', '.join(invalidos)}. Disponíveis: {', '.join(permitidos)}."
+    return tuple(nome for nome in permitidos if nome in pedidos), None
+
+SALA = Serializador(Sala, ('id', 'nome', 'professor_id'))
+ALUNO = Serializador(Aluno, ('id', 'nome', 'email'))
+TRILHA = Serializador(Trilha, ('id', 'nome', 'descricao'))
+JOGO = Serializador(Jogo, ('id', 'nome', 'descricao', 'trilha_id', 'trilha_nome')) # 'trilha_nome': catálogo
+
+# -------------------------------------------------------------
+# PROVEDOR JSON DO FLASK
+# -------------------------------------------------------------
+# Com o orjson instalado, jsonify()/request.get_json() usam o orjson (mesmas chaves ordenadas e
+# chaves não-texto convertidas, como o provedor padrão). Datas, Decimal, UUID etc. continuam pelo
+# default() do Flask, com o mesmo formato.
+# Diferença em relação ao provedor padrão do Flask: o texto sai em UTF-8 ("Não"), e não escapado
+# ("N\u00e3o" com ensure_ascii=True), porque o orjson não tem essa opção. O JSON é equivalente para
+# qualquer parser, mas os bytes mudam: quem compara respostas byte a byte (cache, ETag, testes) vê a
+# diferença. Sem o orjson o json da biblioteca padrão recebe ensure_ascii=False, para a saída ser a
+# mesma com ou sem o pacote.
+
+class ProvedorJson(DefaultJSONProvider):
+    ensure_ascii = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        opcoes = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get('sort_keys', self.sort_keys):
+            opcoes |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            opcoes |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=opcoes).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
@@ -0,0 +1,140 @@
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# O app é criado na importação de app.py: a configuração de teste (SQLite temporário, hash barato,
+# sem limite de login, IA local) precisa estar na Config antes dela
+_diretorio = tempfile.mkdtemp(prefix='mathmagic-testes-')
+import config
+config.Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(_diretorio, 'testes.db')
+config.Config.REVOCATION_SQLITE_PATH = os.path.join(_diretorio, 'tokens_revogados.db')
+config.Config.PASSWORD_HASH_ALGORITHM = 'pbkdf2'
+config.Config.PASSWORD_PBKDF2_ITERATIONS = 1000
+config.Config.PASSWORD_HASH_WORKERS = 0
+config.Config.LOGIN_LIMIT_ENABLED = False
+config.Config.DESEMPENHO_WRITE_BEHIND = False
+config.Config.IA_MODEL_BACKEND = 'local'
+
+from app import app as flask_app
+from models import db
+from fila_desempenho import fila_desempenho
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+@pytest.fixture(scope='session')
+def client(app):
+    return app.test_client()
+
+@pytest.fixture(scope='session')
+def contador_consultas(app):
+    # Conta os comandos SQL enviados ao banco: contador_consultas(função) -> (resultado, total)
+    total = [0]
+    with app.app_context():
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _contar(*args, **kwargs):
+            total[0] += 1
+
+    def contar(funcao):
+        total[0] = 0
+        resultado = funcao()
+        return resultado, total[0]
+    return contar
+
+@pytest.fixture(scope='session')
+def api(client):
+    # Atalhos para montar os cenários pela própria API (como o frontend faria)
+    class Api:
+        def post(self, url, token, **dados):
+            resposta = client.post(url, json=dados, headers={'Authorization': f'Bearer {token}'})
+            assert resposta.status_code in (200, 201), resposta.get_json()
+            return resposta.get_json()
+
+        def get(self, url, token):
+            return client.get(url, headers={'Authorization': f'Bearer {token}'})
+
+        def login(self, email, senha):
+            resposta = client.post('/api/auth/login', json={'email': email, 'senha': senha})
+            assert resposta.status_code == 200, resposta.get_json()
+            return resposta.get_json()['access_token']
+
+    api = Api()
+    resposta = client.post('/api/auth/register/admin', json={'nome': 'Admin', 'email': 'admin@teste', 'senha': 'admin'})
+    assert resposta.status_code == 201, resposta.get_json()
+    api.admin = api.login('admin@teste', 'admin')
+    return api
+
+@pytest.fixture(scope='session')
+def novo_professor(api):
+    # Cria um professor com email único e devolve o token dele
+    contador = [0]
+
+    def criar():
+        contador[0] += 1
+        email = f'professor{contador[0]}@teste'
+        api.post('/api/admin/professores', api.admin, nome=f'Professor {contador[0]}', email=email, senha='prof')
+        return api.login(email, 'prof')
+    return criar
+
+@pytest.fixture(scope='session')
+def nova_trilha(api):
+    # Cria uma trilha com 'jogos' jogos e devolve o id dela
+    contador = [0]
+
+    def criar(jogos):
+        contador[0] += 1
+        trilha_id = api.post('/api/admin/trilhas', api.admin, nome=f'Trilha {contador[0]}', descricao='Trilha de teste')['trilha']['id']
+        for numero in range(jogos):
+            api.post('/api/admin/jogos', api.admin, nome=f'Jogo {contador[0]}-{numero}', trilha_id=trilha_id)
+        return trilha_id
+    return criar
+
+@pytest.fixture(scope='session')
+def novo_aluno(api, client, novo_professor, nova_trilha):
+    # Cria professor, trilha com 'jogos' jogos, sala e um aluno nela; devolve ids e o token do aluno
+    contador = [0]
+
+    def criar(jogos=3):
+        contador[0] += 1
+        token_professor = novo_professor()
+        trilha_id = nova_trilha(jogos)
+        sala_id = api.post('/api/professor/salas', token_professor, nome='Sala', trilhas_ids=[trilha_id])['sala']['id']
+        email = f'aluno-fixture{contador[0]}@teste'
+        aluno_id = api.post(f'/api/professor/salas/{sala_id}/alunos', token_professor,
+                            nome='Aluno', email=email, senha='aluno')['aluno']['id']
+        token = api.login(email, 'aluno')
+        jogos_ids = [jogo['id'] for jogo in api.get(f'/api/aluno/trilhas/{trilha_id}/jogos', token).get_json()['jogos']]
+        return SimpleNamespace(token=token, headers={'Authorization': f'Bearer {token}'}, aluno_id=aluno_id,
+                               sala_id=sala_id, trilha_id=trilha_id, jogos_ids=jogos_ids,
+                               token_professor=token_professor)
+    return criar
+
+@pytest.fixture
+def escrita_adiada(app, tmp_path):
+    # Liga a escrita adiada com o journal num diretório temporário. A thread de fundo fica parada:
+    # o teste decide quando drenar (fila_desempenho.drenar())
+    app.config.update(DESEMPENHO_WRITE_BEHIND=True, DESEMPENHO_JOURNAL_DIR=str(tmp_path))
+    fila_desempenho.init_app(app)
+    fila_desempenho._parar.set()
+    yield fila_desempenho
+    fila_desempenho.drenar()
+    fila_desempenho.habilitada = False
+    app.config['DESEMPENHO_WRITE_BEHIND'] = False
+
+@pytest.fixture
+def atraso_do_modelo():
+    # Deixa o ModeloLocal lento (IA_STUB_DELAY_SECONDS) durante o teste: atraso_do_modelo(segundos)
+    from ia import servico_analises, ModeloLocal
+    modelo = servico_analises.modelo
+
+    def ajustar(segundos):
+        servico_analises.modelo = ModeloLocal(segundos)
+    yield ajustar
+    servico_analises.modelo = modelo
@@ -0,0 +1,165 @@
+# Análises da IA (ModeloLocal, sem rede): jobs avulsos e lotes da sala
+import json
+import time
+from datetime import datetime, timedelta
+import ia
+from models import db, JobAnaliseIA
+
+def _com_tentativas(api, aluno, *outros_emails):
+    # Uma tentativa do aluno (e de cada aluno extra, criado na mesma sala) na trilha
+    tokens = [aluno.token]
+    for email in outros_emails:
+        api.post(f'/api/professor/salas/{aluno.sala_id}/alunos', aluno.token_professor, nome='Colega', email=email, senha='aluno')
+        tokens.append(api.login(email, 'aluno'))
+    for token in tokens:
+        api.post('/api/aluno/desempenho', token, jogo_id=aluno.jogos_ids[0], trilha_id=aluno.trilha_id, passou=True)
+
+def _aguardar(api, aluno, url, terminado, segundos=10):
+    limite = time.monotonic() + segundos
+    while True:
+        dados = api.get(url, aluno.token_professor).get_json()
+        if terminado(dados) or time.monotonic() > limite:
+            return dados
+        time.sleep(0.05)
+
+def _lote_terminado(dados):
+    return dados['em_andamento'] == 0
+
+def test_lote_repetido_enquanto_executa_devolve_o_mesmo_lote(api, client, novo_aluno, atraso_do_modelo):
+    aluno = novo_aluno()
+    _com_tentativas(api, aluno, 'colega-lote-repetido@teste')
+    atraso_do_modelo(0.4)
+    url = f'/api/professor/salas/{aluno.sala_id}/trilhas/{aluno.trilha_id}/analise-ia'
+    cabecalhos = {'Authorization': f'Bearer {aluno.token_professor}'}
+
+    primeira = client.post(url, headers=cabecalhos)
+    assert primeira.status_code == 202, primeira.get_json()
+    segunda = client.post(url, headers=cabecalhos)
+    assert segunda.status_code == 202
+    assert segunda.get_json()['lote_id'] == primeira.get_json()['lote_id']
+
+    lote = _aguardar(api, aluno, f"/api/professor/analises/lotes/{primeira.get_json()['lote_id']}", _lote_terminado)
+    assert (lote['total'], lote['concluidos']) == (2, 2)
+    # Terminado o lote, as análises vêm do cache
+    terceira = client.post(url, headers=cabecalhos)
+    assert terceira.status_code == 200
+    assert terceira.get_json()['lote_id'] != primeira.get_json()['lote_id']
+
+def test_lote_sem_vagas_para_todos_os_jobs_responde_503(app, api, client, novo_aluno, monkeypatch):
+    aluno = novo_aluno()
+    _com_tentativas(api, aluno, 'colega-lote-cheio@teste')
+    monkeypatch.setattr(ia.servico_analises, 'max_pendentes', 1)
+
+    resposta = client.post(f'/api/professor/salas/{aluno.sala_id}/trilhas/{aluno.trilha_id}/analise-ia',
+                           headers={'Authorization': f'Bearer {aluno.token_professor}'})
+    assert resposta.status_code == 503
+    assert resposta.headers['Retry-After'] == '10'
+    with app.app_context():
+        assert db.session.query(JobAnaliseIA).filter_by(aluno_id=aluno.aluno_id).count() == 0
+    assert ia.servico_analises._pendentes == 0
+
+def test_prazo_do_job_na_fila_conta_da_sua_vez_e_depois_do_inicio(app, api, client, novo_aluno, monkeypatch):
+    aluno = novo_aluno()
+    _com_tentativas(api, aluno, 'colega-prazo-1@teste', 'colega-prazo-2@teste')
+    monkeypatch.setattr(ia.servico_analises, 'max_simultaneos_sala', 1)
+    # Sem executar: os jobs ficam na fila do lote
+    monkeypatch.setattr(ia.servico_analises, '_executar_lote', lambda fila: ia.servico_analises._liberar(len(fila)))
+
+    resposta = client.post(f'/api/professor/salas/{aluno.sala_id}/trilhas/{aluno.trilha_id}/analise-ia',
+                           headers={'Authorization': f'Bearer {aluno.token_professor}'})
+    assert resposta.status_code == 202, resposta.get_json()
+    with app.app_context():
+        jobs = db.session.query(JobAnaliseIA).filter_by(lote_id=resposta.get_json()['lote_id']).order_by(JobAnaliseIA.prazo_em).all()
+        tempo_limite = timedelta(seconds=ia.servico_analises.tempo_limite)
+        # Um executor para o lote: cada job espera os anteriores
+        assert [job.prazo_em - job.criado_em for job in jobs] == [tempo_limite, 2 * tempo_limite, 3 * tempo_limite]
+
+        # Criado há mais que o tempo limite, mas ainda na sua vez: não é dado como 'erro'
+        ultimo = jobs[-1]
+        ultimo.criado_em -= tempo_limite * 1.5
+        assert ia.servico_analises.situacao(ultimo)[0] == 'pendente'
+
+        # Executando: o prazo passa a contar do início
+        prazos = []
+        def gerar(prompt):
+            prazos.append(ultimo.prazo_em - datetime.utcnow())
+            return '{}'
+        monkeypatch.setattr(ia.servico_analises, 'gerar', gerar)
+        ia.servico_analises._processar(ultimo.id)
+        assert ultimo.status == 'concluido'
+        assert tempo_limite - timedelta(seconds=5) < prazos[0] <= tempo_limite
+
+def _url_analise(aluno, sufixo=''):
+    return f'/api/professor/alunos/{aluno.aluno_id}/historico/trilha/{aluno.trilha_id}/analise-ia{sufixo}'
+
+def test_job_de_analise_ate_concluir_e_depois_do_cache(api, client, novo_aluno):
+    aluno = novo_aluno()
+    _com_tentativas(api, aluno)
+    cabecalhos = {'Authorization': f'Bearer {aluno.token_professor}'}
+
+    resposta = client.post(_url_analise(aluno, '/jobs'), headers=cabecalhos)
+    assert resposta.status_code == 202, resposta.get_json()
+    job = resposta.get_json()
+    assert job['status'] in ('pendente', 'executando', 'concluido')
+    assert resposta.headers['Location'] == f"/api/professor/analises/{job['job_id']}"
+
+    job = _aguardar(api, aluno, resposta.headers['Location'], lambda dados: dados['status'] not in ('pendente', 'executando'))
+    assert job['status'] == 'concluido', job
+    assert job['analise_ia'] and job['prompt_tokens']
+
+    # Sem tentativa nova: a análise sai do cache na hora
+    resposta = client.get(_url_analise(aluno), headers=cabecalhos)
+    assert resposta.status_code == 200
+    assert resposta.get_json() == {'analise_ia': job['analise_ia'], 'em_cache': True}
+
+def test_job_com_a_fila_cheia_responde_503(api, client, novo_aluno, monkeypatch):
+    aluno = novo_aluno()
+    _com_tentativas(api, aluno)
+    monkeypatch.setattr(ia.servico_analises, 'max_pendentes', 0)
+
+    resposta = client.get(_url_analise(aluno), headers={'Authorization': f'Bearer {aluno.token_professor}'})
+    assert resposta.status_code == 503
+    assert resposta.headers['Retry-After'] == '10'
+
+def _eventos_sse(resposta):
+    eventos = []
+    for bloco in resposta.get_data(as_text=True).strip().split('\n\n'):
+        evento, dados = bloco.split('\n')
+        eventos.append((evento[len('event: '):], json.loads(dados[len('data: '):])))
+    return eventos
+
+def test_stream_entrega_as_partes_e_depois_usa_o_cache(api, client, novo_aluno, atraso_do_modelo):
+    aluno = novo_aluno()
+    _com_tentativas(api, aluno)
+    atraso_do_modelo(0.08)
+    cabecalhos = {'Authorization': f'Bearer {aluno.token_professor}'}
+
+    resposta = client.get(_url_analise(aluno, '/stream'), headers=cabecalhos)
+    assert resposta.status_code == 200
+    assert resposta.mimetype == 'text/event-stream'
+    eventos = _eventos_sse(resposta)
+    assert [evento for evento, _ in eventos] == ['parte'] * ia.ModeloLocal.PARTES + ['fim']
+    assert eventos[-1][1]['em_cache'] is False
+    analise = ''.join(dados['texto'] for evento, dados in eventos[:-1])
+    assert json.loads(analise)['resumo_geral']
+
+    resposta = client.get(_url_analise(aluno, '/stream'), headers=cabecalhos)
+    assert _eventos_sse(resposta) == [('parte', {'texto': analise}), ('fim', {'em_cache': True})]
+
+def test_stream_com_falha_do_modelo_envia_evento_de_erro(api, client, novo_aluno, monkeypatch):
+    aluno = novo_aluno()
+    _com_tentativas(api, aluno)
+
+    def gerar_em_partes(prompt):
+        yield 'começo'
+        raise TimeoutError("Tempo limite da chamada ao modelo excedido.")
+    monkeypatch.setattr(ia.servico_analises, 'gerar_em_partes', gerar_em_partes)
+
+    resposta = client.get(_url_analise(aluno, '/stream'), headers={'Authorization': f'Bearer {aluno.token_professor}'})
+    eventos = _eventos_sse(resposta)
+    assert [evento for evento, _ in eventos] == ['parte', 'erro']
+    assert 'Tempo limite' in eventos[-1][1]['message']
+    # Nada vai para o cache: a próxima consulta gera de novo
+    monkeypatch.undo()
+    resposta = client.get(_url_analise(aluno), headers={'Authorization': f'Bearer {aluno.token_professor}'})
+    assert resposta.status_code == 202
@@ -0,0 +1,6 @@
+# Validação da rota de login
+
+def test_login_recusa_email_ou_senha_que_nao_sao_texto(client):
+    for dados in ({'email': 123, 'senha': 'x'}, {'email': 'a@teste', 'senha': ['x']}):
+        resposta = client.post('/api/auth/login', json=dados)
+        assert resposta.status_code == 400, resposta.get_json()
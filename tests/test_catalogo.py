@@ -0,0 +1,22 @@
+# Catálogo em memória após alterações do admin
+from catalogo import catalogo
+
+def test_falha_ao_recarregar_nao_derruba_alteracao_gravada(api, client, monkeypatch):
+    montar = catalogo._montar
+    falhas = [RuntimeError("banco indisponível")]
+
+    def montar_com_falha():
+        if falhas:
+            raise falhas.pop()
+        return montar()
+    monkeypatch.setattr(catalogo, '_montar', montar_com_falha)
+
+    resposta = client.post('/api/admin/trilhas', json={'nome': 'Trilha recarga', 'descricao': 'd'},
+                           headers={'Authorization': f'Bearer {api.admin}'})
+    assert resposta.status_code == 201, resposta.get_json()
+    assert not falhas # a recarga foi tentada e falhou
+
+    # A próxima leitura remonta o catálogo com a trilha nova
+    trilha_id = resposta.get_json()['trilha']['id']
+    with client.application.app_context():
+        assert trilha_id in catalogo.atual().trilhas
@@ -0,0 +1,50 @@
+# Número de consultas SQL das rotas de leitura: não pode crescer com o tamanho dos dados
+import itertools
+
+_emails = itertools.count(1)
+
+def _aluno_com_trilhas(api, novo_professor, nova_trilha, trilhas, jogos):
+    token_professor = novo_professor()
+    trilhas_ids = [nova_trilha(jogos) for _ in range(trilhas)]
+    sala_id = api.post('/api/professor/salas', token_professor, nome='Sala', trilhas_ids=trilhas_ids)['sala']['id']
+    email = f'aluno{next(_emails)}@teste'
+    api.post(f'/api/professor/salas/{sala_id}/alunos', token_professor, nome='Aluno', email=email, senha='aluno')
+    return api.login(email, 'aluno')
+
+def test_me_completo_consultas_constantes(api, novo_professor, nova_trilha, contador_consultas):
+    pequeno = _aluno_com_trilhas(api, novo_professor, nova_trilha, trilhas=1, jogos=1)
+    grande = _aluno_com_trilhas(api, novo_professor, nova_trilha, trilhas=5, jogos=10)
+
+    api.get('/api/aluno/me', pequeno) # aquece caches (catálogo, escopo do token) fora da contagem
+    resposta_pequeno, consultas_pequeno = contador_consultas(lambda: api.get('/api/aluno/me', pequeno))
+    resposta_grande, consultas_grande = contador_consultas(lambda: api.get('/api/aluno/me', grande))
+
+    assert resposta_pequeno.status_code == 200
+    assert resposta_grande.status_code == 200
+    assert [len(trilha['jogos']) for trilha in resposta_pequeno.get_json()['trilhas']] == [1]
+    assert [len(trilha['jogos']) for trilha in resposta_grande.get_json()['trilhas']] == [10] * 5
+    assert consultas_grande == consultas_pequeno, (consultas_pequeno, consultas_grande)
+
+def _professor_com_salas(api, novo_professor, nova_trilha, salas, alunos):
+    token_professor = novo_professor()
+    trilha_id = nova_trilha(1)
+    for numero_sala in range(salas):
+        sala_id = api.post('/api/professor/salas', token_professor, nome=f'Sala {numero_sala}', trilhas_ids=[trilha_id])['sala']['id']
+        for _ in range(alunos):
+            api.post(f'/api/professor/salas/{sala_id}/alunos', token_professor,
+                     nome='Aluno', email=f'aluno{next(_emails)}@teste', senha='aluno')
+    return token_professor
+
+def test_salas_do_professor_consultas_constantes(api, novo_professor, nova_trilha, contador_consultas):
+    pequeno = _professor_com_salas(api, novo_professor, nova_trilha, salas=1, alunos=1)
+    grande = _professor_com_salas(api, novo_professor, nova_trilha, salas=5, alunos=10)
+
+    api.get('/api/professor/salas', pequeno) # aquece caches fora da contagem
+    resposta_pequeno, consultas_pequeno = contador_consultas(lambda: api.get('/api/professor/salas', pequeno))
+    resposta_grande, consultas_grande = contador_consultas(lambda: api.get('/api/professor/salas', grande))
+
+    assert resposta_pequeno.status_code == 200
+    assert resposta_grande.status_code == 200
+    assert [sala['contagem_alunos'] for sala in resposta_pequeno.get_json()] == [1]
+    assert [sala['contagem_alunos'] for sala in resposta_grande.get_json()] == [10] * 5
+    assert consultas_grande == consultas_pequeno, (consultas_pequeno, consultas_grande)
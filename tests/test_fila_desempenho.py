@@ -0,0 +1,104 @@
+# Escrita adiada dos desempenhos (DESEMPENHO_WRITE_BEHIND): journal local drenado para o banco
+import glob
+import json
+import os
+import pytest
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError, OperationalError
+import fila_desempenho as modulo_fila
+from models import db, DesempenhoJogo
+
+def _linhas_do_aluno(app, aluno_id):
+    with app.app_context():
+        return db.session.query(DesempenhoJogo).filter_by(aluno_id=aluno_id).count()
+
+def _mapa(client, aluno):
+    resposta = client.get(f'/api/aluno/trilhas/{aluno.trilha_id}/progressao', headers=aluno.headers)
+    assert resposta.status_code == 200, resposta.get_json()
+    return [jogo['status'] for jogo in resposta.get_json()['mapa_jogos']]
+
+def _tentativa(aluno, jogo_id, passou=True):
+    return {'jogo_id': jogo_id, 'trilha_id': aluno.trilha_id, 'passou': passou, 'acertos': ['3x4'], 'erros': [],
+            'data_hora': datetime.utcnow()}
+
+def test_tentativa_aceita_visivel_e_gravada_no_dreno(app, client, novo_aluno, escrita_adiada):
+    aluno = novo_aluno()
+    resposta = client.post('/api/aluno/desempenho', headers=aluno.headers,
+                           json={'jogo_id': aluno.jogos_ids[0], 'trilha_id': aluno.trilha_id, 'passou': True})
+    assert resposta.status_code == 202, resposta.get_json()
+
+    # Ainda no journal: o mapa do aluno já considera a tentativa
+    assert _linhas_do_aluno(app, aluno.aluno_id) == 0
+    assert _mapa(client, aluno) == ['concluido', 'liberado', 'bloqueado']
+
+    assert escrita_adiada.drenar() == 1
+    assert _linhas_do_aluno(app, aluno.aluno_id) == 1
+    assert _mapa(client, aluno) == ['concluido', 'liberado', 'bloqueado']
+    assert glob.glob(os.path.join(escrita_adiada.diretorio, '*')) == []
+
+def test_tentativa_recusada_pelo_banco_vai_para_rejeitados(app, novo_aluno, escrita_adiada):
+    aluno = novo_aluno()
+    recusada = _tentativa(aluno, aluno.jogos_ids[1], passou=None) # passou NOT NULL: IntegrityError
+    escrita_adiada.enfileirar(aluno.aluno_id, aluno.sala_id, [_tentativa(aluno, aluno.jogos_ids[0]), recusada,
+                                                              _tentativa(aluno, aluno.jogos_ids[2], passou=False)])
+
+    escrita_adiada.drenar()
+
+    assert _linhas_do_aluno(app, aluno.aluno_id) == 2
+    rejeitados = glob.glob(os.path.join(escrita_adiada.diretorio, '*.rejeitados'))
+    assert len(rejeitados) == 1
+    with open(rejeitados[0], encoding='utf-8') as arquivo:
+        linhas = [json.loads(linha) for linha in arquivo]
+    assert [(linha['jogo_id'], linha['passou']) for linha in linhas] == [(aluno.jogos_ids[1], None)]
+    assert glob.glob(os.path.join(escrita_adiada.diretorio, '*.drenando')) == []
+
+def test_falha_transitoria_mantem_o_journal_para_o_proximo_ciclo(app, novo_aluno, escrita_adiada, monkeypatch):
+    aluno = novo_aluno()
+    escrita_adiada.enfileirar(aluno.aluno_id, aluno.sala_id, [_tentativa(aluno, jogo_id) for jogo_id in aluno.jogos_ids])
+
+    inserir = modulo_fila.inserir_desempenhos
+    def banco_fora_do_ar(*args, **kwargs):
+        raise OperationalError('INSERT INTO desempenho_jogo', {}, Exception('Lost connection to server'))
+    monkeypatch.setattr(modulo_fila, 'inserir_desempenhos', banco_fora_do_ar)
+    with pytest.raises(OperationalError):
+        escrita_adiada.drenar()
+
+    assert _linhas_do_aluno(app, aluno.aluno_id) == 0
+    assert len(glob.glob(os.path.join(escrita_adiada.diretorio, '*.drenando'))) == 1
+    assert glob.glob(os.path.join(escrita_adiada.diretorio, '*.rejeitados')) == []
+
+    monkeypatch.setattr(modulo_fila, 'inserir_desempenhos', inserir)
+    assert escrita_adiada.drenar() == 3
+    assert _linhas_do_aluno(app, aluno.aluno_id) == 3
+
+def test_falha_transitoria_no_meio_da_gravacao_uma_a_uma_nao_duplica(app, novo_aluno, escrita_adiada, monkeypatch):
+    aluno = novo_aluno()
+    escrita_adiada.enfileirar(aluno.aluno_id, aluno.sala_id, [_tentativa(aluno, jogo_id) for jogo_id in aluno.jogos_ids])
+
+    # Lote recusado, primeira tentativa gravada, banco cai na segunda
+    inserir = modulo_fila.inserir_desempenhos
+    erros = [IntegrityError('INSERT', {}, Exception('lote')), None, OperationalError('INSERT', {}, Exception('lock wait timeout'))]
+    def inserir_com_falhas(*args, **kwargs):
+        erro = erros.pop(0) if erros else None
+        if erro:
+            raise erro
+        return inserir(*args, **kwargs)
+    monkeypatch.setattr(modulo_fila, 'inserir_desempenhos', inserir_com_falhas)
+    with pytest.raises(OperationalError):
+        escrita_adiada.drenar()
+    assert _linhas_do_aluno(app, aluno.aluno_id) == 1
+
+    assert escrita_adiada.drenar() == 2
+    assert _linhas_do_aluno(app, aluno.aluno_id) == 3
+
+def test_journal_orfao_de_processo_morto_e_assumido(app, novo_aluno, escrita_adiada):
+    aluno = novo_aluno()
+    pid_morto = next(pid for pid in range(4194000, 4000000, -1) if not modulo_fila._processo_vivo(pid))
+    entrada = dict(_tentativa(aluno, aluno.jogos_ids[0]), aluno_id=aluno.aluno_id, sala_id=aluno.sala_id, chave='orfao')
+    caminho = os.path.join(escrita_adiada.diretorio, f'desempenho-{pid_morto}-1.drenando')
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        arquivo.write(modulo_fila._serializar(entrada) + '\n')
+
+    assert escrita_adiada.drenar() == 1
+    assert _linhas_do_aluno(app, aluno.aluno_id) == 1
+    assert not os.path.exists(caminho)
@@ -0,0 +1,86 @@
+# Idempotency-Key nas rotas de desempenho: o reenvio recebe a resposta original e não grava de novo
+import glob
+import os
+from datetime import datetime
+from models import db, DesempenhoJogo, ChaveIdempotencia
+from idempotencia import idempotencia
+
+def _linhas_do_aluno(app, aluno_id):
+    with app.app_context():
+        return db.session.query(DesempenhoJogo).filter_by(aluno_id=aluno_id).count()
+
+def _enviar(client, aluno, url, dados, chave):
+    return client.post(url, json=dados, headers=dict(aluno.headers, **{'Idempotency-Key': chave}))
+
+def test_reenvio_recebe_a_resposta_original_sem_gravar_de_novo(app, client, novo_aluno):
+    aluno = novo_aluno()
+    dados = {'jogo_id': aluno.jogos_ids[0], 'trilha_id': aluno.trilha_id, 'passou': True}
+
+    primeira = _enviar(client, aluno, '/api/aluno/desempenho', dados, 'tentativa-1')
+    assert primeira.status_code == 201, primeira.get_json()
+
+    # Sem o cache em memória (outro worker): a resposta vem da tabela de chaves
+    idempotencia._respostas.clear()
+    reenvio = _enviar(client, aluno, '/api/aluno/desempenho', dados, 'tentativa-1')
+    assert reenvio.status_code == 201
+    assert reenvio.get_json() == primeira.get_json()
+    assert _linhas_do_aluno(app, aluno.aluno_id) == 1
+
+def test_chave_invalida(client, novo_aluno):
+    aluno = novo_aluno()
+    dados = {'jogo_id': aluno.jogos_ids[0], 'trilha_id': aluno.trilha_id, 'passou': True}
+    for chave in ('x' * 65, ''):
+        resposta = _enviar(client, aluno, '/api/aluno/desempenho', dados, chave)
+        assert resposta.status_code == 400, chave
+        resposta = _enviar(client, aluno, '/api/aluno/desempenho/batch', [dados], chave)
+        assert resposta.status_code == 400, chave
+
+def test_reenvio_do_lote(app, client, novo_aluno):
+    aluno = novo_aluno()
+    dados = {'tentativas': [{'jogo_id': jogo_id, 'trilha_id': aluno.trilha_id, 'passou': True} for jogo_id in aluno.jogos_ids]
+             + [{'jogo_id': aluno.jogos_ids[0], 'trilha_id': aluno.trilha_id}]} # inválida: sem 'passou'
+
+    primeira = _enviar(client, aluno, '/api/aluno/desempenho/batch', dados, 'lote-1')
+    assert primeira.status_code == 200, primeira.get_json()
+    assert (primeira.get_json()['salvos'], primeira.get_json()['rejeitados']) == (3, 1)
+
+    reenvio = _enviar(client, aluno, '/api/aluno/desempenho/batch', dados, 'lote-1')
+    assert reenvio.status_code == 200
+    assert reenvio.get_json() == primeira.get_json()
+    assert _linhas_do_aluno(app, aluno.aluno_id) == 3
+
+def test_reenvio_com_escrita_adiada_antes_e_depois_do_dreno(app, client, novo_aluno, escrita_adiada):
+    aluno = novo_aluno()
+    dados = {'jogo_id': aluno.jogos_ids[0], 'trilha_id': aluno.trilha_id, 'passou': True}
+
+    primeira = _enviar(client, aluno, '/api/aluno/desempenho', dados, 'adiada-1')
+    assert primeira.status_code == 202, primeira.get_json()
+
+    # Ainda no journal e fora do cache em memória: a resposta vem do journal (resposta_pendente)
+    idempotencia._respostas.clear()
+    reenvio = _enviar(client, aluno, '/api/aluno/desempenho', dados, 'adiada-1')
+    assert reenvio.status_code == 202
+    assert reenvio.get_json() == primeira.get_json()
+
+    escrita_adiada.drenar()
+    idempotencia._respostas.clear()
+    reenvio = _enviar(client, aluno, '/api/aluno/desempenho', dados, 'adiada-1')
+    assert reenvio.status_code == 202
+    assert reenvio.get_json() == primeira.get_json()
+    assert _linhas_do_aluno(app, aluno.aluno_id) == 1
+
+def test_envios_simultaneos_com_a_mesma_chave_gravam_uma_vez(app, novo_aluno, escrita_adiada):
+    aluno = novo_aluno()
+    # Duas requisições com a mesma chave que não viram a resposta uma da outra: ambas vão ao journal
+    for _ in range(2):
+        tentativas = [{'jogo_id': jogo_id, 'trilha_id': aluno.trilha_id, 'passou': True, 'acertos': [], 'erros': [],
+                       'data_hora': datetime.utcnow()} for jogo_id in aluno.jogos_ids[:2]]
+        escrita_adiada.enfileirar(aluno.aluno_id, aluno.sala_id, tentativas, 'simultanea-1',
+                                  ({'salvos': 2}, 202))
+
+    escrita_adiada.drenar()
+
+    assert _linhas_do_aluno(app, aluno.aluno_id) == 2
+    with app.app_context():
+        assert db.session.query(ChaveIdempotencia).filter_by(aluno_id=aluno.aluno_id).count() == 1
+    assert glob.glob(os.path.join(escrita_adiada.diretorio, '*.rejeitados')) == []